@@ -11,6 +11,10 @@
 module use /apps/leuven/common/modules/all
 module load vsc-python-irodsclient/development
 
+# Start an agent which keeps an iRODS session alive, so that
+# the following commands do not each need to set up a new session
+vsc-prc-agent --daemon --idle-time=300
+
 # Next, create an iRODS collection with data for this example
 # In regular workflows, such a collection will already exist
 tmpdir="~/.irodstest"
@@ -24,23 +28,31 @@ scratchdir=$VSC_SCRATCH/$PBS_JOBID
 mkdir $scratchdir
 cd $scratchdir
 
-# Get sample input files from iRODS
-vsc-prc-iget "$tmpdir/molecules/*.xyz" --destination="." --verbose
+# Start staging in the sample input files from iRODS; this returns
+# at once, while the files are downloaded in the background
+vsc-prc-stage "$tmpdir/molecules/*.xyz" --destination="." --verbose
+filenames=`vsc-prc-find "$tmpdir/molecules" --name="*.xyz" --types=f`
+
+# Upload the output files to iRODS (with job metadata) in the
+# background, as soon as they have not been modified for 10 seconds
+vsc-prc-watch-put . --destination="$tmpdir/molecules" --name="*.out" \
+                  --quiet=10 --job-metadata --verbose &
+watch_pid=$!
 
-# Do something with these files; to keep this example very simple,
-# we will just write the output of 'wc -l' of each <molecule>.xyz
-# to a file <molecule>.out
-filenames=`find . -name "*.xyz"`
+# Do something with these files as soon as they have arrived; to keep
+# this example very simple, we will just write the output of 'wc -l'
+# of each <molecule>.xyz to a file <molecule>.out
 for filename in $filenames; do
-  name=$(basename "$filename" | cut -f 1 -d '.')
+  filename=$(basename "$filename")
+  vsc-prc-stage --wait $filename --destination="."
+  name=$(echo "$filename" | cut -f 1 -d '.')
   wc -l $filename > $name".out"
 done
+vsc-prc-stage --join --destination="."
 
-# Upload the output files to iRODS
-vsc-prc-iput *.out --destination="$tmpdir/molecules" --verbose
-
-# Add job metadata to these output files
-vsc-prc-add-job-metadata "$tmpdir/molecules/*.out" --verbose
+# Stop the uploads, which first uploads the remaining output files
+kill $watch_pid
+wait $watch_pid
 
 # Remove the scratch directory
 cd; rm -r $scratchdir
@@ -48,3 +60,6 @@ cd; rm -r $scratchdir
 # Remove the iRODS collection for this example
 # In regular workflows, this should not be done
 vsc-prc-irm -r $tmpdir --verbose
+
+# Stop the agent
+vsc-prc-agent --stop
@@ -0,0 +1,570 @@
+import os
+import json
+import stat
+import time
+import socket
+import struct
+import inspect
+import builtins
+import tempfile
+import threading
+import functools
+from vsc_irods.cache import DownloadCache
+from vsc_irods.journal import TransferJournal
+from vsc_irods.session import VSCiRODSSession
+from vsc_irods.manager.bulk_manager import BulkOperationError
+
+
+managers = ['path', 'search', 'bulk']
+
+
+class AgentError(Exception):
+    """ Raised for errors in operations carried out by an agent
+    which do not correspond to a built-in exception type.
+    """
+    pass
+
+
+def default_socket_path():
+    """ Returns the path to the Unix socket of the agent of the current
+    user, which can be set with the VSC_PRC_AGENT_SOCKET environment
+    variable and otherwise resides in $XDG_RUNTIME_DIR (if defined)
+    or in a per-user subdirectory of the temporary directory of the node.
+    In all cases, the directory of the socket needs to be private
+    (see :func:`check_private_directory`).
+    """
+    try:
+        return os.environ['VSC_PRC_AGENT_SOCKET']
+    except KeyError:
+        pass
+
+    directory = os.environ.get('XDG_RUNTIME_DIR')
+    if directory:
+        return os.path.join(directory, 'vsc-prc-agent-%d.sock' % os.getuid())
+
+    directory = os.path.join(tempfile.gettempdir(),
+                             'vsc-prc-agent-%d' % os.getuid())
+    return os.path.join(directory, 'agent.sock')
+
+
+def check_private_directory(directory):
+    """ Raises a PermissionError unless the given directory belongs to
+    the current user and is not accessible to other users (so that
+    nobody else can put a socket in it). Symbolic links are refused.
+    """
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or \
+       info.st_mode & 0o077:
+        raise PermissionError('%s is not a private directory of the '
+                              'current user' % directory)
+
+
+def _peer_uid(connection):
+    # Returns the user ID of the process at the other end of the given
+    # Unix socket connection, or None if it cannot be determined
+    try:
+        size = struct.calcsize('3i')
+        credentials = connection.getsockopt(socket.SOL_SOCKET,
+                                            socket.SO_PEERCRED, size)
+    except (AttributeError, OSError):
+        return None
+
+    pid, uid, gid = struct.unpack('3i', credentials)
+    return uid
+
+
+def _connect(socket_path):
+    # Connects to the agent on the given socket, after checking that
+    # both the socket and the agent belong to the current user
+    check_private_directory(os.path.dirname(os.path.abspath(socket_path)))
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+        if _peer_uid(connection) != os.getuid():
+            raise PermissionError('The agent on %s does not belong to '
+                                  'the current user' % socket_path)
+    except OSError:
+        connection.close()
+        raise
+    return connection
+
+
+def environment_file():
+    """ Returns the path to the irods_environment.json file
+    (as used by VSCiRODSSession)
+    """
+    try:
+        return os.environ['IRODS_ENVIRONMENT_FILE']
+    except KeyError:
+        return os.path.expanduser('~/.irods/irods_environment.json')
+
+
+def _encode(value):
+    # Converts the given value to something which can be sent as JSON
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    elif isinstance(value, tuple):
+        return {'__tuple__': [_encode(v) for v in value]}
+    elif isinstance(value, list):
+        return [_encode(v) for v in value]
+    elif isinstance(value, dict):
+        return {str(k): _encode(v) for k, v in value.items()}
+    elif isinstance(value, TransferJournal):
+        return {'__journal__': value.filename}
+    elif isinstance(value, DownloadCache):
+        return {'__cache__': [value.directory, value.max_size, value.link]}
+    raise TypeError('Cannot pass %r through the agent' % (value,))
+
+
+def _decode(value, opened):
+    # Reverts _encode(), appending any opened journals to the given list
+    if isinstance(value, list):
+        return [_decode(v, opened) for v in value]
+    elif not isinstance(value, dict):
+        return value
+    elif '__tuple__' in value:
+        return tuple([_decode(v, opened) for v in value['__tuple__']])
+    elif '__journal__' in value:
+        # The client already created (or truncated) the journal file
+        journal = TransferJournal(value['__journal__'], resume=True)
+        opened.append(journal)
+        return journal
+    elif '__cache__' in value:
+        return DownloadCache(*value['__cache__'])
+    return {k: _decode(v, opened) for k, v in value.items()}
+
+
+def _send(connection, message):
+    connection.sendall((json.dumps(message) + '\n').encode())
+
+
+def _exception(name, message):
+    # Recreates the exception raised by the agent, where possible
+    if name == BulkOperationError.__name__:
+        # Only the message is passed on, not the individual failures
+        error = Exception.__new__(BulkOperationError)
+        Exception.__init__(error, message)
+        error.failures = []
+        return error
+
+    cls = getattr(builtins, name, None)
+    if isinstance(cls, type) and issubclass(cls, Exception):
+        return cls(message)
+
+    return AgentError('%s: %s' % (name, message))
+
+
+def control(command, socket_path=None):
+    """ Sends a 'status' or 'stop' command to the agent and returns
+    its reply (a dictionary), or None if no agent is listening.
+
+    Arguments:
+
+    command: str
+        The command ('status' or 'stop')
+
+    socket_path: None or str (default: None)
+        The path to the Unix socket of the agent
+        (None means :func:`default_socket_path`)
+    """
+    socket_path = socket_path or default_socket_path()
+
+    try:
+        with _connect(socket_path) as connection:
+            _send(connection, {'control': command})
+            with connection.makefile('rb') as rfile:
+                line = rfile.readline()
+    except OSError:
+        return None
+
+    return json.loads(line)['value'] if line else None
+
+
+class _LogWriter:
+    # File-like object which forwards the log output of an operation
+    # to the client, where the lock keeps the messages of concurrent
+    # threads (e.g. bulk workers) from interleaving on the connection
+    def __init__(self, connection):
+        self.connection = connection
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        with self.lock:
+            _send(self.connection, message)
+
+    def write(self, text):
+        self.send({'log': text})
+
+    def flush(self):
+        pass
+
+
+class Agent:
+    """ A per-user process which keeps an authenticated VSCiRODSSession
+    (and its pool of connections) alive, and carries out operations
+    on behalf of the command line scripts, which thereby avoid the
+    set-up of a new session (SSL context, authentication, ...)
+    for every command. See :func:`connect` and :class:`AgentSession`.
+
+    The agent listens on a Unix socket in a directory which is only
+    accessible to the user, only serves clients of the same user (and
+    clients only talk to an agent of the same user), and exits when it
+    has been idle for the given time. Operations are carried out one at
+    a time, in the working directory and with the environment variables
+    and umask of the client. When the agent is busy, clients fall back
+    to a session of their own. The lookup cache of the session (see
+    :class:`vsc_irods.lookup.LookupCache`) is emptied before every
+    operation, so that changes made in between by other clients are
+    always seen.
+
+    Example:
+
+    >>> Agent(idle_time=1800).serve()
+
+    Arguments:
+
+    socket_path: None or str (default: None)
+        The path to the Unix socket
+        (None means :func:`default_socket_path`)
+
+    idle_time: None or float (default: 600)
+        The number of seconds without any operation after which
+        the agent exits (None meaning never)
+
+    session: None or VSCiRODSSession (default: None)
+        The session to use (None means that a new one is created,
+        and cleaned up when the agent exits)
+    """
+    def __init__(self, socket_path=None, idle_time=600, session=None):
+        self.socket_path = socket_path or default_socket_path()
+        self.idle_time = idle_time
+        self.session = session
+        self.lock = threading.Lock()
+        self.stopping = False
+        self.started = time.time()
+        self.last_used = time.time()
+        self.served = 0
+
+    def serve(self):
+        """ Listens for operations until the agent is idle
+        for too long or gets stopped.
+        """
+        directory = os.path.dirname(os.path.abspath(self.socket_path))
+        try:
+            os.mkdir(directory, 0o700)
+        except FileExistsError:
+            pass
+        check_private_directory(directory)
+
+        if control('status', self.socket_path) is not None:
+            raise RuntimeError('An agent is already listening on %s' %
+                               self.socket_path)
+
+        own_session = self.session is None
+        if own_session:
+            self.session = VSCiRODSSession(txt=None)
+
+        # Open (and authenticate) a first connection
+        self.icwd = self.session.path.get_irods_cwd()
+        self.session.collections.get(self.icwd)
+        self.environment_file = environment_file()
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            os.remove(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+        umask = os.umask(0o077)
+        try:
+            server.bind(self.socket_path)
+        finally:
+            os.umask(umask)
+
+        server.listen(16)
+        server.settimeout(1.)
+
+        try:
+            while not self.stopping:
+                try:
+                    connection, _ = server.accept()
+                except socket.timeout:
+                    if self.idle_time is not None and \
+                       not self.lock.locked() and \
+                       time.time() - self.last_used > self.idle_time:
+                        break
+                    continue
+
+                connection.settimeout(None)
+                thread = threading.Thread(target=self._handle,
+                                          args=(connection,), daemon=True)
+                thread.start()
+        finally:
+            server.close()
+            try:
+                os.remove(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+            if own_session:
+                self.session.cleanup()
+
+    def _same_user(self, connection):
+        # Checks the credentials of the client, refusing clients
+        # whose credentials cannot be read
+        return _peer_uid(connection) == os.getuid()
+
+    def _handle(self, connection):
+        # Handles one request
+        try:
+            with connection, connection.makefile('rb') as rfile:
+                if not self._same_user(connection):
+                    return
+
+                line = rfile.readline()
+                if not line:
+                    return
+                request = json.loads(line)
+
+                if 'control' in request:
+                    _send(connection, {'value': self._control(request)})
+                elif request.get('environment_file') != \
+                     self.environment_file:
+                    _send(connection, {'status': 'refused'})
+                elif not self.lock.acquire(blocking=False):
+                    _send(connection, {'status': 'busy'})
+                else:
+                    try:
+                        self.served += 1
+                        _send(connection, {'status': 'accepted'})
+                        self._run(connection, request)
+                    finally:
+                        self.last_used = time.time()
+                        self.lock.release()
+        except (OSError, ValueError):
+            # E.g. when the client has been interrupted
+            pass
+
+    def _control(self, request):
+        # Carries out a 'status' or 'stop' command
+        if request['control'] == 'stop':
+            self.stopping = True
+
+        return {'pid': os.getpid(), 'socket': self.socket_path,
+                'uptime': time.time() - self.started,
+                'idle': 0. if self.lock.locked() else
+                        time.time() - self.last_used,
+                'served': self.served, 'stopping': self.stopping}
+
+    def _run(self, connection, request):
+        # Carries out an operation in the environment of the client
+        cwd, environ = os.getcwd(), dict(os.environ)
+        umask = os.umask(request['umask'])
+        txt = self.session.txt
+        writer = _LogWriter(connection)
+        opened = []
+
+        try:
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(request['environ'])
+            self.session.set_log_output(writer)
+            self.session.lookups.clear()
+            self.session.path.ichdir(self.icwd)
+
+            manager, method = request['method'].split('.')
+            if manager not in managers or method.startswith('_'):
+                raise AttributeError('Unknown operation: %s' %
+                                     request['method'])
+
+            function = getattr(getattr(self.session, manager), method)
+            args = _decode(request['args'], opened)
+            kwargs = _decode(request['kwargs'], opened)
+            result = function(*args, **kwargs)
+
+            if inspect.isgenerator(result):
+                writer.send({'iterator': True})
+                for item in result:
+                    writer.send({'item': _encode(item)})
+                writer.send({'end': True})
+            else:
+                writer.send({'value': _encode(result)})
+        except Exception as e:
+            writer.send({'error': type(e).__name__, 'message': str(e)})
+        finally:
+            for journal in opened:
+                journal.close()
+            self.session.txt = txt
+            os.environ.clear()
+            os.environ.update(environ)
+            os.umask(umask)
+            os.chdir(cwd)
+
+
+class _ManagerProxy:
+    # Stands in for the path, search or bulk manager of an AgentSession
+    def __init__(self, agent_session, name):
+        self.agent_session = agent_session
+        self.name = name
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return functools.partial(self.agent_session.call,
+                                 '%s.%s' % (self.name, method))
+
+
+class AgentSession:
+    """ Offers the path, search and bulk managers of a VSCiRODSSession,
+    but carries out their operations through the agent (see
+    :class:`Agent`). When the agent is busy or not reachable, or when
+    the arguments cannot be passed to it, a session of its own
+    is used instead.
+
+    Note that operations asking for confirmation (interactive=True)
+    should not be carried out through the agent.
+
+    Arguments:
+
+    txt: None or str (default: '-')
+        Where output should be printed
+        (see :class:`vsc_irods.session.VSCiRODSSession`)
+
+    socket_path: None or str (default: None)
+        The path to the Unix socket of the agent
+        (None means :func:`default_socket_path`)
+    """
+    set_log_output = VSCiRODSSession.set_log_output
+
+    def __init__(self, txt='-', socket_path=None):
+        self.socket_path = socket_path or default_socket_path()
+        self.set_log_output(txt)
+        self.session = None
+
+        for name in managers:
+            setattr(self, name, _ManagerProxy(self, name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
+
+    def cleanup(self):
+        """ Cleans up the fallback session, if one has been created """
+        if self.session is not None:
+            self.session.cleanup()
+
+    def _call_directly(self, method, *args, **kwargs):
+        if self.session is None:
+            self.session = VSCiRODSSession(txt=self.txt)
+
+        manager, method = method.split('.')
+        return getattr(getattr(self.session, manager), method)(*args,
+                                                               **kwargs)
+
+    def _receive(self, rfile):
+        # Prints log output until another message arrives
+        while True:
+            line = rfile.readline()
+            if not line:
+                raise AgentError('The agent closed the connection')
+
+            message = json.loads(line)
+            if 'log' not in message:
+                return message
+
+            self.txt.write(message['log'])
+            self.txt.flush()
+
+    def _result(self, message):
+        if 'error' in message:
+            raise _exception(message['error'], message['message'])
+        return _decode(message['value'], [])
+
+    def _iterate(self, connection, rfile):
+        with connection, rfile:
+            while True:
+                message = self._receive(rfile)
+                if 'end' in message:
+                    return
+                elif 'item' in message:
+                    yield _decode(message['item'], [])
+                else:
+                    self._result(message)
+
+    def call(self, method, *args, **kwargs):
+        """ Carries out the given operation (e.g. 'bulk.get')
+        with the given arguments and returns its result.
+        """
+        mask = os.umask(0)
+        os.umask(mask)
+
+        try:
+            request = {'method': method, 'args': _encode(list(args)),
+                       'kwargs': _encode(kwargs), 'cwd': os.getcwd(),
+                       'environ': dict(os.environ), 'umask': mask,
+                       'environment_file': environment_file()}
+        except TypeError:
+            return self._call_directly(method, *args, **kwargs)
+
+        try:
+            connection = _connect(self.socket_path)
+        except OSError:
+            return self._call_directly(method, *args, **kwargs)
+
+        try:
+            _send(connection, request)
+            rfile = connection.makefile('rb')
+            status = self._receive(rfile)
+        except (OSError, AgentError):
+            connection.close()
+            return self._call_directly(method, *args, **kwargs)
+
+        if status.get('status') != 'accepted':
+            rfile.close()
+            connection.close()
+            return self._call_directly(method, *args, **kwargs)
+
+        try:
+            message = self._receive(rfile)
+            if 'iterator' in message:
+                iterator = self._iterate(connection, rfile)
+                connection = None
+                return iterator
+            return self._result(message)
+        finally:
+            if connection is not None:
+                rfile.close()
+                connection.close()
+
+
+def connect(txt='-', agent=True, socket_path=None):
+    """ Returns an :class:`AgentSession` if an agent is listening
+    on the given socket, and a new VSCiRODSSession otherwise.
+
+    Example:
+
+    >>> with connect(txt='-') as session:
+    >>>    session.bulk.get('~/my_irods_collection/*.txt', local_path='.')
+
+    Arguments:
+
+    txt: None or str (default: '-')
+        Where output should be printed
+        (see :class:`vsc_irods.session.VSCiRODSSession`)
+
+    agent: bool (default: True)
+        Whether to use the agent (if listening)
+
+    socket_path: None or str (default: None)
+        The path to the Unix socket of the agent
+        (None means :func:`default_socket_path`)
+    """
+    socket_path = socket_path or default_socket_path()
+
+    if agent and os.path.exists(socket_path):
+        return AgentSession(txt=txt, socket_path=socket_path)
+
+    return VSCiRODSSession(txt=txt)
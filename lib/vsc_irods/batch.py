@@ -0,0 +1,245 @@
+import re
+import json
+import time
+import shlex
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from vsc_irods.manager.bulk_manager import BulkManager
+from vsc_irods.manager.path_manager import PathManager
+from vsc_irods.manager.search_manager import SearchManager
+
+
+aliases = {'get': 'bulk.get', 'put': 'bulk.put', 'remove': 'bulk.remove',
+           'move': 'bulk.move', 'copy': 'bulk.copy', 'metadata': 'bulk.metadata',
+           'add_job_metadata': 'bulk.add_job_metadata', 'size': 'bulk.size',
+           'find': 'search.find', 'glob': 'search.glob',
+           'imkdir': 'path.imkdir', 'ichdir': 'path.ichdir'}
+
+managers = {'path': PathManager, 'search': SearchManager, 'bulk': BulkManager}
+
+barrier = 'wait'
+
+# Operations which affect the following ones (such as a change of the
+# working collection), and which hence act as a barrier on both sides
+exclusive = ['path.ichdir']
+
+
+class BatchOperation:
+    """ An operation in a batch, i.e. a call of a method of the path,
+    search or bulk manager of a session (see :func:`parse_operation`).
+    """
+    def __init__(self, number, name, args=[], kwargs={}):
+        self.number = number
+        self.name = aliases.get(name, name)
+        self.args = list(args)
+        self.kwargs = dict(kwargs)
+
+        manager, _, method = self.name.partition('.')
+        if manager not in managers or not method or method.startswith('_'):
+            raise ValueError('Unknown operation: %s' % name)
+
+    def run(self, session):
+        """ Carries out the operation and returns its result
+        (where iterators are turned into lists)
+        """
+        manager, method = self.name.split('.')
+        function = getattr(getattr(session, manager), method)
+        result = function(*self.args, **self.kwargs)
+
+        if inspect.isgenerator(result):
+            result = list(result)
+        return result
+
+
+def _parse_value(text):
+    # Interprets e.g. 'true', '4' and '["a", "b"]' as JSON, else as a string
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def _expects_json(name, key):
+    # Returns whether the given keyword argument of the given operation
+    # expects something else than a string, according to the type in the
+    # 'Arguments' section of the docstring (e.g. 'min_size: int or None')
+    # or else to the default value (e.g. recurse=False or object_avu=[])
+    manager, _, method = aliases.get(name, name).partition('.')
+    function = getattr(managers.get(manager), method, None)
+    try:
+        default = inspect.signature(function).parameters[key].default
+    except (TypeError, ValueError, KeyError):
+        return False
+
+    pattern = r'^\s+%s: (.+?)(\(default: .*\))?$' % key
+    match = re.search(pattern, function.__doc__ or '', flags=re.MULTILINE)
+    if match:
+        return 'str' not in re.findall(r'\w+', match.group(1))
+
+    return default not in [inspect.Parameter.empty, None] and \
+           not isinstance(default, str)
+
+
+def parse_operation(line, number=0):
+    """ Returns the BatchOperation described by the given line, the
+    barrier string 'wait', or None for empty lines and comments.
+
+    A line can either be a JSON object, with the name of the operation
+    and (optionally) a list of positional and a dictionary of keyword
+    arguments, for example::
+
+        {"op": "get", "args": ["~/data/*.txt"], "kwargs": {"local_path": "."}}
+
+    or a command with shell-like quoting, where 'key=value' words are
+    keyword arguments and the other words positional arguments,
+    for example::
+
+        get '~/data/*.txt' local_path=. recurse=true workers=4
+
+    Positional arguments are always strings. Values of keyword arguments
+    are interpreted as JSON if the argument does not expect a string
+    (e.g. 'recurse=true', 'min_size=1024' or 'object_avu=["a", "b"]'),
+    and are kept as strings otherwise (e.g. 'local_path=2024'). JSON
+    values can also be given explicitly with 'key:=value' words.
+
+    Operations are named after the methods of the path, search and bulk
+    managers of a session (e.g. 'bulk.get' or simply 'get').
+
+    Arguments:
+
+    line: str
+        The line to parse
+
+    number: int (default: 0)
+        The line number, for reporting
+    """
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+
+    if line.startswith('{'):
+        description = json.loads(line)
+        name = description['op']
+        args = description.get('args', [])
+        kwargs = description.get('kwargs', {})
+    else:
+        words = shlex.split(line)
+        name, args, kwargs = words[0], [], {}
+        for word in words[1:]:
+            key, sep, value = word.partition('=')
+            if sep and key.endswith(':') and key[:-1].isidentifier():
+                kwargs[key[:-1]] = json.loads(value)
+            elif sep and key.isidentifier():
+                if _expects_json(name, key):
+                    value = _parse_value(value)
+                kwargs[key] = value
+            else:
+                args.append(word)
+
+    if name == barrier and not args and not kwargs:
+        return barrier
+
+    # JSON has no tuples, but AVUs are expected to be tuples
+    for key in ['collection_avu', 'object_avu']:
+        avu = kwargs.get(key)
+        if isinstance(avu, list) and avu and isinstance(avu[0], str):
+            kwargs[key] = tuple(avu)
+        elif isinstance(avu, list):
+            kwargs[key] = [tuple(a) for a in avu]
+
+    return BatchOperation(number, name, args=args, kwargs=kwargs)
+
+
+def run_batch(session, lines, workers=1, stop_on_error=False):
+    """ Carries out the operations described by the given lines
+    (see :func:`parse_operation`) within the given session, and
+    yields a status dictionary for every operation, in order.
+
+    The operations between two 'wait' lines are considered to be
+    independent, and are carried out concurrently by the given
+    number of worker threads. Changes of the working collection
+    ('ichdir') are always carried out on their own, as if surrounded
+    by 'wait' lines.
+
+    The status dictionaries contain the line number ('line'), the
+    operation ('op'), the status ('ok' or 'failed'), the duration in
+    seconds ('seconds') and, depending on the status, the result
+    ('result') or the error ('error').
+
+    Example:
+
+    >>> lines = ['put data recurse=true', 'wait',
+                 'size data recurse=true', 'find data types=f']
+    >>> for status in run_batch(session, lines, workers=2):
+    >>>     print(status)
+
+    Arguments:
+
+    session: VSCiRODSSession
+        The session in which to carry out the operations
+
+    lines: iterable of str
+        The lines describing the operations
+
+    workers: int (default: 1)
+        The number of operations to carry out concurrently
+
+    stop_on_error: bool (default: False)
+        Whether to stop at the next 'wait' line (or the end)
+        after an operation has failed
+    """
+    def run(operation):
+        if isinstance(operation, dict):
+            # The status of an invalid line
+            return operation
+
+        t0 = time.time()
+        status = {'line': operation.number, 'op': operation.name}
+
+        try:
+            result = operation.run(session)
+        except Exception as e:
+            status.update(status='failed',
+                          error='%s: %s' % (type(e).__name__, e))
+        else:
+            status['status'] = 'ok'
+            if result is not None:
+                status['result'] = result
+
+        status['seconds'] = time.time() - t0
+        return status
+
+    def run_group(group):
+        if workers > 1 and len(group) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                return list(executor.map(run, group))
+        return [run(operation) for operation in group]
+
+    group, failed = [], False
+
+    for number, line in enumerate(lines, start=1):
+        try:
+            operation = parse_operation(line, number=number)
+        except (ValueError, KeyError) as e:
+            group.append({'line': number, 'op': None, 'status': 'failed',
+                          'error': 'Invalid operation: %s' % e,
+                          'seconds': 0.})
+            continue
+
+        if operation is None:
+            continue
+        elif operation == barrier or operation.name in exclusive:
+            groups = [group] if operation == barrier else [group, [operation]]
+            for group in groups:
+                for status in run_group(group):
+                    failed |= status['status'] == 'failed'
+                    yield status
+
+                if failed and stop_on_error:
+                    return
+            group = []
+        else:
+            group.append(operation)
+
+    for status in run_group(group):
+        yield status
@@ -0,0 +1,153 @@
+import os
+import json
+import shutil
+import tarfile
+
+
+# Name of the data object with the member index of a bundled collection
+bundle_index_name = '.vsc-prc-bundles.json'
+
+# Names of the bundles (tar archives) in a bundled collection, given
+# the generation (which increases every time the bundles are replaced,
+# so that the bundles of the current index never get overwritten)
+# and the number of the bundle
+bundle_name = 'bundle-g%d-%05d.tar'
+
+# Number of bytes read or written at once when streaming a bundle
+bundle_buffer_size = 4 * 1024**2
+
+
+def member_size(size):
+    """ Returns the (approximate) number of bytes which a file
+    of the given size takes up in a tar archive
+    """
+    blocks = -(-size // tarfile.BLOCKSIZE)
+    return (blocks + 1) * tarfile.BLOCKSIZE
+
+
+def plan_bundles(files, target_size):
+    """ Splits the given (member name, local file, os.stat_result)
+    tuples in consecutive groups, so that every group (bundle)
+    stays below the given target size in bytes (unless it only
+    holds a single larger file).
+    """
+    bundles = []
+    total = 0
+
+    for name, local_file, local_stat in files:
+        size = member_size(local_stat.st_size)
+        if len(bundles) == 0 or total + size > target_size:
+            bundles.append([])
+            total = 0
+        bundles[-1].append((name, local_file, local_stat))
+        total += size
+
+    return bundles
+
+
+def write_bundle(f, members):
+    """ Writes a tar archive with the given (member name, local file)
+    tuples to the given writable file object (e.g. an opened data
+    object), as a single stream in large blocks. Returns the total
+    number of bytes and a dictionary with the offset of the content,
+    the size, the modification time and the mode of every member.
+    """
+    index = {}
+    with tarfile.open(fileobj=f, mode='w|', bufsize=bundle_buffer_size) \
+                                                                    as tar:
+        for name, local_file in members:
+            tarinfo = tar.gettarinfo(local_file, arcname=name)
+            with open(local_file, 'rb') as fh:
+                tar.addfile(tarinfo, fh)
+
+            padded = member_size(tarinfo.size) - tarfile.BLOCKSIZE
+            index[name] = [tar.offset - padded, tarinfo.size,
+                           int(tarinfo.mtime), tarinfo.mode]
+        total = tar.offset
+
+    # Closing the archive adds (at least) two empty blocks
+    # and pads it to a multiple of the record size
+    total += 2 * tarfile.BLOCKSIZE
+    remainder = total % tarfile.RECORDSIZE
+    if remainder > 0:
+        total += tarfile.RECORDSIZE - remainder
+    return total, index
+
+
+def extract_bundle(f, local_path, names=None, atomic=False):
+    """ Extracts the files in the tar archive which is read (as a
+    single stream) from the given file object (e.g. an opened data
+    object) to the given local folder, and returns their total size.
+
+    Arguments:
+
+    f: file object
+        The (readable) file object
+
+    local_path: str
+        The folder to extract the files to
+
+    names: None or set of str (default: None)
+        The names of the members to extract (None means all of them)
+
+    atomic: bool (default: False)
+        Whether to write every file to a hidden temporary file first,
+        which is renamed once it is complete
+    """
+    total = 0
+    with tarfile.open(fileobj=f, mode='r|', bufsize=bundle_buffer_size) \
+                                                                    as tar:
+        for tarinfo in tar:
+            if not tarinfo.isfile() or \
+               (names is not None and tarinfo.name not in names):
+                continue
+
+            name = os.path.normpath(tarinfo.name)
+            if os.path.isabs(name) or name.split(os.sep)[0] == '..':
+                raise OSError('Refusing to extract %s outside of %s' % \
+                              (tarinfo.name, local_path))
+
+            target = os.path.join(local_path, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+
+            local_file = target
+            if atomic:
+                local_file = os.path.join(os.path.dirname(target),
+                                          '.%s.part' % os.path.basename(name))
+
+            with tar.extractfile(tarinfo) as src, \
+                 open(local_file, 'wb') as dst:
+                shutil.copyfileobj(src, dst, bundle_buffer_size)
+
+            os.chmod(local_file, tarinfo.mode & 0o7777)
+            os.utime(local_file, (tarinfo.mtime, tarinfo.mtime))
+            if atomic:
+                os.replace(local_file, target)
+            total += tarinfo.size
+
+    return total
+
+
+def read_index(f):
+    """ Reads the member index of a bundled collection from the given
+    file object. The index is a dictionary with the 'generation' and
+    the names of the 'bundles' and, for every member, the name of its
+    bundle and the offset, size, modification time and mode of its
+    content.
+    """
+    return json.loads(f.read().decode())
+
+
+def write_index(f, bundles, indices, generation=0):
+    """ Writes the member index of a bundled collection, given the
+    names of the bundles, their member indices (see write_bundle())
+    and their generation, to the given file object.
+    """
+    members = {}
+    for bundle, index in zip(bundles, indices):
+        for name, (offset, size, mtime, mode) in index.items():
+            members[name] = [bundle, offset, size, mtime, mode]
+
+    index = {'version': 1, 'generation': generation, 'bundles': bundles,
+             'members': members}
+    f.write(json.dumps(index).encode())
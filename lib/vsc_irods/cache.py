@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import tempfile
+import threading
+from calendar import timegm
+
+
+class DownloadCache:
+    """ A local cache of downloaded data objects, which can be shared
+    by several processes on the same node (see e.g.
+    :func:`vsc_irods.manager.bulk_manager.BulkManager.get`).
+
+    Cached files are stored under a key derived from the iRODS checksum
+    of the data object, or (for data objects without a checksum) from
+    its path, size and modification time, so that changed data objects
+    are never served from the cache. When the total size of the cache
+    exceeds the maximum size, the least recently used files are evicted.
+
+    Cached files are made read-only and are added and removed
+    atomically. Looking up a file does not need any lock: a hit only
+    sets the access time of the cached file (which is the time of last
+    use for the eviction) and appends a byte to a file counting the
+    hits (or misses). The index with the sizes of the cached files and
+    the number of evictions is kept in a JSON file in the cache
+    directory, which is only read and written when files are added
+    or evicted, while holding an exclusive lock on a lock file
+    (using fcntl.flock()).
+
+    Example:
+
+    >>> cache = DownloadCache('/local/scratch/irods_cache',
+                              max_size=50 * 1024**3)
+    >>> session.bulk.get('~/reference/*.fa', local_path='.', cache=cache)
+    >>> cache.statistics()
+
+    Arguments:
+
+    directory: str
+        The path to the cache directory (created if needed)
+
+    max_size: None or int (default: None)
+        The maximum total size (in bytes) of the cached files.
+        None means that the size is not limited.
+
+    link: bool (default: False)
+        Whether to create hard links to the (read-only) cached files
+        instead of copies, where possible. This avoids copying, but
+        means that the local files should not be modified in place
+        (bulk get operations using the cache replace such links
+        instead of overwriting them).
+    """
+    def __init__(self, directory, max_size=None, link=False):
+        self.directory = directory
+        self.max_size = max_size
+        self.link = link
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.objects = os.path.join(directory, 'objects')
+        os.makedirs(self.objects, exist_ok=True)
+
+    @staticmethod
+    def key(entry):
+        """ Returns the cache key for the data object described
+        by the given Entry instance (see search_manager.Entry).
+        """
+        if entry.checksum:
+            text = 'checksum:%s:%d' % (entry.checksum, entry.size)
+        else:
+            mtime = timegm(entry.modify_time.utctimetuple())
+            text = 'path:%s:%d:%d' % (entry.abs_path, entry.size, mtime)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.objects, key[:2], key)
+
+    def _update_index(self, function, write=True):
+        # Calls function(index) while holding the lock on the index,
+        # and (if write is True) writes the modified index back to disk
+        with open(os.path.join(self.directory, 'lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                filename = os.path.join(self.directory, 'index.json')
+                try:
+                    with open(filename, 'r') as f:
+                        index = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    index = {'entries': {}, 'evictions': 0}
+
+                result = function(index)
+
+                if not write:
+                    return result
+
+                fd, tmp = tempfile.mkstemp(dir=self.directory)
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(index, f)
+                os.replace(tmp, filename)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+        return result
+
+    def fetch(self, key, local_file):
+        """ Puts the cached file with the given key at the given local
+        path (replacing any existing file) and returns True, or returns
+        False if there is no such file in the cache.
+        """
+        cached_file = self._path(key)
+        try:
+            self._place(cached_file, local_file)
+            found = True
+        except FileNotFoundError:
+            # Not cached (or evicted in the meantime by another process)
+            found = False
+
+        if found:
+            self._touch(cached_file)
+        self._count('hits' if found else 'misses')
+
+        with self.lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        return found
+
+    def _touch(self, cached_file):
+        # Records the time of last use of the cached file
+        # as its access time
+        try:
+            info = os.stat(cached_file)
+            os.utime(cached_file, (time.time(), info.st_mtime))
+        except OSError:
+            pass
+
+    def _count(self, event):
+        # Counts the given event ('hits' or 'misses') for all processes,
+        # as the size of a file which is only appended to
+        with open(os.path.join(self.directory, event), 'ab') as f:
+            f.write(b'.')
+
+    def _place(self, cached_file, local_file):
+        # Hard links or copies the cached file to the local path
+        tmp = '%s.cache%d.%d' % (local_file, os.getpid(),
+                                 threading.get_ident())
+
+        if self.link:
+            try:
+                os.link(cached_file, tmp)
+                os.replace(tmp, local_file)
+                return
+            except FileNotFoundError:
+                raise
+            except OSError:
+                # E.g. when on a different file system
+                pass
+
+        shutil.copyfile(cached_file, tmp)
+        os.replace(tmp, local_file)
+
+    def store(self, key, local_file):
+        """ Adds a copy of the given local file to the cache,
+        under the given key, and evicts the least recently used
+        files if the maximum size is exceeded.
+        """
+        cached_file = self._path(key)
+        os.makedirs(os.path.dirname(cached_file), exist_ok=True)
+
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(cached_file))
+        os.close(fd)
+        shutil.copyfile(local_file, tmp)
+        os.chmod(tmp, 0o444)
+        size = os.path.getsize(tmp)
+
+        def add(index):
+            os.replace(tmp, cached_file)
+            index['entries'][key] = [size, time.time()]
+            self._evict(index)
+
+        self._update_index(add)
+
+    def _evict(self, index):
+        # Removes the least recently used files from the cache
+        # (and the given index) until the maximum size is respected
+        if self.max_size is None:
+            return
+
+        entries = index['entries']
+        for key in list(entries):
+            try:
+                entries[key][1] = os.stat(self._path(key)).st_atime
+            except FileNotFoundError:
+                entries.pop(key)
+        total = sum([size for size, last_used in entries.values()])
+
+        for key in sorted(entries, key=lambda key: entries[key][1]):
+            if total <= self.max_size:
+                break
+
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+            total -= entries.pop(key)[0]
+            index['evictions'] += 1
+
+    def statistics(self):
+        """ Returns a dictionary with the number of cached files ('files'),
+        their total size in bytes ('size'), and the numbers of hits,
+        misses and evictions, for all processes using the cache.
+        """
+        def get_statistics(index):
+            entries = index['entries']
+            return {'files': len(entries),
+                    'size': sum([size for size, _ in entries.values()]),
+                    'evictions': index['evictions']}
+
+        statistics = self._update_index(get_statistics, write=False)
+
+        for event in ['hits', 'misses']:
+            try:
+                statistics[event] = os.path.getsize(os.path.join(
+                                                    self.directory, event))
+            except FileNotFoundError:
+                statistics[event] = 0
+        return statistics
@@ -0,0 +1,143 @@
+import json
+import threading
+
+
+class TransferJournal:
+    """ An append-only journal of the transfers in bulk get/put
+    operations, which allows to resume these after an interruption
+    (see e.g. :func:`vsc_irods.manager.bulk_manager.BulkManager.get`).
+
+    Every line in the journal file is a JSON record, describing
+    a transfer from a source to a destination path, with one of
+    the following statuses:
+
+    * 'planned': the transfer has been planned, where the size and
+      (if known) the checksum and modification time of the source
+      are recorded,
+    * 'partial': a byte range (offset and length) of the transfer
+      has been completed (only for files transferred in multiple
+      streams),
+    * 'done': the transfer has been completed,
+    * 'failed': the transfer has failed (with the error message).
+
+    Records are flushed to disk as soon as they are written.
+    An incomplete last line (e.g. when the process got killed)
+    is ignored when reading the journal.
+
+    Example:
+
+    >>> journal = TransferJournal('transfers.journal', resume=True)
+    >>> session.bulk.get('~/my_collection', recurse=True,
+                         journal=journal, resume=True)
+
+    Arguments:
+
+    filename: str
+        The path to the journal file
+
+    resume: bool (default: False)
+        Whether to read an existing journal (and append to it),
+        instead of starting a new one.
+    """
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.states = {}
+
+        if resume:
+            try:
+                with open(filename, 'r') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue
+                        self._update(record)
+            except FileNotFoundError:
+                pass
+
+        self.f = open(filename, 'a' if resume else 'w')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """ Closes the journal file """
+        self.f.close()
+
+    def _update(self, record):
+        # Updates the state of the transfer described by the given record
+        key = (record['source'], record['destination'])
+        status = record['status']
+
+        if status == 'planned':
+            state = self.states.get(key)
+            version = (record['size'], record.get('checksum'),
+                       record.get('mtime'))
+            if state is None or state['version'] != version:
+                # A new transfer, or one where the source has changed
+                self.states[key] = {'version': version,
+                                    'status': 'planned', 'ranges': []}
+        elif key in self.states:
+            state = self.states[key]
+            state['status'] = status
+            if status == 'partial':
+                state['ranges'].append((record['offset'], record['length']))
+
+    def _write(self, record):
+        with self.lock:
+            self._update(record)
+            self.f.write(json.dumps(record) + '\n')
+            self.f.flush()
+
+    def planned(self, source, destination, size, checksum=None, mtime=None):
+        """ Records a planned transfer """
+        self._write({'status': 'planned', 'source': source,
+                     'destination': destination, 'size': size,
+                     'checksum': checksum, 'mtime': mtime})
+
+    def partial(self, source, destination, offset, length):
+        """ Records the completion of the given byte range of a transfer """
+        self._write({'status': 'partial', 'source': source,
+                     'destination': destination, 'offset': offset,
+                     'length': length})
+
+    def done(self, source, destination):
+        """ Records a completed transfer """
+        self._write({'status': 'done', 'source': source,
+                     'destination': destination})
+
+    def failed(self, source, destination, error):
+        """ Records a failed transfer """
+        self._write({'status': 'failed', 'source': source,
+                     'destination': destination, 'error': str(error)})
+
+    def is_planned(self, source, destination):
+        """ Returns whether the given transfer is in the journal
+        (whatever its status and the version of its source).
+        """
+        return (source, destination) in self.states
+
+    def is_done(self, source, destination, size, checksum=None, mtime=None):
+        """ Returns whether the given transfer has been completed
+        earlier, for a source with the given size, checksum and
+        modification time.
+        """
+        state = self.states.get((source, destination))
+        return state is not None and state['status'] == 'done' and \
+               state['version'] == (size, checksum, mtime)
+
+    def completed_ranges(self, source, destination, size, checksum=None,
+                         mtime=None):
+        """ Returns the list of (offset, length) tuples of the completed
+        byte ranges of the given (unfinished) transfer, for a source with
+        the given size, checksum and modification time.
+        """
+        state = self.states.get((source, destination))
+        if state is None or state['status'] == 'done' or \
+           state['version'] != (size, checksum, mtime):
+            return []
+        return list(state['ranges'])
@@ -0,0 +1,128 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class LookupCache:
+    """ A bounded, in-memory cache of the types of iRODS paths
+    (collection, data object or nonexistent), which saves the managers
+    of a session from asking the server again and again whether
+    the same paths exist (see :attr:`VSCiRODSSession.lookups`).
+
+    The cache is filled by the existence checks themselves as well
+    as by the listing queries of the search manager, and the session's
+    own create, move and remove operations invalidate the affected
+    paths. Changes made by other clients only become visible once the
+    entries have expired, so the time-to-live should be kept short.
+
+    The 'hits' and 'misses' attributes count how many lookups were
+    answered from the cache and how many needed a query to the server.
+
+    Example:
+
+    >>> session = VSCiRODSSession(lookup_ttl=30)
+    >>> session.bulk.put('results/*', irods_path='~/results')
+    >>> print(session.lookups.stats())
+
+    Arguments:
+
+    ttl: float (default: 60)
+        The number of seconds after which an entry expires
+        (0 disables the cache)
+
+    max_size: int (default: 100000)
+        The maximum number of paths in the cache, beyond which
+        the least recently used ones are dropped
+    """
+    def __init__(self, ttl=60, max_size=100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, path, kind):
+        """ Returns whether the given absolute path is a collection
+        (kind='d') or a data object (kind='f'), or None if this
+        is not known (in which case the server needs to be asked).
+        """
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and time.time() - entry[0] > self.ttl:
+                del self.entries[path]
+                entry = None
+
+            if entry is None or kind not in entry[1]:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return entry[1][kind]
+
+    def set(self, path, kind, exists):
+        """ Records whether the given absolute path is a collection
+        (kind='d') or a data object (kind='f'). As a path cannot be
+        both, an existing one is also recorded not to be of the other
+        kind.
+        """
+        if self.ttl <= 0:
+            return
+
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                facts = {}
+            else:
+                facts = entry[1]
+
+            facts[kind] = exists
+            if exists:
+                facts['f' if kind == 'd' else 'd'] = False
+
+            self.entries[path] = (time.time(), facts)
+            self.entries.move_to_end(path)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def lookup(self, path, kind, function):
+        """ Returns the cached answer for the given absolute path and
+        kind (see get()), or else calls the given function (e.g. PRC's
+        collections.exists()) with the path and caches its answer.
+        """
+        exists = self.get(path, kind)
+        if exists is None:
+            exists = function(path)
+            self.set(path, kind, exists)
+        return exists
+
+    def invalidate(self, path, recurse=False):
+        """ Drops the given absolute path from the cache, as well as
+        everything below it if recurse is True (e.g. when a collection
+        is moved or removed).
+        """
+        with self.lock:
+            self.entries.pop(path, None)
+
+            if recurse:
+                prefix = path.rstrip('/') + '/'
+                for key in [key for key in self.entries
+                            if key.startswith(prefix)]:
+                    del self.entries[key]
+
+    def clear(self):
+        """ Empties the cache (the counters are kept) """
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """ Returns a dictionary with the number of hits, misses
+        and cached paths.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.entries)}
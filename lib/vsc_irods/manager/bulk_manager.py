@@ -1,19 +1,167 @@
 import os
+import sys
 import glob
-from irods.column import Criterion
-from irods.exception import (CollectionDoesNotExist, OperationNotSupported,
-                             MultipleResultsFound)
-from irods.keywords import FORCE_FLAG_KW
+import time
+import base64
+import hashlib
+import itertools
+from calendar import timegm
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from irods import MAX_SQL_ROWS
+from irods.column import Criterion, In
+from irods.exception import (CollectionDoesNotExist, DataObjectDoesNotExist,
+                             OperationNotSupported, SYS_UNMATCHED_API_NUM)
+from irods.keywords import (ALL_KW, FORCE_FLAG_KW, OPR_TYPE_KW,
+                            UPDATE_REPL_KW)
 from irods.meta import iRODSMeta
-from irods.models import Collection, DataObject
+from irods.models import (Collection, CollectionMeta, DataObject,
+                          DataObjectMeta)
+from vsc_irods.bundle import (bundle_index_name, bundle_name, extract_bundle,
+                              plan_bundles, read_index, write_bundle,
+                              write_index)
+from vsc_irods.cache import DownloadCache
+from vsc_irods.journal import TransferJournal
 from vsc_irods.manager import Manager
+from vsc_irods.manager.search_manager import Entry, get_shard, shard_items
+from vsc_irods.reader import DataObjectReader
+from vsc_irods.stage import Stage
 
+try:
+    # Atomic metadata operations are only available in newer PRC versions
+    from irods.meta import AVUOperation
+except ImportError:
+    AVUOperation = None
 
 # Job-related environment variables used by add_job_metadata
 job_env_var = ['PBS_O_HOST', 'PBS_JOBID', 'PBS_JOBNAME', 'PBS_NODEFILE',
                'SLURM_SUBMIT_HOST', 'SLURM_JOB_ID', 'SLURM_JOB_NAME',
                'SLURM_JOB_NODELIST']
 
+# Number of bytes read or written at once per stream when
+# transferring large data objects in multiple streams
+stream_buffer_size = 4 * 1024**2
+
+# Number of bytes after which the progress of a stream
+# is recorded in the transfer journal (if any)
+journal_block_size = 256 * 1024**2
+
+
+class BulkOperationError(Exception):
+    """ Raised when some of the items in a bulk operation failed,
+    after all the other items have been processed.
+
+    Attributes:
+
+    failures: list of (description, exception) tuples
+        One for every failed item
+    """
+    def __init__(self, failures):
+        self.failures = failures
+        msg = '%d item(s) failed, starting with %s: %s'
+        Exception.__init__(self, msg % (len(failures), failures[0][0],
+                                        failures[0][1]))
+
+
+def local_checksum(filename, irods_checksum):
+    """ Returns the checksum of the given local file, in the same
+    format as the given iRODS checksum ('sha2:' followed by the
+    base64-encoded SHA-256 digest, or else the hexadecimal MD5 digest).
+    """
+    if irods_checksum.startswith('sha2:'):
+        h = hashlib.sha256()
+    else:
+        h = hashlib.md5()
+
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(stream_buffer_size), b''):
+            h.update(block)
+
+    if irods_checksum.startswith('sha2:'):
+        return 'sha2:' + base64.b64encode(h.digest()).decode()
+    return h.hexdigest()
+
+
+def scan_local(local_path):
+    """ Yields (folder, subfolder names, [(file name, os.stat_result)])
+    tuples for the given local directory tree, in the same (top-down)
+    order as os.walk(), but using os.scandir() so that the file
+    information comes with the directory listing. Hidden files and
+    folders are skipped, as when globbing with '*', and symbolic
+    links are followed.
+    """
+    folders = [local_path]
+    while len(folders) > 0:
+        folder = folders.pop()
+        subfolders = []
+        files = []
+
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                elif entry.is_dir():
+                    subfolders.append(entry.name)
+                elif entry.is_file():
+                    files.append((entry.name, entry.stat()))
+
+        subfolders.sort()
+        files.sort()
+        yield (folder, subfolders, files)
+
+        folders.extend([os.path.join(folder, subfolder)
+                        for subfolder in reversed(subfolders)])
+
+
+def read_fully(raw, view):
+    """ Reads from the given raw file object (e.g. the 'raw' attribute
+    of an opened data object) straight into the given memoryview of
+    bytes, until it is full or the end of the file is reached, and
+    returns the number of bytes read.
+    """
+    count = 0
+    while count < len(view):
+        n = raw.readinto(view[count:count + stream_buffer_size])
+        if not n:
+            break
+        count += n
+    return count
+
+
+def clip_range(offset, length, size):
+    """ Returns the (offset, length) tuple for the part of the given
+    byte range which lies within a file of the given size. A negative
+    offset counts from the end of the file and a length of None
+    means 'up to the end'.
+    """
+    if offset < 0:
+        offset = max(size + offset, 0)
+    offset = min(offset, size)
+
+    if length is None:
+        length = size - offset
+    return offset, max(min(length, size - offset), 0)
+
+
+def job_metadata():
+    """ Returns a list of (attribute, value) tuples with job-related
+    information, taken from the environment variables which are set
+    by PBS or Slurm (see 'job_env_var').
+    """
+    avus = []
+    for key in job_env_var:
+        if key in os.environ:
+            if key.endswith('FILE'):
+                # e.g. $PBS_NODEFILE is special, as it refers to a file
+                with open(os.environ[key], 'r') as f:
+                    value = ','.join([line.strip() for line in f])
+
+                listkey = key.replace('FILE', 'LIST')
+                avus.append((listkey, value))
+            else:
+                avus.append((key, os.environ[key]))
+    return avus
+
 
 def confirm(operation, kind, item):
     """ Prompts the users to confirm the given operation """
@@ -24,7 +172,374 @@ def confirm(operation, kind, item):
 
 
 class BulkManager(Manager):
-    """ A class for easier 'bulk' operations with the iRODS file system """
+    """ A class for easier 'bulk' operations with the iRODS file system
+
+    The 'atomic_metadata' attribute tells whether metadata changes are
+    applied with atomic requests (see :func:`metadata`), which is turned
+    off when PRC or the iRODS server does not support these.
+    """
+    def __init__(self, session):
+        Manager.__init__(self, session)
+        self.atomic_metadata = AVUOperation is not None
+
+    def _iterate(self, iterator, shard=None):
+        """ Returns an iterator over the given items, where strings
+        are turned into search_manager.iglob() iterators
+        (yielding Entry instances). If a shard is given, only the
+        items in that shard are kept (see _shard()).
+        """
+        if isinstance(iterator, str):
+            iterator = self.session.search.iglob(iterator, return_entries=True)
+        if shard is not None:
+            iterator = self._shard(iterator, shard)
+        return iterator
+
+    def _shard(self, iterator, shard):
+        """ Returns an iterator over the given items (paths or Entry
+        instances) in the given shard (see search_manager.shard_items()
+        and search_manager.get_shard()), where the size of a collection
+        is the total size of its collection tree.
+        """
+        def get_size(item):
+            entry = item
+            item, path, is_collection = self._resolve(item)
+            if is_collection:
+                return self._tree_sizes(path)[path][0]
+            elif isinstance(entry, Entry):
+                return entry.size
+            return self._object_entry(path).size
+
+        return shard_items(iterator, *get_shard(shard), size=get_size)
+
+    def _resolve(self, item):
+        """ Returns a (path, absolute path, is_collection) tuple for
+        the given item, which can be a path string or an Entry instance.
+        Only for path strings which are not in the session's lookup
+        cache, the server needs to be contacted.
+        """
+        if isinstance(item, Entry):
+            return (item.path, item.abs_path, item.kind == 'd')
+
+        path = self.session.path.get_absolute_irods_path(item)
+        return (item, path, self.session.path.is_collection(path))
+
+    def _run_tasks(self, tasks, workers=1):
+        """ Runs the given tasks, which are (description, function,
+        arguments) tuples, using the given number of worker threads.
+        Every worker gets its own connection from the session's
+        connection pool when it needs to talk to the server.
+
+        A failing task does not abort the other ones. Returns a list with
+        the return values of the tasks (in the same order, and None for
+        the failed ones) and a list of (description, exception) tuples
+        for the failed tasks.
+        """
+        results = [None] * len(tasks)
+        failures = []
+
+        def report(index, error):
+            description = tasks[index][0]
+            self.log('Failed %s: %s' % (description, error), True)
+            failures.append((description, error))
+
+        if workers > 1 and len(tasks) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(function, *args)
+                           for description, function, args in tasks]
+
+                for index, future in enumerate(futures):
+                    try:
+                        results[index] = future.result()
+                    except Exception as error:
+                        report(index, error)
+        else:
+            for index, (description, function, args) in enumerate(tasks):
+                try:
+                    results[index] = function(*args)
+                except Exception as error:
+                    report(index, error)
+
+        return results, failures
+
+    def _log_summary(self, operation, sizes, skipped, failures, elapsed,
+                     verbose):
+        """ Logs a summary of a bulk transfer, given the list of
+        transferred sizes (None for failed transfers).
+        """
+        sizes = [size for size in sizes if size is not None]
+        total = sum(sizes)
+        rate = total / elapsed / 1024**2 if elapsed > 0 else 0.
+        msg = '%s %d data objects (%d bytes) in %.2f s (%.2f MiB/s), ' + \
+              '%d skipped, %d failed'
+        self.log(msg % (operation, len(sizes), total, elapsed, rate,
+                        skipped, len(failures)), verbose)
+
+    def _object_entry(self, path):
+        """ Returns an Entry instance for the data object
+        with the given absolute path.
+        """
+        dirname = os.path.dirname(path)
+        basename = os.path.basename(path)
+        criteria = [Criterion('=', Collection.name, dirname),
+                    Criterion('=', DataObject.name, basename)]
+        search = self.session.search
+        q = search._query_entries('f', criteria)
+
+        results = [result for result in search._results(q, limit=1)]
+        if len(results) == 0:
+            raise DataObjectDoesNotExist(path)
+
+        return search._make_entry('f', results[0])
+
+    @staticmethod
+    def _is_changed(local_file, local_stat, entry, checksum, direction):
+        """ Returns whether the given local file (with the given
+        os.stat_result) and data object (as an Entry instance) differ,
+        and hence need to be synchronized in the given direction
+        ('get' or 'put').
+
+        Files with different sizes always differ. Otherwise, if checksum
+        is True and the data object has a registered checksum, the local
+        checksum gets computed and compared. Else the modification times
+        are compared: for 'get', where the local modification time is
+        set to the remote one after every transfer, these need to be
+        equal, and for 'put' the local file may not be more recent.
+        """
+        if local_stat.st_size != entry.size:
+            return True
+
+        if checksum and entry.checksum:
+            return local_checksum(local_file, entry.checksum) != \
+                   entry.checksum
+
+        local_mtime = int(local_stat.st_mtime)
+        remote_mtime = timegm(entry.modify_time.utctimetuple())
+
+        if direction == 'get':
+            return local_mtime != remote_mtime
+        return local_mtime > remote_mtime
+
+    @staticmethod
+    def _split_ranges(size, streams, completed=[]):
+        """ Returns a list of (offset, length) tuples dividing
+        the given number of bytes over (at most) the given
+        number of streams, leaving out the given completed
+        (offset, length) ranges.
+        """
+        length = -(-size // max(streams, 1))
+        ranges = [(offset, min(length, size - offset))
+                  for offset in range(0, size, max(length, 1))]
+
+        for done_offset, done_length in completed:
+            done_end = done_offset + done_length
+            remaining = []
+            for offset, length in ranges:
+                end = offset + length
+                if done_end <= offset or done_offset >= end:
+                    remaining.append((offset, length))
+                    continue
+                if offset < done_offset:
+                    remaining.append((offset, done_offset - offset))
+                if done_end < end:
+                    remaining.append((done_end, end - done_end))
+            ranges = remaining
+
+        return ranges
+
+    def _transfer_ranges(self, function, ranges, streams, progress=None):
+        """ Calls function(offset, length, report) for every given byte
+        range, using one thread per stream. Every thread opens the data
+        object over its own connection from the session's pool. The first
+        error is raised once all ranges have been processed.
+
+        The 'report' argument is a function to be called with the offset
+        up to which the range has been transferred, which calls
+        progress(offset, length) for (at least) every journal_block_size
+        bytes and at the end of the range.
+        """
+        if len(ranges) == 0:
+            return
+
+        def transfer(offset, length):
+            start = offset
+
+            def report(position):
+                nonlocal start
+                if progress is not None and \
+                   (position - start >= journal_block_size or \
+                    position == offset + length):
+                    progress(start, position - start)
+                    start = position
+
+            function(offset, length, report)
+
+        with ThreadPoolExecutor(max_workers=min(streams, len(ranges))) \
+                as executor:
+            futures = [executor.submit(transfer, offset, length)
+                       for offset, length in ranges]
+
+        for future in futures:
+            future.result()
+
+    def _get_ranges(self, path, local_file, size, streams, completed=[],
+                    progress=None, **options):
+        """ Downloads the data object with the given absolute path
+        to the given local file, reading byte ranges concurrently
+        over multiple streams. The local file is preallocated
+        and every range is written at its own offset.
+
+        If the file exists, the given completed (offset, length)
+        ranges are not transferred again. The progress function
+        gets called with every (offset, length) range which has
+        been written.
+        """
+        if not os.path.exists(local_file):
+            completed = []
+
+        flags = os.O_WRONLY | os.O_CREAT
+        if len(completed) == 0:
+            flags |= os.O_TRUNC
+
+        fd = os.open(local_file, flags)
+        try:
+            if len(completed) == 0:
+                if size > 0 and hasattr(os, 'posix_fallocate'):
+                    os.posix_fallocate(fd, 0, size)
+                else:
+                    os.ftruncate(fd, size)
+
+            def get_range(offset, length, report):
+                with self.session.data_objects.open(path, 'r',
+                                                    **options) as f:
+                    f.seek(offset)
+                    while length > 0:
+                        data = f.read(min(length, stream_buffer_size))
+                        if len(data) == 0:
+                            raise IOError('Unexpected end of data object ' + \
+                                          '%s at offset %d' % (path, offset))
+                        os.pwrite(fd, data, offset)
+                        offset += len(data)
+                        length -= len(data)
+                        report(offset)
+
+            ranges = self._split_ranges(size, streams, completed=completed)
+            self._transfer_ranges(get_range, ranges, streams,
+                                  progress=progress)
+        finally:
+            os.close(fd)
+
+    def _open_put(self, path, mode='w', **options):
+        """ Opens the data object with the given absolute path for
+        writing as PRC's data_objects.put() does, i.e. as a put
+        operation, so that the acPostProcForPut policies run when
+        it gets closed.
+        """
+        options = dict(options)
+        options.setdefault(OPR_TYPE_KW, 1)  # PUT_OPR
+        return self.session.data_objects.open(path, mode, **options)
+
+    def _replicate_put(self, path, **options):
+        """ Updates all replicas of the data object with the given
+        absolute path after a put, if the ALL_KW option is given
+        (as PRC's data_objects.put() does).
+        """
+        if ALL_KW in options:
+            options = dict(options)
+            options[UPDATE_REPL_KW] = ''
+            self.session.data_objects.replicate(path, **options)
+
+    def _put_ranges(self, local_file, path, size, streams, completed=[],
+                    progress=None, **options):
+        """ Uploads the given local file to the data object with the
+        given absolute path, writing byte ranges concurrently over
+        multiple streams. The data object is first created (or truncated,
+        if it already exists) and every range is then written
+        at its own offset.
+
+        If the data object exists, the given completed (offset, length)
+        ranges are not transferred again (and the data object is not
+        truncated). The progress function gets called with every
+        (offset, length) range which has been written.
+
+        Once all ranges are in place, the data object is opened and
+        closed once more as a put (see _open_put()), so that the put
+        policies run only once, on the complete content.
+        """
+        options = {key: value for key, value in options.items()
+                   if key != OPR_TYPE_KW}
+
+        if len(completed) > 0 and not self.session.path.is_data_object(path):
+            completed = []
+
+        if len(completed) == 0:
+            with self.session.data_objects.open(path, 'w', **options):
+                pass
+            self.session.lookups.set(path, 'f', True)
+
+        fd = os.open(local_file, os.O_RDONLY)
+        try:
+            def put_range(offset, length, report):
+                with self.session.data_objects.open(path, 'r+',
+                                                    **options) as f:
+                    f.seek(offset)
+                    while length > 0:
+                        data = os.pread(fd, min(length, stream_buffer_size),
+                                        offset)
+                        if len(data) == 0:
+                            raise IOError('Unexpected end of file ' + \
+                                          '%s at offset %d' % \
+                                          (local_file, offset))
+                        f.write(data)
+                        f.flush()
+                        offset += len(data)
+                        length -= len(data)
+                        report(offset)
+
+            ranges = self._split_ranges(size, streams, completed=completed)
+            self._transfer_ranges(put_range, ranges, streams,
+                                  progress=progress)
+        finally:
+            os.close(fd)
+
+        with self._open_put(path, 'r+', **options):
+            pass
+        self._replicate_put(path, **options)
+
+    def _create_collections(self, collections, existing, verbose=False,
+                            **options):
+        """ Creates those of the given collections (absolute paths)
+        which are not in the given set of existing collections.
+        Only the deepest ones are created explicitly, as their
+        parents get created along with them.
+        """
+        missing = [collection for collection in collections
+                   if collection not in existing]
+        missing.sort(key=lambda collection: collection.split('/'))
+
+        for index, collection in enumerate(missing):
+            self.log('Creating collection: %s' % collection, verbose)
+            is_leaf = index == len(missing) - 1 or \
+                      not missing[index + 1].startswith(collection + '/')
+            if is_leaf:
+                self.session.collections.create(collection, recurse=True,
+                                                **options)
+            self.session.lookups.set(collection, 'd', True)
+
+    @staticmethod
+    def _journal_task(journal, key, function):
+        """ Returns a function which calls the given transfer function
+        and records its completion or failure in the given journal,
+        for the given (source, destination) key.
+        """
+        def task(*args):
+            try:
+                result = function(*args)
+            except Exception as error:
+                journal.failed(*key, error)
+                raise
+            journal.done(*key)
+            return result
+        return task
 
     def remove(self, iterator, recurse=False, force=False, interactive=False,
                verbose=False, **options):
@@ -63,13 +578,10 @@ class BulkManager(Manager):
             Additional options to be passed on to PRC's
             collections.remove() and data_objects.unlink() methods.
         """
-        if isinstance(iterator, str):
-            iterator = self.session.search.iglob(iterator)
+        for item in self._iterate(iterator):
+            item, path, is_collection = self._resolve(item)
 
-        for item in iterator:
-            path = self.session.path.get_absolute_irods_path(item)
-
-            if self.session.collections.exists(path):
+            if is_collection:
                 # Item is a collection, not an object
                 if recurse:
                     ok = confirm('remove', 'collection', path) if interactive \
@@ -78,6 +590,7 @@ class BulkManager(Manager):
                         self.log('Removing collection %s' % path, verbose)
                         self.session.collections.remove(path, recurse=True,
                                                         force=force, **options)
+                        self.session.lookups.invalidate(path, recurse=True)
                 else:
                     self.log('Skipping collection %s (no recursion)' % item,
                              verbose)
@@ -87,6 +600,7 @@ class BulkManager(Manager):
                     self.log('Removing object %s' % path, verbose)
                     self.session.data_objects.unlink(path, force=force,
                                                      **options)
+                    self.session.lookups.invalidate(path)
 
     def move(self, iterator, irods_path, clobber=True, interactive=False,
              verbose=False):
@@ -126,13 +640,9 @@ class BulkManager(Manager):
         verbose: bool (default: False)
             Whether to print more output.
         """
-        def move_one(src, dest):
+        def move_one(src, dest_abs, dest_is_object):
             # Move/renames a single item
-            src_abs = self.session.path.get_absolute_irods_path(src)
-            dest_abs = self.session.path.get_absolute_irods_path(dest)
-
-            src_is_collection = self.session.collections.exists(src_abs)
-            dest_is_object = self.session.data_objects.exists(dest_abs)
+            src, src_abs, src_is_collection = self._resolve(src)
             kind = 'collection' if src_is_collection else 'data object'
 
             ok = True
@@ -155,13 +665,15 @@ class BulkManager(Manager):
                         self.session.collections.move(src_abs, dest_abs)
                 else:
                     self.session.data_objects.move(src_abs, dest_abs)
+
+                self.session.lookups.invalidate(src_abs, recurse=True)
+                self.session.lookups.invalidate(dest_abs, recurse=True)
             else:
                 self.log('Skipped moving %s %s to destination %s' % \
                          (kind, src_abs, dest_abs), verbose)
 
 
-        if isinstance(iterator, str):
-            iterator = self.session.search.iglob(iterator)
+        iterator = iter(self._iterate(iterator))
 
         try:
             previous_item = next(iterator)
@@ -169,28 +681,210 @@ class BulkManager(Manager):
             raise StopIteration('Iterator yields no objects or collections')
 
         dest = self.session.path.get_absolute_irods_path(irods_path)
+        dest_is_object = self.session.path.is_data_object(dest)
 
         item = None
+        dest_is_collection = None
         for item in iterator:
             # There is more than one item, so irods_path needs
             # to be an existing collection
-            if not self.session.collections.exists(dest):
+            if dest_is_collection is None:
+                dest_is_collection = self.session.path.is_collection(dest)
+            if not dest_is_collection:
                 raise CollectionDoesNotExist(dest)
 
-            move_one(previous_item, dest)
+            move_one(previous_item, dest, dest_is_object)
             previous_item = item
 
         if item is not None:
-            move_one(item, dest)
+            move_one(item, dest, dest_is_object)
         else:
             # The iterator only held 1 item originally,
             # and it hasn't been processed yet
-            move_one(previous_item, dest)
+            move_one(previous_item, dest, dest_is_object)
 
         return
 
+    def copy(self, iterator, irods_path, recurse=False, clobber=True,
+             interactive=False, workers=1, shard=None, verbose=False,
+             create_options={}, **options):
+        """ Copy iRODS data objects and/or collections to another place
+        on the iRODS server, similar to the UNIX 'cp' command.
+
+        The data objects are copied by the server, so that their content
+        does not pass through the client. Collection trees are listed
+        with a couple of queries, after which the missing collections
+        are created and the data objects copied.
+
+        Raises an CollectionDoesNotExist if the iterator corresponds to more
+        than one item and the irods_path destination does not correspond to an
+        existing collection.
+
+        Examples:
+
+        >>> session.bulk.copy('results*', '~/backup/', recurse=True)
+        >>> session.bulk.copy('./data', './data_copy', recurse=True,
+                              workers=4, verbose=True)
+
+        Arguments:
+
+        iterator: iterator or str
+            Defines which items are subject to the bulk operation.
+            Can be an iterator (e.g. using search_manager.find())
+            or a string (which will be used to construct a
+            search_manager.iglob() iterator). Matching data objects
+            (and, if used recursively, collections) will be copied
+            to the new path.
+
+        irods_path: str
+            The (absolute or relative) path on the iRODS file system
+            where the data objects and collections will be copied to.
+            If it is an existing collection, the items are copied
+            into it, else a single item is copied to this path.
+
+        recurse: bool (default: False)
+            Whether to use recursion, meaning that also matching collections
+            and their data objects and subcollections will be copied.
+
+        clobber: bool (default: True)
+            Whether to overwrite existing data objects.
+
+        interactive: bool (default: False)
+            Whether to prompt for permission before overwriting
+            existing data objects. If True, the value of the 'clobber'
+            argument is ignored.
+
+        workers: int (default: 1)
+            The number of data objects to copy concurrently, each over
+            a separate connection from the session's pool.
+
+        shard: None, (int, int) tuple or 'auto' (default: None)
+            If not None, only the items in the given shard are processed
+            (see :func:`vsc_irods.manager.search_manager.get_shard`)
+
+        verbose: bool (default: False)
+            Whether to print more output, including a summary
+            at the end.
+
+        create_options: dict (default: {})
+            Additional options to be passed on to PRC's
+            collections.create() method.
+
+        options: (any remaining keywords arguments)
+            Additional options to be passed on to PRC's
+            data_objects.copy() method.
+        """
+        iterator = iter(self._iterate(iterator, shard=shard))
+        items = []
+        for item in iterator:
+            items.append(item)
+            if len(items) > 1:
+                break
+
+        if len(items) == 0:
+            raise StopIteration('Iterator yields no objects or collections')
+
+        dest = self.session.path.get_absolute_irods_path(irods_path)
+        dest_is_collection = self.session.path.is_collection(dest)
+
+        if len(items) > 1 and not dest_is_collection:
+            raise CollectionDoesNotExist(dest)
+
+        search = self.session.search
+
+        # First plan the copies, listing the source trees and the existing
+        # collections and data objects at the destination
+        copies = []
+        collections = []
+        existing_collections = set()
+        existing_objects = set()
+
+        for item in itertools.chain(items, iterator):
+            item, path, is_collection = self._resolve(item)
+
+            if dest_is_collection:
+                target = os.path.join(dest, os.path.basename(path))
+            else:
+                target = dest
+
+            if not is_collection:
+                if isinstance(item, Entry):
+                    entry = item
+                else:
+                    entry = self._object_entry(path)
+                if self.session.path.is_data_object(target):
+                    existing_objects.add(target)
+                copies.append((path, target, entry.size))
+                continue
+            elif not recurse:
+                self.log('Skipping collection %s (no recursion)' % item,
+                         verbose)
+                continue
+            elif self.session.path.is_data_object(target):
+                msg = 'Cannot overwrite obj %s with coll %s'
+                raise OperationNotSupported(msg % (target, path))
+
+            if self.session.path.is_collection(target):
+                for entry, depth in search._iter_subtree(target, 'd'):
+                    existing_collections.add(entry.abs_path)
+                for entry, depth in search._iter_subtree(target, 'f'):
+                    existing_objects.add(entry.abs_path)
+
+            for entry, depth in search._iter_subtree(path, 'd'):
+                collections.append(target + entry.abs_path[len(path):])
+
+            for entry, depth in search._iter_subtree(path, 'f'):
+                copies.append((entry.abs_path,
+                               target + entry.abs_path[len(path):],
+                               entry.size))
+
+        self._create_collections(collections, existing_collections,
+                                 verbose=verbose, **create_options)
+
+        def copy_one(path, target, size):
+            extra_options = {FORCE_FLAG_KW: ''} if target in existing_objects \
+                            else {}
+            self.session.data_objects.copy(path, target, **extra_options,
+                                           **options)
+            self.session.lookups.set(target, 'f', True)
+            self.log('Copied data object %s to %s (%d bytes)' % \
+                     (path, target, size), verbose)
+            return size
+
+        tasks = []
+        skipped = 0
+
+        for path, target, size in copies:
+            ok = True
+
+            if target in existing_objects:
+                if interactive:
+                    ok = confirm('overwrite', 'data object', target)
+                else:
+                    ok = clobber
+
+            if ok:
+                description = 'copying data object %s to %s' % (path, target)
+                tasks.append((description, copy_one, (path, target, size)))
+            else:
+                skipped += 1
+                self.log('Skipped copying data object %s to %s' % \
+                         (path, target), verbose)
+
+        start = time.time()
+        results, failures = self._run_tasks(tasks, workers=workers)
+
+        self._log_summary('Copied', results, skipped, failures,
+                          time.time() - start, verbose)
+
+        if len(failures) > 0:
+            raise BulkOperationError(failures)
+
     def get(self, iterator, local_path='.', recurse=False, clobber=True,
             interactive=False, return_data_objects=False, verbose=False,
+            *, sync=False, checksum=False, workers=1, streams=1,
+            large_threshold=1024**3, journal=None, resume=False,
+            cache=None, shard=None, atomic=False, unbundle=True,
             **options):
         """ Copy iRODS data objects and/or collections to the local machine.
 
@@ -220,6 +914,22 @@ class BulkManager(Manager):
         clobber: bool (default: True)
             Whether to overwrite existing local files.
 
+        sync: bool (default: False)
+            Whether to only copy data objects which are new or have
+            changed, in a manner that resembles 'rsync'. Existing local
+            files are compared with the data objects by size and
+            modification time (or by checksum, see below), and the
+            modification time of the copied files is set to the one
+            of the data objects. If True, the 'clobber' argument
+            is ignored.
+
+        checksum: bool (default: False)
+            Whether to compare existing local files with data objects
+            of the same size by checksum instead of modification time
+            (only relevant if 'sync' is True). Data objects without
+            a registered checksum are still compared by modification
+            time.
+
         interactive: bool (default: False)
             Whether to prompt for permission before overwriting
             existing local files. If True, the value of the 'clobber'
@@ -231,76 +941,899 @@ class BulkManager(Manager):
             them to the local file system. If True, the 'clobber'
             and 'interactive' arguments are ignored.
 
+        workers: int (default: 1)
+            The number of data objects to transfer concurrently,
+            each over a separate connection from the session's pool.
+            All transfers are first planned (and, if interactive,
+            confirmed) before they are started.
+
+        streams: int (default: 1)
+            The number of streams used for data objects that are at
+            least 'large_threshold' bytes in size. Such data objects
+            are split in byte ranges which are read concurrently, each
+            over a separate connection, and written at their offsets
+            in a preallocated local file. The default (1) means that
+            every data object is transferred in a single stream.
+
+        large_threshold: int (default: 1024**3)
+            The size (in bytes) from which data objects are transferred
+            in multiple streams (only relevant if 'streams' > 1).
+
+        journal: None, str or TransferJournal (default: None)
+            The journal (or the path to the journal file) in which
+            the planned and completed transfers are recorded
+            (see :class:`vsc_irods.journal.TransferJournal`).
+
+        resume: bool (default: False)
+            Whether to resume the transfers recorded in the journal,
+            meaning that completed transfers are skipped and that data
+            objects transferred in multiple streams continue from the
+            completed byte ranges. If True, the 'clobber' and 'sync'
+            arguments are ignored for transfers in the journal.
+
+        cache: None, str or DownloadCache (default: None)
+            The local cache (or the path to the cache directory) from
+            which unchanged data objects are taken instead of being
+            transferred again, and to which the transferred data objects
+            are added (see :class:`vsc_irods.cache.DownloadCache`).
+
+        shard: None, (int, int) tuple or 'auto' (default: None)
+            If not None, only the items in the given shard are processed
+            (see :func:`vsc_irods.manager.search_manager.get_shard`)
+
+        atomic: bool (default: False)
+            Whether to download every data object to a hidden temporary
+            file in the destination ('.<name>.part'), which is renamed
+            once it is complete, so that other processes never see
+            partially downloaded files.
+
+        unbundle: bool (default: True)
+            Whether to extract the files from the bundles in collections
+            which have been stored as bundles (see put()), streaming
+            every bundle only once, instead of downloading the bundles
+            themselves. Any other data objects in such collections are
+            skipped. With 'sync' or without 'clobber', the files are
+            compared with the index of the bundles, and bundles without
+            files to extract are not read at all. The 'journal', 'resume',
+            'streams' and 'cache' arguments do not apply to bundles.
+
         verbose: bool (default: False)
-            Whether to print more output.
+            Whether to print more output, including a summary
+            at the end.
 
         options: (any remaining keywords arguments)
             Additional options to be passed on to PRC's
-            data_objects.get() method.
+            data_objects.get() method (or data_objects.open(),
+            for data objects transferred in multiple streams).
         """
-        if isinstance(iterator, str):
-            iterator = self.session.search.iglob(iterator)
-
         if not return_data_objects and not os.path.isdir(local_path):
             raise OSError('Destination %s does not exist' % local_path)
 
-        objects = []
+        close_journal = isinstance(journal, str)
+        if close_journal:
+            journal = TransferJournal(journal, resume=resume)
 
-        for item in iterator:
-            path = self.session.path.get_absolute_irods_path(item)
+        if isinstance(cache, str):
+            cache = DownloadCache(cache)
+
+        tasks = []
+        skipped = 0
+
+        def get_object(path):
+            self.log('Getting object %s' % path, verbose)
+            return self.session.data_objects.get(path, file=None, **options)
+
+        def download(path, local_path, entry):
+            target = os.path.join(local_path, os.path.basename(path))
+            if atomic:
+                # Written to a hidden temporary file first, which only
+                # gets its final name once it is complete
+                local_file = os.path.join(local_path,
+                                          '.%s.part' % os.path.basename(path))
+            else:
+                local_file = target
+
+            if (streams > 1 or sync or cache is not None) and entry is None:
+                entry = self._object_entry(path)
+
+            cached = False
+
+            if cache is not None:
+                cache_key = cache.key(entry)
+                cached = cache.fetch(cache_key, local_file)
+
+                if not cached and os.path.exists(local_file) and \
+                   os.stat(local_file).st_nlink > 1:
+                    # Hard links to cached files are replaced
+                    # instead of overwritten
+                    os.remove(local_file)
+
+            if not cached:
+                if streams > 1 and entry.size >= large_threshold:
+                    completed = []
+                    progress = None
+
+                    if journal is not None:
+                        key = (path, os.path.abspath(target))
+                        completed = journal.completed_ranges(*key, entry.size,
+                                                             entry.checksum)
+                        progress = lambda offset, length: \
+                                          journal.partial(*key, offset, length)
+
+                    self._get_ranges(path, local_file, entry.size, streams,
+                                     completed=completed, progress=progress,
+                                     **options)
+                else:
+                    extra_options = {FORCE_FLAG_KW: ''}
+                    self.session.data_objects.get(path, local_file,
+                                                  **extra_options, **options)
+
+                if cache is not None:
+                    cache.store(cache_key, local_file)
+
+            if sync:
+                mtime = timegm(entry.modify_time.utctimetuple())
+                os.utime(local_file, (mtime, mtime))
+
+            if atomic:
+                os.replace(local_file, target)
+
+            size = os.path.getsize(target)
+            self.log('Got object %s to destination %s (%d bytes%s)' % \
+                     (path, local_path, size, ', cached' if cached else ''),
+                     verbose)
+            return size
+
+        listings = {}
+
+        def list_local(local_path):
+            # Returns the names and os.stat_results of the files
+            # in the given local directory (listed only once)
+            if local_path not in listings:
+                listings[local_path] = {}
+                if os.path.isdir(local_path):
+                    _, _, files = next(scan_local(local_path))
+                    listings[local_path].update(files)
+            return listings[local_path]
+
+        def extract(path, local_path, names):
+            with self.session.data_objects.open(path, 'r', **options) as f:
+                size = extract_bundle(f, local_path, names=names,
+                                      atomic=atomic)
+            self.log('Extracted %d files from bundle %s to destination %s ' \
+                     '(%d bytes)' % (len(names), path, local_path, size),
+                     verbose)
+            return size
+
+        def get_bundles(path, local_path):
+            # Plans the extraction of the files in a bundled collection,
+            # reading only the bundles which hold files to extract
+            nonlocal skipped
+
+            index = self.bundle_index(path)
+            names = {}
+
+            for name, member in sorted(index['members'].items()):
+                bundle, offset, size, mtime, mode = member
+                local_file = os.path.join(local_path, name)
+                ok = True
+
+                if sync or not clobber:
+                    try:
+                        local_stat = os.stat(local_file)
+                    except FileNotFoundError:
+                        local_stat = None
+
+                    if sync:
+                        ok = local_stat is None or \
+                             (local_stat.st_size, int(local_stat.st_mtime)) \
+                             != (size, mtime)
+                    else:
+                        ok = local_stat is None
+
+                if ok:
+                    names.setdefault(bundle, set()).add(name)
+                else:
+                    skipped += 1
+
+            for bundle in index['bundles']:
+                if bundle not in names:
+                    continue
+
+                bundle_path = os.path.join(path, bundle)
+                if interactive and not confirm('extract', 'bundle',
+                                               bundle_path + \
+                                               ' to destination ' + \
+                                               local_path):
+                    skipped += len(names[bundle])
+                    continue
+
+                description = 'extracting bundle %s to destination %s' % \
+                              (bundle_path, local_path)
+                tasks.append((description, extract,
+                              (bundle_path, local_path, names[bundle])))
+
+            return index
+
+        def get_one(path, local_path, entry=None):
+            # Plans the transfer of a single data object
+            # (for which an Entry may already be available)
+            nonlocal skipped
+
+            if return_data_objects:
+                tasks.append(('getting object %s' % path, get_object, (path,)))
+            else:
+                name = os.path.basename(path)
+                local_file = os.path.join(local_path, name)
+                local_stat = list_local(local_path).get(name)
 
-            if self.session.collections.exists(path):
+                if entry is None and (journal is not None or \
+                                      (sync and local_stat is not None)):
+                    entry = self._object_entry(path)
+
+                ok = True
+
+                if sync:
+                    if local_stat is not None:
+                        ok = self._is_changed(local_file, local_stat, entry,
+                                              checksum, 'get')
+                elif not clobber:
+                    ok = local_stat is None
+
+                if journal is not None:
+                    key = (path, os.path.abspath(local_file))
+
+                    if resume and journal.is_planned(*key):
+                        if not journal.is_done(*key, entry.size,
+                                               entry.checksum):
+                            # Unfinished transfers are always carried out
+                            # (e.g. a file truncated by a killed job)
+                            ok = True
+                        elif local_stat is not None:
+                            ok = local_stat.st_size != entry.size
+
+                if interactive and (ok or not sync):
+                    ok = confirm('get', 'object',
+                                 path +' to destination ' + local_path)
+
+                if ok:
+                    description = 'getting object %s to destination %s' % \
+                                  (path, local_path)
+                    function = download
+
+                    if journal is not None:
+                        journal.planned(*key, entry.size, entry.checksum)
+                        function = self._journal_task(journal, key, download)
+
+                    tasks.append((description, function,
+                                  (path, local_path, entry)))
+                else:
+                    skipped += 1
+                    self.log('Skipped getting object %s to destination %s' \
+                             % (path, local_path), verbose)
+
+        for item in self._iterate(iterator, shard=shard):
+            entry = item
+            item, path, is_collection = self._resolve(item)
+
+            if is_collection:
                 # Item is a collection, not an object
                 if recurse:
+                    # The whole collection tree is listed with
+                    # a couple of queries (see search_manager.walk())
                     d = os.path.join(local_path, os.path.basename(item))
+                    tree = self.session.search.walk(path, use_queries=True,
+                                                    return_entries=True)
+
+                    for collection, _, data_objects in tree:
+                        subdir = os.path.relpath(collection.abs_path, path)
+                        subdir = os.path.normpath(os.path.join(d, subdir))
+
+                        if not os.path.exists(subdir) and \
+                           not return_data_objects:
+                            self.log('Creating directory: %s' % subdir,
+                                     verbose)
+                            os.mkdir(subdir)
+
+                        if unbundle and not return_data_objects and \
+                           any(data_object.abs_path.endswith('/' + \
+                                                    bundle_index_name)
+                               for data_object in data_objects):
+                            index = get_bundles(collection.abs_path, subdir)
+
+                            # Other data objects in a bundled collection
+                            # (e.g. bundles of an interrupted put) are not
+                            # part of its content
+                            for data_object in data_objects:
+                                name = os.path.basename(data_object.abs_path)
+                                if name != bundle_index_name and \
+                                   name not in index['bundles']:
+                                    skipped += 1
+                                    self.log('Skipped object %s in bundled '
+                                             'collection %s' % \
+                                             (data_object.abs_path,
+                                              collection.abs_path), verbose)
+                            continue
+
+                        for data_object in data_objects:
+                            get_one(data_object.abs_path, subdir,
+                                    entry=data_object)
+                else:
+                    self.log('Skipping collection %s (no recursion)' % item,
+                             verbose)
+            elif isinstance(entry, Entry):
+                get_one(path, local_path, entry=entry)
+            else:
+                get_one(path, local_path)
+
+        if cache is not None:
+            hits, misses = cache.hits, cache.misses
+
+        start = time.time()
+        results, failures = self._run_tasks(tasks, workers=workers)
+
+        if close_journal:
+            journal.close()
 
-                    if not os.path.exists(d) and not return_data_objects:
-                        self.log('Creating directory: %s' % d, verbose)
-                        os.mkdir(d)
+        if not return_data_objects:
+            self._log_summary('Got', results, skipped, failures,
+                              time.time() - start, verbose)
 
-                    self.get(item + '/*', local_path=d, recurse=True,
-                             clobber=clobber, interactive=interactive,
-                             return_data_objects=return_data_objects,
-                             verbose=verbose, **options)
+        if cache is not None:
+            self.log('Download cache: %d hits, %d misses' % \
+                     (cache.hits - hits, cache.misses - misses), verbose)
+
+        if len(failures) > 0:
+            raise BulkOperationError(failures)
+
+        if return_data_objects:
+            return results
+
+    def bundle_index(self, irods_path):
+        """ Returns the index of the files in the given collection which
+        has been stored as bundles (see put()), or None if it has not.
+        See :func:`vsc_irods.bundle.read_index` for its contents.
+        """
+        path = self.session.path.get_absolute_irods_path(irods_path)
+        index_path = os.path.join(path, bundle_index_name)
+
+        if not self.session.path.is_data_object(index_path):
+            return None
+
+        with self.session.data_objects.open(index_path, 'r') as f:
+            return read_index(f)
+
+    def read_member(self, irods_path, name, index=None, **options):
+        """ Returns the content (as bytes) of a single file in a
+        collection which has been stored as bundles (see put()), which
+        is read from its offset in the bundle, without reading the rest.
+
+        Example:
+
+        >>> session.bulk.put('molecules', recurse=True, bundle_size=10**8)
+        >>> session.bulk.read_member('molecules', 'c6h6.xyz')
+
+        Arguments:
+
+        irods_path: str
+            The (absolute or relative) path of the bundled collection
+
+        name: str
+            The path of the file, relative to the bundled folder
+
+        index: None or dict (default: None)
+            The index of the collection, if already available
+            (see bundle_index()), to save a lookup when reading
+            several files
+
+        options: (any remaining keywords arguments)
+            Additional options to be passed on to PRC's
+            data_objects.open() method.
+        """
+        path = self.session.path.get_absolute_irods_path(irods_path)
+
+        if index is None:
+            index = self.bundle_index(path)
+            if index is None:
+                raise DataObjectDoesNotExist(os.path.join(path,
+                                                          bundle_index_name))
+
+        if name not in index['members']:
+            raise DataObjectDoesNotExist(os.path.join(path, name))
+
+        bundle, offset, size, mtime, mode = index['members'][name]
+        with self.session.data_objects.open(os.path.join(path, bundle), 'r',
+                                            **options) as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def _iterate_objects(self, iterator, recurse=False, shard=None,
+                         verbose=False):
+        """ Yields (absolute path, size) tuples for the data objects
+        among the given items (see _iterate()) and, if recurse is True,
+        in the trees of the collections among them.
+        """
+        for item in self._iterate(iterator, shard=shard):
+            entry = item
+            item, path, is_collection = self._resolve(item)
+
+            if is_collection:
+                if recurse:
+                    tree = self.session.search.walk(path, use_queries=True,
+                                                    return_entries=True)
+                    for collection, _, data_objects in tree:
+                        for data_object in data_objects:
+                            yield data_object.abs_path, data_object.size
                 else:
                     self.log('Skipping collection %s (no recursion)' % item,
                              verbose)
+            elif isinstance(entry, Entry):
+                yield path, entry.size
             else:
-                if return_data_objects:
-                    self.log('Getting object %s' % item, verbose)
-                    obj = self.session.data_objects.get(path, file=None,
-                                                        **options)
-                    objects.append(obj)
-                else:
-                    name = os.path.basename(path)
-                    file_exists = os.path.exists(os.path.join(local_path, name))
+                yield path, self._object_entry(path).size
 
-                    ok = True
+    def _read_into(self, path, view, offset=0, **options):
+        """ Reads the data object with the given absolute path, from
+        the given offset on, straight into the given memoryview of
+        bytes, until it is full or the data object ends. Returns the
+        number of bytes read.
+        """
+        with self.session.data_objects.open(path, 'r', **options) as f:
+            # The socket data goes straight into the memoryview,
+            # bypassing the buffer of the file object
+            if offset > 0:
+                f.raw.seek(offset)
+            return read_fully(f.raw, view)
+
+    def get_into(self, irods_path, buffer, offset=0, streams=1,
+                 verbose=False, **options):
+        """ Reads the content of a data object straight into the given
+        writable buffer (e.g. a bytearray, a NumPy array or an mmap),
+        without intermediate copies, and returns the number of bytes
+        read. The buffer gets filled from the given offset in the data
+        object on, until it is full or the data object ends.
+
+        Example:
+
+        >>> array = numpy.empty(1000, dtype=float)
+        >>> session.bulk.get_into('~/arrays/x.bin', array)
 
-                    if not clobber:
-                        ok = not file_exists
+        Arguments:
 
-                    if interactive:
-                        ok = confirm('get', 'object',
-                                     path +' to destination ' + local_path)
+        irods_path: str
+            The (absolute or relative) path of the data object
 
-                    if ok:
-                        self.log('Getting object %s to destination %s' % \
-                                 (path, local_path), verbose)
-                        extra_options = {FORCE_FLAG_KW: ''}
-                        obj = self.session.data_objects.get(path,
-                                                            local_path,
-                                                            **extra_options,
-                                                            **options)
-                    else:
-                        self.log('Skipped getting object %s to destination %s' \
-                                 % (path, local_path), verbose)
+        buffer: object supporting the buffer protocol
+            The (writable and contiguous) buffer to fill
 
-        if return_data_objects:
-            return objects
+        offset: int (default: 0)
+            The offset in the data object from which to read
+
+        streams: int (default: 1)
+            The number of streams, each over a separate connection and
+            filling its own part of the buffer (see get())
+
+        verbose: bool (default: False)
+            Whether to print more output.
+
+        options: (any remaining keywords arguments)
+            Additional options to be passed on to PRC's
+            data_objects.open() method.
+        """
+        path = self.session.path.get_absolute_irods_path(irods_path)
+        view = memoryview(buffer).cast('B')
+        if view.readonly:
+            raise TypeError('Cannot read %s into a read-only buffer' % path)
+
+        if streams > 1:
+            size = self._object_entry(path).size
+            count = max(min(len(view), size - offset), 0)
+
+            def get_range(start, length, report):
+                n = self._read_into(path, view[start:start + length],
+                                    offset=offset + start, **options)
+                if n < length:
+                    raise IOError('Unexpected end of data object ' + \
+                                  '%s at offset %d' % \
+                                  (path, offset + start + n))
+                report(start + length)
+
+            self._transfer_ranges(get_range,
+                                  self._split_ranges(count, streams),
+                                  streams)
+        else:
+            count = self._read_into(path, view, offset=offset, **options)
+
+        self.log('Got object %s into buffer (%d bytes)' % (path, count),
+                 verbose)
+        return count
+
+    def get_buffers(self, iterator, buffer=None, recurse=False, align=1,
+                    workers=4, shard=None, verbose=False, **options):
+        """ Reads the content of iRODS data objects straight into
+        consecutive slices of one buffer (see get_into()), several
+        data objects at a time, and returns a dictionary with the
+        absolute paths of the data objects and the memoryviews of
+        their slices (in the order of the iterator).
+
+        Example:
+
+        >>> views = session.bulk.get_buffers('~/arrays/*.bin', workers=8)
+        >>> arrays = {path: numpy.frombuffer(view)
+                      for path, view in views.items()}
+
+        Arguments:
+
+        iterator: iterator or str
+            Defines which items are subject to the bulk operation.
+            Can be an iterator (e.g. using search_manager.find())
+            or a string (which will be used to construct a
+            search_manager.iglob() iterator). Matching data objects
+            (and, if used recursively, the data objects in matching
+            collections) will be read.
+
+        buffer: None or object supporting the buffer protocol
+            (default: None)
+            The (writable and contiguous) buffer to fill, which must be
+            large enough for all data objects. None means that a
+            bytearray of the right size gets allocated.
+
+        recurse: bool (default: False)
+            Whether to use recursion, meaning that also the data objects
+            in matching collections and their subcollections are read.
+
+        align: int (default: 1)
+            The slices start at multiples of this number of bytes
+            (e.g. the item size of a NumPy dtype)
+
+        workers: int (default: 4)
+            The number of data objects to read concurrently,
+            each over a separate connection.
+
+        shard: None, (int, int) tuple or 'auto' (default: None)
+            If not None, only the items in the given shard are read
+            (see :func:`vsc_irods.manager.search_manager.get_shard`)
+
+        verbose: bool (default: False)
+            Whether to print more output, including a summary
+            at the end.
+
+        options: (any remaining keywords arguments)
+            Additional options to be passed on to PRC's
+            data_objects.open() method.
+        """
+        slices = []
+        total = 0
+        for path, size in self._iterate_objects(iterator, recurse=recurse,
+                                                shard=shard, verbose=verbose):
+            total = -(-total // align) * align
+            slices.append((path, total, size))
+            total += size
+
+        if buffer is None:
+            buffer = bytearray(total)
+
+        view = memoryview(buffer).cast('B')
+        if view.readonly:
+            raise TypeError('Cannot read into a read-only buffer')
+        if len(view) < total:
+            raise ValueError('The buffer is too small (%d bytes instead ' \
+                             'of %d)' % (len(view), total))
+
+        def get_one(path, start, size):
+            count = self._read_into(path, view[start:start + size],
+                                    **options)
+            if count < size:
+                raise IOError('Unexpected end of data object %s at ' \
+                              'offset %d' % (path, count))
+            self.log('Got object %s into buffer at offset %d (%d bytes)' % \
+                     (path, start, size), verbose)
+            return size
+
+        tasks = [('getting object %s into buffer' % path, get_one,
+                  (path, start, size)) for path, start, size in slices]
+
+        start = time.time()
+        results, failures = self._run_tasks(tasks, workers=workers)
+        self._log_summary('Got', results, 0, failures, time.time() - start,
+                          verbose)
+
+        if len(failures) > 0:
+            raise BulkOperationError(failures)
+
+        return {path: view[start:start + size]
+                for path, start, size in slices}
+
+    def read_ranges(self, iterator, ranges, recurse=False, workers=4,
+                    shard=None, verbose=False, **options):
+        """ Yields (absolute path, list of bytearrays) tuples with the
+        given byte ranges of iRODS data objects, in the order of the
+        iterator, so that e.g. previewing the headers of large data
+        objects only transfers those headers.
+
+        Every data object is opened once, after which only the given
+        ranges are read (straight into their bytearrays, see get_into()).
+        Ranges which extend beyond the end of a data object are cut
+        short. Several data objects are read concurrently, ahead of
+        the one which is yielded.
+
+        Example:
+
+        >>> for path, (header, tail) in session.bulk.read_ranges(
+                    '~/trajectories/*.xyz', [(0, 4096), (-1024, None)]):
+        >>>     natoms = int(header.split(b'\\n')[0])
+
+        Arguments:
+
+        iterator: iterator or str
+            Defines which items are subject to the bulk operation.
+            Can be an iterator (e.g. using search_manager.find())
+            or a string (which will be used to construct a
+            search_manager.iglob() iterator). Matching data objects
+            (and, if used recursively, the data objects in matching
+            collections) will be read.
+
+        ranges: list of (int, int or None) tuples
+            The (offset, length) tuples of the byte ranges to read.
+            A negative offset counts from the end of the data object
+            and a length of None means 'up to the end'.
+
+        recurse: bool (default: False)
+            Whether to use recursion, meaning that also the data objects
+            in matching collections and their subcollections are read.
+
+        workers: int (default: 4)
+            The number of data objects to read concurrently (and ahead),
+            each over a separate connection.
+
+        shard: None, (int, int) tuple or 'auto' (default: None)
+            If not None, only the items in the given shard are read
+            (see :func:`vsc_irods.manager.search_manager.get_shard`)
+
+        verbose: bool (default: False)
+            Whether to print more output.
+
+        options: (any remaining keywords arguments)
+            Additional options to be passed on to PRC's
+            data_objects.open() method.
+        """
+        def read_one(path, size):
+            clipped = [clip_range(offset, length, size)
+                       for offset, length in ranges]
+            buffers = [bytearray(length) for offset, length in clipped]
+
+            if sum(len(buffer) for buffer in buffers) > 0:
+                with self.session.data_objects.open(path, 'r',
+                                                    **options) as f:
+                    for (offset, length), buffer in zip(clipped, buffers):
+                        f.raw.seek(offset)
+                        count = read_fully(f.raw, memoryview(buffer))
+                        del buffer[count:]
+
+            self.log('Read %d bytes from object %s' % \
+                     (sum(len(buffer) for buffer in buffers), path), verbose)
+            return path, buffers
+
+        executor = ThreadPoolExecutor(max_workers=max(workers, 1))
+        futures = deque()
+
+        try:
+            for path, size in self._iterate_objects(iterator, recurse=recurse,
+                                                    shard=shard,
+                                                    verbose=verbose):
+                futures.append(executor.submit(read_one, path, size))
+                if len(futures) > workers:
+                    yield futures.popleft().result()
+
+            while len(futures) > 0:
+                yield futures.popleft().result()
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def iter_open(self, iterator, recurse=False, prefetch=4,
+                  read_ahead=1024**2, shard=None, verbose=False, **options):
+        """ Yields readable, seekable file objects for the content of
+        iRODS data objects (see :class:`vsc_irods.reader.DataObjectReader`),
+        without storing them on the local file system.
+
+        While the caller works on one data object, the next ones are
+        already opened (and, if they fit in a single block, read as
+        a whole) in the background, and the next block of every opened
+        data object is read ahead, so that looping over many (small)
+        data objects does not have to wait for a round trip to the
+        server for each of them. Every reader should be closed after
+        use (e.g. with a 'with' statement), to give back its connection.
+
+        Example:
+
+        >>> for f in session.bulk.iter_open('~/molecules/*.xyz'):
+        >>>     with f:
+        >>>         natoms = int(f.readline())
+
+        Arguments:
+
+        iterator: iterator or str
+            Defines which items are subject to the bulk operation.
+            Can be an iterator (e.g. using search_manager.find())
+            or a string (which will be used to construct a
+            search_manager.iglob() iterator). Matching data objects
+            (and, if used recursively, the data objects in matching
+            collections) will be opened, in the order of the iterator.
+
+        recurse: bool (default: False)
+            Whether to use recursion, meaning that also the data objects
+            in matching collections and their subcollections are opened.
+
+        prefetch: int (default: 4)
+            The number of data objects which are opened ahead,
+            each over a separate connection
+
+        read_ahead: int (default: 1024**2)
+            The number of bytes which are read at once (and ahead)
+
+        shard: None, (int, int) tuple or 'auto' (default: None)
+            If not None, only the items in the given shard are opened
+            (see :func:`vsc_irods.manager.search_manager.get_shard`)
+
+        verbose: bool (default: False)
+            Whether to print more output.
+
+        options: (any remaining keywords arguments)
+            Additional options to be passed on to PRC's
+            data_objects.open() method.
+        """
+        def open_one(path, size):
+            self.log('Opening object %s' % path, verbose)
+            f = self.session.data_objects.open(path, 'r', **options)
+            try:
+                data = f.read(min(size, read_ahead))
+            except Exception:
+                f.close()
+                raise
+
+            if size <= read_ahead:
+                # Read as a whole, so the connection is not needed anymore
+                f.close()
+                f = None
+
+            return DataObjectReader(path, size, f=f, data=data,
+                                    read_ahead=read_ahead, executor=executor)
+
+        executor = ThreadPoolExecutor(max_workers=max(prefetch, 1))
+        futures = deque()
+
+        try:
+            for path, size in self._iterate_objects(iterator, recurse=recurse,
+                                                    shard=shard,
+                                                    verbose=verbose):
+                futures.append(executor.submit(open_one, path, size))
+                if len(futures) > prefetch:
+                    yield futures.popleft().result()
+
+            while len(futures) > 0:
+                yield futures.popleft().result()
+        finally:
+            # Readers which have been opened ahead, but which have
+            # not been handed out, are closed again
+            for future in futures:
+                if not future.cancel() and future.exception() is None:
+                    future.result().close()
+            executor.shutdown(wait=False)
+
+    def prefetch(self, iterator, local_path='.', recurse=False, workers=1,
+                 verbose=False, **options):
+        """ Starts copying iRODS data objects and/or collections to the
+        local machine in a background process, and returns at once
+        with a :class:`vsc_irods.stage.Stage` handle, which allows
+        to wait for individual files (or for the whole stage-in).
+
+        The background process sets up its own iRODS session and
+        downloads the data objects in the order of the given patterns
+        (see get()), each to a temporary file which is only renamed
+        once it is complete. The state of the stage-in is kept in hidden
+        '.vsc-prc-stage.*' files in the destination, including the log
+        output and a journal listing the planned transfers.
+
+        Examples:
+
+        >>> stage = session.bulk.prefetch(['~/inputs/a.xyz', '~/inputs/*'],
+                                          local_path=os.environ['VSC_SCRATCH'])
+        >>> stage.wait('a.xyz')
+        >>> stage.join()
+
+        Arguments:
+
+        iterator: str, list of str or iterator
+            Defines which items are to be downloaded. Strings are
+            glob patterns, which are processed one after the other
+            in the background process. Other iterators (e.g. using
+            search_manager.find()) get evaluated before the background
+            process is started.
+
+        local_path: str (default: '.')
+            The (absolute or relative) path on the local file system
+            where the data objects and collections will be copied to.
+            Any earlier stage-in to this path is forgotten.
+
+        recurse: bool (default: False)
+            Whether to use recursion, meaning that also matching collections
+            and their data objects and subcollections will be copied.
+
+        workers: int (default: 1)
+            The number of data objects to transfer concurrently.
+
+        verbose: bool (default: False)
+            Whether to print more output (to the log file).
+
+        options: (any remaining keywords arguments)
+            Additional options to be passed on to get()
+            (e.g. 'sync', 'streams' or 'cache').
+        """
+        if not os.path.isdir(local_path):
+            raise OSError('Destination %s does not exist' % local_path)
+
+        if isinstance(iterator, str):
+            iterator = [iterator]
+
+        if all(isinstance(item, str) for item in iterator):
+            groups = list(iterator)
+        else:
+            groups = [list(iterator)]
+
+        stage = Stage(local_path)
+        stage.reset()
+
+        for stream in [sys.stdout, sys.stderr, self.session.txt]:
+            stream.flush()
+
+        pid = os.fork()
+        if pid > 0:
+            stage.start(pid)
+            return stage
+
+        # In the background process: the connections of the session
+        # are left alone, as they are shared with the parent process
+        errors = []
+
+        try:
+            with open(os.devnull, 'r') as devnull:
+                os.dup2(devnull.fileno(), sys.stdin.fileno())
+            with open(stage.log_file, 'a') as log:
+                for stream in [sys.stdout, sys.stderr]:
+                    os.dup2(log.fileno(), stream.fileno())
+
+            with TransferJournal(stage.journal_file) as journal, \
+                 self.session.__class__(txt='-',
+                                        **self.session.options) as session:
+                session.path.ichdir(self.session.path.get_irods_cwd())
+
+                for items in groups:
+                    try:
+                        session.bulk.get(items, local_path=stage.local_path,
+                                         recurse=recurse, workers=workers,
+                                         journal=journal, atomic=True,
+                                         verbose=verbose, **options)
+                    except Exception as error:
+                        print('Staging in failed: %s' % error)
+                        errors.append(str(error))
+        except Exception as error:
+            errors.append(str(error))
+        finally:
+            # The background process must never return to the caller
+            try:
+                stage.finish(errors)
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(1 if errors else 0)
 
     def put(self, iterator, irods_path='.', recurse=False, clobber=True,
-            interactive=False, verbose=False, create_options={}, **options):
+            interactive=False, verbose=False, create_options={}, *,
+            sync=False, checksum=False, workers=1, streams=1,
+            large_threshold=1024**3, journal=None, resume=False,
+            shard=None, object_avu=[], bundle_size=None, **options):
         """ Copy local files and/or folders to the iRODS server,
         in a manner that resembles the UNIX 'cp' command.
 
@@ -330,13 +1863,81 @@ class BulkManager(Manager):
         clobber: bool (default: True)
             Whether to overwrite existing data objects.
 
+        sync: bool (default: False)
+            Whether to only copy files which are new or have changed,
+            in a manner that resembles 'rsync'. Existing data objects
+            are compared with the local files by size and modification
+            time (or by checksum, see below), where files which are more
+            recent than the corresponding data objects are considered
+            to have changed. If True, the 'clobber' argument is ignored.
+
+        checksum: bool (default: False)
+            Whether to compare existing data objects with local files
+            of the same size by checksum instead of modification time
+            (only relevant if 'sync' is True). Data objects without
+            a registered checksum are still compared by modification
+            time.
+
         interactive: bool (default: False)
             Whether to prompt for permission before overwriting
             existing data objects. If True, the value of the 'clobber'
             argument is ignored.
 
+        workers: int (default: 1)
+            The number of files to transfer concurrently, each over
+            a separate connection from the session's pool. All transfers
+            are first planned (and, if interactive, confirmed) and the
+            missing collections are created before they are started.
+
+        streams: int (default: 1)
+            The number of streams used for files that are at least
+            'large_threshold' bytes in size. Such files are split in
+            byte ranges which are written concurrently, each over a
+            separate connection, at their offsets in the data object.
+            The default (1) means that every file is transferred
+            in a single stream.
+
+        large_threshold: int (default: 1024**3)
+            The size (in bytes) from which files are transferred
+            in multiple streams (only relevant if 'streams' > 1).
+
+        journal: None, str or TransferJournal (default: None)
+            The journal (or the path to the journal file) in which
+            the planned and completed transfers are recorded
+            (see :class:`vsc_irods.journal.TransferJournal`).
+
+        resume: bool (default: False)
+            Whether to resume the transfers recorded in the journal,
+            meaning that completed transfers are skipped and that files
+            transferred in multiple streams continue from the completed
+            byte ranges. If True, the 'clobber' and 'sync' arguments
+            are ignored for transfers in the journal.
+
+        shard: None, (int, int) tuple or 'auto' (default: None)
+            If not None, only the files and folders in the given shard
+            are copied (see :func:`vsc_irods.manager.search_manager.get_shard`)
+
+        object_avu: tuple or list of tuples (default: [])
+            Metadata to add to the uploaded data objects, once all
+            transfers are done (see metadata() and job_metadata()).
+
+        bundle_size: None or int (default: None)
+            If not None, every folder is stored (with its subfolders)
+            as tar archives ('bundles') of about this size in bytes,
+            instead of as one data object per file, which saves the
+            per-object overhead for many small files. The archives are
+            streamed into the data objects and an index of the files is
+            stored with them (see :mod:`vsc_irods.bundle`), so that
+            single files can be read with read_member(). Bundles get
+            extracted again by get(). Existing bundles are replaced
+            (or, if 'sync' is True, only if some file has changed) by
+            bundles with new names, and only removed once the new index
+            is in place, so that an interrupted put leaves the old
+            bundles intact.
+
         verbose: bool (default: False)
-            Whether to print more output.
+            Whether to print more output, including a summary
+            at the end.
 
         create_options: dict (default: {})
             Additional options to be passed on to PRC's
@@ -344,61 +1945,300 @@ class BulkManager(Manager):
 
         options: (any remaining keywords arguments)
             Additional options to be passed on to PRC's
-            data_objects.put() method.
+            data_objects.put() method (or data_objects.open(),
+            for files transferred in multiple streams).
         """
         if type(iterator) is str:
             iterator = glob.iglob(iterator)
 
+        if shard is not None:
+            def get_size(local_path):
+                if os.path.isdir(local_path):
+                    return sum([local_stat.st_size
+                                for folder, subfolders, files
+                                in scan_local(local_path)
+                                for filename, local_stat in files])
+                return os.path.getsize(local_path)
+
+            iterator = shard_items(iterator, *get_shard(shard),
+                                   size=get_size)
+
         dest = self.session.path.get_absolute_irods_path(irods_path)
 
-        if not self.session.collections.exists(dest):
+        if not self.session.path.is_collection(dest):
             raise CollectionDoesNotExist(dest)
 
+        close_journal = isinstance(journal, str)
+        if close_journal:
+            journal = TransferJournal(journal, resume=resume)
+
+        search = self.session.search
+
+        # First plan the transfers: which files go into which
+        # collections, and which collections need to be created
+        files = []
+        directories = []
+
         for item in iterator:
             local_path = item.rstrip('/')
             path = os.path.join(dest, os.path.basename(local_path))
 
             if os.path.isdir(local_path):
                 if recurse:
-                    if not self.session.collections.exists(path):
-                        self.log('Creating collection: %s' % path, verbose)
-                        self.session.collections.create(path, recurse=True,
-                                                        **create_options)
-
-                    self.put(local_path + '/*', irods_path=path, recurse=True,
-                             clobber=clobber, interactive=interactive,
-                             create_options=create_options, verbose=verbose,
-                             **options)
+                    directories.append((local_path, path))
                 else:
                     self.log('Skipping collection %s (no recursion)' % \
                              local_path, verbose)
 
             elif os.path.isfile(local_path):
-                object_exists = self.session.data_objects.exists(path)
+                files.append((local_path, dest, os.stat(local_path)))
+
+        # The existing collections and (if needed) data objects at the
+        # destination are listed with a few queries, instead of checking
+        # them one by one
+        existing_collections = set()
+        existing_objects = {}
+        list_objects = sync or not clobber
+
+        if list_objects and len(files) > 0:
+            criteria = [Criterion('=', Collection.name, dest)]
+            q = search._query_entries('f', criteria)
+            for result in search._results(q):
+                entry = search._make_entry('f', result)
+                existing_objects[entry.abs_path] = entry
+
+        collections = []
+        bundled = []
+
+        for local_path, path in directories:
+            if bundle_size is not None:
+                # Only the collection holding the bundles is needed
+                if self.session.path.is_collection(path):
+                    existing_collections.add(path)
+                collections.append(path)
+                bundled.append((local_path, path))
+                continue
+
+            for entry, depth in search._iter_subtree(path, 'd'):
+                existing_collections.add(entry.abs_path)
+
+            if list_objects:
+                for entry, depth in search._iter_subtree(path, 'f'):
+                    existing_objects[entry.abs_path] = entry
+
+            for folder, subfolders, filenames in scan_local(local_path):
+                collection = os.path.normpath(os.path.join(path,
+                                        os.path.relpath(folder, local_path)))
+                collections.append(collection)
+
+                for filename, local_stat in filenames:
+                    files.append((os.path.join(folder, filename),
+                                  collection, local_stat))
+
+        self._create_collections(collections, existing_collections,
+                                 verbose=verbose, **create_options)
+
+        def upload(local_path, collection, size, mtime=None):
+            if streams > 1 and size >= large_threshold:
+                path = os.path.join(collection, os.path.basename(local_path))
+                completed = []
+                progress = None
+
+                if journal is not None:
+                    key = (os.path.abspath(local_path), path)
+                    completed = journal.completed_ranges(*key, size,
+                                                         mtime=mtime)
+                    progress = lambda offset, length: \
+                                      journal.partial(*key, offset, length)
+
+                self._put_ranges(local_path, path, size, streams,
+                                 completed=completed, progress=progress,
+                                 **options)
+            else:
+                self.session.data_objects.put(local_path, collection + '/',
+                                              **options)
+                path = os.path.join(collection, os.path.basename(local_path))
+                self.session.lookups.set(path, 'f', True)
+            self.log('Put file %s in collection %s (%d bytes)' % \
+                     (local_path, collection, size), verbose)
+            return size
+
+        tasks = []
+        targets = []
+        skipped = 0
+
+        bundle_indices = {}
+        bundle_plans = []
+
+        def upload_bundle(path, members):
+            with self._open_put(path, 'w', **options) as f:
+                size, index = write_bundle(f, members)
+            self._replicate_put(path, **options)
+            self.session.lookups.set(path, 'f', True)
+            bundle_indices[path] = index
+            self.log('Put bundle %s (%d files, %d bytes)' % \
+                     (path, len(members), size), verbose)
+            return size
+
+        for local_path, path in bundled:
+            members = [(os.path.relpath(os.path.join(folder, filename),
+                                        local_path),
+                        os.path.join(folder, filename), local_stat)
+                       for folder, subfolders, filenames
+                       in scan_local(local_path)
+                       for filename, local_stat in filenames]
+            old_index = self.bundle_index(path)
 
-                ok = True
+            ok = True
 
-                if not clobber:
-                    ok = not object_exists
+            if old_index is not None:
+                if sync:
+                    old_members = {name: tuple(member[2:4]) for name, member
+                                   in old_index['members'].items()}
+                    new_members = {name: (local_stat.st_size,
+                                          int(local_stat.st_mtime))
+                                   for name, _, local_stat in members}
+                    ok = old_members != new_members
+                elif not clobber:
+                    ok = False
+
+                if interactive and (ok or not sync):
+                    ok = confirm('replace', 'bundles',
+                                 'in collection %s with folder %s' % \
+                                 (path, local_path))
+
+            if not ok:
+                skipped += len(members)
+                self.log('Skipped putting folder %s as bundles in ' \
+                         'collection %s' % (local_path, path), verbose)
+                continue
+
+            # New bundles get new names, so that the old index stays
+            # valid until the new one replaces it
+            generation = 1
+            if old_index is not None:
+                generation = old_index.get('generation', 0) + 1
+
+            names = []
+            for index, bundle in enumerate(plan_bundles(members,
+                                                        bundle_size)):
+                names.append(bundle_name % (generation, index))
+                bundle_path = os.path.join(path, names[-1])
+                description = 'putting bundle %s from folder %s' % \
+                              (bundle_path, local_path)
+                tasks.append((description, upload_bundle,
+                              (bundle_path, [(name, local_file)
+                                             for name, local_file, _
+                                             in bundle])))
+                targets.append(bundle_path)
+
+            bundle_plans.append((path, names, generation, old_index))
+
+        for local_path, collection, local_stat in files:
+            path = os.path.join(collection, os.path.basename(local_path))
 
-                if interactive:
-                    ok = confirm('put', 'file',
-                                 local_path +' in collection ' + dest)
+            ok = True
 
-                if ok:
-                    self.log('Putting file %s in collection %s' % \
-                             (local_path, dest), verbose)
-                    self.session.data_objects.put(local_path, dest + '/',
-                                                  **options)
-                else:
-                    self.log('Skipped putting file %s in collection %s' % \
-                             (local_path, dest), verbose)
+            if sync:
+                if path in existing_objects:
+                    ok = self._is_changed(local_path, local_stat,
+                                          existing_objects[path], checksum,
+                                          'put')
+            elif not clobber:
+                ok = path not in existing_objects
+
+            if journal is not None:
+                # A file which gets rewritten with the same size
+                # has a different modification time
+                key = (os.path.abspath(local_path), path)
+                size, mtime = local_stat.st_size, local_stat.st_mtime_ns
+
+                if resume and journal.is_planned(*key):
+                    # Unfinished transfers are always carried out
+                    # (e.g. a data object truncated by a killed job)
+                    ok = not journal.is_done(*key, size, mtime=mtime)
+
+            if interactive and (ok or not sync):
+                ok = confirm('put', 'file',
+                             local_path +' in collection ' + collection)
+
+            if ok:
+                description = 'putting file %s in collection %s' % \
+                              (local_path, collection)
+                function = upload
+
+                if journal is not None:
+                    journal.planned(*key, size, mtime=mtime)
+                    function = self._journal_task(journal, key, upload)
+
+                tasks.append((description, function,
+                              (local_path, collection, local_stat.st_size,
+                               local_stat.st_mtime_ns)))
+                targets.append(path)
+            else:
+                skipped += 1
+                self.log('Skipped putting file %s in collection %s' % \
+                         (local_path, collection), verbose)
+
+        start = time.time()
+        results, failures = self._run_tasks(tasks, workers=workers)
+
+        # The index of a bundled folder is only written once all
+        # its bundles are in place, after which the old bundles are
+        # removed (or, if some bundle failed, the new ones)
+        for path, names, generation, old_index in bundle_plans:
+            paths = [os.path.join(path, name) for name in names]
+            removed = []
+
+            if all(bundle_path in bundle_indices for bundle_path in paths):
+                index_path = os.path.join(path, bundle_index_name)
+                with self._open_put(index_path, 'w', **options) as f:
+                    write_index(f, names, [bundle_indices[bundle_path]
+                                           for bundle_path in paths],
+                                generation=generation)
+                self._replicate_put(index_path, **options)
+                self.session.lookups.set(index_path, 'f', True)
+
+                if old_index is not None:
+                    removed = [os.path.join(path, name)
+                               for name in old_index['bundles']]
+            else:
+                removed = [bundle_path for bundle_path in paths
+                           if bundle_path in bundle_indices]
 
+            for bundle_path in removed:
+                self.log('Removing unused bundle %s' % bundle_path, verbose)
+                self.session.data_objects.unlink(bundle_path, force=True)
+                self.session.lookups.invalidate(bundle_path)
+
+        if close_journal:
+            journal.close()
+
+        self._log_summary('Put', results, skipped, failures,
+                          time.time() - start, verbose)
+
+        if len(object_avu) > 0:
+            paths = [path for path, result in zip(targets, results)
+                     if result is not None]
+            if len(paths) > 0:
+                self.metadata(paths, action='add', object_avu=object_avu,
+                              workers=max(workers, 4), verbose=verbose)
+
+        if len(failures) > 0:
+            raise BulkOperationError(failures)
 
     def metadata(self, iterator, action='add', recurse=False, collection_avu=[],
-                 object_avu=[], verbose=False):
+                 object_avu=[], verbose=False, *, workers=4, shard=None):
         """ Add or remove metadata to iRODS data objects and/or collections.
 
+        The existing metadata of the targeted items is first listed with
+        a few queries, after which only the changes which are needed are
+        sent, for several items concurrently. All the changes to an item
+        are sent in a single atomic request, if supported by PRC and the
+        iRODS server (otherwise one request per changed AVU is needed).
+        Items which already have (or, for removal, do not have) the given
+        AVUs are left untouched.
+
         Examples:
 
         >>> session.bulk.metadata('tmpdir*', action='add', recurse=True,
@@ -416,6 +2256,9 @@ class BulkManager(Manager):
 
         action: str
             The action to perform. Choose either 'add' or 'remove'.
+            Adding AVUs replaces any existing AVUs with the same
+            attribute names (where several AVUs with the same
+            attribute name are all added).
 
         recurse: bool (default: False)
             Whether to use recursion, meaning that metadata will be
@@ -430,12 +2273,18 @@ class BulkManager(Manager):
             One or several attribute-value[-unit]] tuples to be modified
             for data objects.
 
+        workers: int (default: 4)
+            The number of items for which the metadata is modified
+            concurrently, each over a separate connection from
+            the session's pool.
+
+        shard: None, (int, int) tuple or 'auto' (default: None)
+            If not None, only the items in the given shard are processed
+            (see :func:`vsc_irods.manager.search_manager.get_shard`)
+
         verbose: bool (default: False)
             Whether to print more output.
         """
-        if isinstance(iterator, str):
-            iterator = self.session.search.iglob(iterator)
-
         if action not in ['add', 'remove']:
             raise OperationNotSupported('Unknown action "%s"' % action)
 
@@ -447,45 +2296,181 @@ class BulkManager(Manager):
         if isinstance(object_avu, tuple): object_avu = [object_avu]
         if isinstance(collection_avu, tuple): collection_avu = [collection_avu]
 
-        for item in iterator:
-            path = self.session.path.get_absolute_irods_path(item)
+        search = self.session.search
 
-            if self.session.collections.exists(path):
-                # Item is a collection, not an object
-                kind = 'collection'
+        # First gather the targets, as (model, absolute path) tuples,
+        # together with the criteria for listing their metadata
+        targets = []
+        listings = []
 
+        for item in self._iterate(iterator, shard=shard):
+            item, path, is_collection = self._resolve(item)
+
+            if is_collection:
+                # Item is a collection, not an object
                 if recurse:
-                    for avu in collection_avu:
-                        self.log(log_msg.format(avu=avu, kind=kind, path=path),
-                                 verbose)
-
-                        meta = iRODSMeta(*avu)
-                        if action == 'add':
-                            self.session.metadata.set(Collection, path, meta)
-                        elif action == 'remove':
-                            self.session.metadata.remove(Collection, path, meta)
-
-                    self.metadata(item + '/*', action, recurse=True,
-                                  collection_avu=collection_avu,
-                                  object_avu=object_avu,
-                                  verbose=verbose)
+                    for entry, depth in search._iter_subtree(path, 'd'):
+                        targets.append((Collection, entry.abs_path))
+                    for entry, depth in search._iter_subtree(path, 'f'):
+                        targets.append((DataObject, entry.abs_path))
+
+                    prefix = path.rstrip('/')
+                    listing = ('like', prefix + '%')
                 else:
                     self.log('Skipping collection %s (no recursion)' % item,
                              verbose)
+                    continue
             else:
-                kind = 'data object'
+                targets.append((DataObject, path))
+                listing = ('=', os.path.dirname(path))
 
-                for avu in object_avu:
-                    self.log(log_msg.format(avu=str(avu), kind=kind, path=path),
-                             verbose)
+            if listing not in listings:
+                listings.append(listing)
+
+        targets = list(dict.fromkeys(targets))
+
+        avus = {Collection: [iRODSMeta(*avu) for avu in collection_avu],
+                DataObject: [iRODSMeta(*avu) for avu in object_avu]}
+
+        existing = self._list_metadata(listings, avus, set(targets))
+
+        # Then work out the changes for every target
+        tasks = []
+        unchanged = 0
+
+        for model, path in targets:
+            if len(avus[model]) == 0:
+                continue
+
+            new = [(meta.name, meta.value, meta.units or '')
+                   for meta in avus[model]]
+            old = existing.get((model, path), [])
 
-                    meta = iRODSMeta(*avu)
-                    if action == 'add':
-                        self.session.metadata.set(DataObject, path, meta)
-                    elif action == 'remove':
-                        self.session.metadata.remove(DataObject, path, meta)
+            if action == 'add':
+                operations = []
+                for name in dict.fromkeys([avu[0] for avu in new]):
+                    old_values = [avu for avu in old if avu[0] == name]
+                    new_values = [avu for avu in new if avu[0] == name]
 
-    def add_job_metadata(self, iterator, recurse=False, verbose=False):
+                    if len(new_values) == 1 and len(old_values) > 0 and \
+                       old_values != new_values:
+                        # Replaces all other values (in one request,
+                        # if not applied atomically)
+                        operations.append(('set', new_values[0]))
+                        continue
+
+                    operations += [('remove', avu) for avu in old_values
+                                   if avu not in new_values]
+                    operations += [('add', avu) for avu in new_values
+                                   if avu not in old_values]
+            else:
+                operations = [('remove', avu) for avu in new if avu in old]
+
+            kind = 'collection' if model is Collection else 'data object'
+
+            if len(operations) == 0:
+                unchanged += 1
+                self.log('Metadata of %s %s is already up to date' % \
+                         (kind, path), verbose)
+                continue
+
+            for avu in (collection_avu if model is Collection else object_avu):
+                self.log(log_msg.format(avu=str(avu), kind=kind, path=path),
+                         verbose)
+
+            description = 'modifying metadata of %s %s' % (kind, path)
+            tasks.append((description, self._change_metadata,
+                          (model, path, operations, old)))
+
+        start = time.time()
+        results, failures = self._run_tasks(tasks, workers=workers)
+        msg = 'Modified metadata of %d items in %.2f s, %d unchanged, ' + \
+              '%d failed'
+        self.log(msg % (len(tasks) - len(failures), time.time() - start,
+                        unchanged, len(failures)), verbose)
+
+        if len(failures) > 0:
+            raise BulkOperationError(failures)
+
+    def _list_metadata(self, listings, avus, targets):
+        """ Returns a dictionary with, for each of the given (model,
+        absolute path) targets, the list of its (name, value, units)
+        AVUs with the same attribute names as the given AVUs (which is
+        a dictionary with a list of iRODSMeta instances per model).
+
+        The listings are ('like' or '=', collection name) tuples,
+        defining the queries to be run for each model.
+        """
+        existing = {}
+
+        for model, meta_model in [(Collection, CollectionMeta),
+                                  (DataObject, DataObjectMeta)]:
+            names = sorted(set([meta.name for meta in avus[model]]))
+            if len(names) == 0:
+                continue
+
+            columns = [Collection.name, meta_model.name, meta_model.value,
+                       meta_model.units]
+            if model is DataObject:
+                columns.insert(1, DataObject.name)
+
+            for op, collection in listings:
+                q = self.session.query(*columns)
+                q = q.filter(Criterion(op, Collection.name, collection),
+                             In(meta_model.name, names))
+
+                for result in self.session.search._results(q):
+                    path = result[Collection.name]
+                    if model is DataObject:
+                        path = os.path.join(path, result[DataObject.name])
+
+                    key = (model, path)
+                    if key in targets:
+                        avu = (result[meta_model.name],
+                               result[meta_model.value],
+                               result[meta_model.units] or '')
+                        if avu not in existing.setdefault(key, []):
+                            existing[key].append(avu)
+
+        return existing
+
+    def _change_metadata(self, model, path, operations, old=[]):
+        """ Applies the given ('set', 'add' or 'remove', (name, value,
+        units)) operations to the given (model, absolute path) target,
+        given its current (name, value, units) AVUs with the same names.
+
+        The operations are applied in a single atomic request if
+        supported by PRC and the iRODS server, and else with one
+        request per operation.
+        """
+        if self.atomic_metadata:
+            avu_operations = []
+            for operation, avu in operations:
+                if operation == 'set':
+                    avu_operations += [AVUOperation(operation='remove',
+                                                    avu=iRODSMeta(*other))
+                                       for other in old
+                                       if other[0] == avu[0] and other != avu]
+                    if avu in old:
+                        continue
+                    operation = 'add'
+                avu_operations.append(AVUOperation(operation=operation,
+                                                   avu=iRODSMeta(*avu)))
+
+            try:
+                self.session.metadata.apply_atomic_operations(model, path,
+                                                        *avu_operations)
+                return
+            except SYS_UNMATCHED_API_NUM:
+                # The server does not offer atomic metadata operations
+                self.atomic_metadata = False
+
+        for operation, avu in operations:
+            function = getattr(self.session.metadata, operation)
+            function(model, path, iRODSMeta(*avu))
+
+    def add_job_metadata(self, iterator, recurse=False, verbose=False, *,
+                         workers=4):
         """ Add job-related metadata to selected data objects and collections.
 
         Examples:
@@ -506,37 +2491,38 @@ class BulkManager(Manager):
             added to matching collections and their data objects and
             subcollections.
 
+        workers: int (default: 4)
+            The number of items for which the metadata is added
+            concurrently (see metadata()).
+
         verbose: bool (default: False)
             Whether to print more output.
         """
         # Gather job-related information from available environment variables
-        avus = []
-        for key in job_env_var:
-            if key in os.environ:
-                if key.endswith('FILE'):
-                    # e.g. $PBS_NODEFILE is special, as it refers to a file
-                    with open(os.environ[key], 'r') as f:
-                        value = ','.join([line.strip() for line in f])
-
-                    listkey = key.replace('FILE', 'LIST')
-                    avus.append((listkey, value))
-                else:
-                    avus.append((key, os.environ[key]))
+        avus = job_metadata()
 
         self.metadata(iterator, action='add',
                       collection_avu=avus,
                       object_avu=avus,
                       recurse=recurse,
+                      workers=workers,
                       verbose=verbose)
 
-    def size(self, iterator, recurse=False, verbose=False):
+    def size(self, iterator, recurse=False, verbose=False, *, max_depth=0,
+             counts=False, shard=None):
         """ Yields (path, size-in-bytes) tuples for the selected data
         objects and collections.
 
+        Collection sizes are obtained with aggregate queries, where
+        data objects with several replicas are only counted once
+        (with the size of the largest replica).
+
         Examples:
 
         >>> session.bulk.size('~/data/out*.txt')
         >>> session.bulk.size('./data', recurse=True)
+        >>> session.bulk.size('./data', recurse=True, max_depth=1,
+                              counts=True)
 
         Arguments:
 
@@ -552,37 +2538,135 @@ class BulkManager(Manager):
             matching collections will be calculated as the sum of
             their data objects and subcollection sizes.
 
+        max_depth: int (default: 0)
+            Similar to 'du --max-depth': when used recursively, also yield
+            the sizes of the subcollections down to this depth (with -1
+            meaning no limit). Subcollections precede their parents.
+
+        counts: bool (default: False)
+            Whether to yield (path, size-in-bytes, number of data objects)
+            tuples instead.
+
+        shard: None, (int, int) tuple or 'auto' (default: None)
+            If not None, only the items in the given shard are processed
+            (see :func:`vsc_irods.manager.search_manager.get_shard`)
+
         verbose: bool (default: False)
             Whether to print more output.
         """
-        if isinstance(iterator, str):
-            iterator = self.session.search.iglob(iterator)
+        for item in self._iterate(iterator, shard=shard):
+            entry = item
+            item, path, is_collection = self._resolve(item)
 
-        for item in iterator:
-            path = self.session.path.get_absolute_irods_path(item)
-
-            if self.session.collections.exists(path):
+            if is_collection:
                 if recurse:
-                    new_iterator = self.size(item + '/*', recurse=True,
-                                             verbose=verbose)
-                    size = sum([result[1] for result in new_iterator])
+                    totals = self._tree_sizes(path, max_depth=max_depth)
+
+                    for collection in self._post_order(totals):
+                        size, count = totals[collection]
+                        collection = item + collection[len(path):]
+                        yield (collection, size, count) if counts else \
+                              (collection, size)
                 else:
                     self.log('Skipping collection %s (no recursion)' % item,
                              verbose)
-                    continue
+                continue
+            elif isinstance(entry, Entry):
+                size = entry.size
             else:
-                dirname = os.path.dirname(path)
-                basename = os.path.basename(path)
-                criteria = [Criterion('=', Collection.name, dirname),
-                            Criterion('=', DataObject.name, basename)]
-                fields = [DataObject.size]
-                q = self.session.query(*fields).filter(*criteria)
+                size = self._object_entry(path).size
+
+            yield (item, size, 1) if counts else (item, size)
 
-                results = [result for result in q.get_results()]
-                if len(results) > 1:
-                    raise MultipleResultsFound('Different replicas of data ' + \
-                                        'object %s have different sizes' % path)
+    def _tree_sizes(self, path, max_depth=0):
+        """ Returns a dictionary with the total size in bytes and the number
+        of data objects (as [size, count] lists) in the collection tree
+        rooted at the given (absolute) path, for the root collection and
+        the subcollections down to max_depth.
 
-                size = results[0][DataObject.size]
+        These are obtained from an aggregate query, which returns the
+        sums and counts per collection and replica number. Only for
+        collections where more than one replica number shows up, the data
+        objects need to be listed to avoid counting replicas twice.
+        """
+        search = self.session.search
+        prefix = path.rstrip('/')
+
+        def get_depth(collection):
+            if collection == path:
+                return 0
+            elif collection.startswith(prefix + '/'):
+                return collection[len(prefix):].count('/')
+            return None
+
+        totals = {path: [0, 0]}
+        if max_depth != 0:
+            for entry, depth in search._iter_subtree(path, 'd'):
+                if max_depth == -1 or depth <= max_depth:
+                    totals[entry.abs_path] = [0, 0]
+
+        def add(collection, size, count):
+            # Adds to the totals of the collection and its parents
+            depth = get_depth(collection)
+            while depth >= 0:
+                if collection in totals:
+                    totals[collection][0] += size
+                    totals[collection][1] += count
+                collection = os.path.dirname(collection)
+                depth -= 1
+
+        q = self.session.query(Collection.name, DataObject.replica_number)
+        q = q.sum(DataObject.size).count(DataObject.id)
+        q = q.filter(Criterion('like', Collection.name, prefix + '%'))
+
+        groups = {}
+        for result in search._results(q):
+            collection = result[Collection.name]
+            if get_depth(collection) is None:
+                continue
+            groups.setdefault(collection, []).append((result[DataObject.size],
+                                                      result[DataObject.id]))
+
+        ambiguous = set()
+        for collection, sums in groups.items():
+            if len(sums) == 1:
+                add(collection, *sums[0])
+            else:
+                ambiguous.add(collection)
+
+        if len(ambiguous) > 0:
+            # Either one query per such collection, or a single query
+            # listing all data objects in the tree, whichever is cheaper
+            nrows = sum([count for sums in groups.values()
+                         for size, count in sums])
+
+            if len(ambiguous) <= nrows // MAX_SQL_ROWS + 1:
+                for collection in sorted(ambiguous):
+                    criteria = [Criterion('=', Collection.name, collection)]
+                    q = search._query_entries('f', criteria)
+                    size, count = 0, 0
+                    for result in search._results(q):
+                        size += result[DataObject.size]
+                        count += 1
+                    add(collection, size, count)
+            else:
+                for entry, depth in search._iter_subtree(path, 'f'):
+                    collection = os.path.dirname(entry.abs_path)
+                    if collection in ambiguous:
+                        add(collection, entry.size, 1)
 
-            yield (item, size)
+        return totals
+
+    @staticmethod
+    def _post_order(paths):
+        """ Returns the given collection paths ordered such that
+        subcollections precede their parent collections.
+        """
+        order = []
+        stack = []
+        for path in sorted(paths, key=lambda path: path.split('/')):
+            while len(stack) > 0 and not path.startswith(stack[-1] + '/'):
+                order.append(stack.pop())
+            stack.append(path)
+        order.extend(reversed(stack))
+        return order
@@ -66,6 +66,24 @@ class PathManager(Manager):
         abs_path = os.path.normpath(abs_path)
         return abs_path
 
+    def is_collection(self, path):
+        """ Returns whether the given (absolute or relative) path
+        is an existing collection, using the session's lookup cache
+        (see :class:`vsc_irods.lookup.LookupCache`)
+        """
+        abs_path = self.get_absolute_irods_path(path)
+        return self.session.lookups.lookup(abs_path, 'd',
+                                           self.session.collections.exists)
+
+    def is_data_object(self, path):
+        """ Returns whether the given (absolute or relative) path
+        is an existing data object, using the session's lookup cache
+        (see :class:`vsc_irods.lookup.LookupCache`)
+        """
+        abs_path = self.get_absolute_irods_path(path)
+        return self.session.lookups.lookup(abs_path, 'f',
+                                           self.session.data_objects.exists)
+
     def imkdir(self, path, parents=False, verbose=False, **options):
         """ Creates a collection on the iRODS file system
 
@@ -85,7 +103,7 @@ class PathManager(Manager):
             Additional options to be passed on to PRC's collections.create()
         """
         abs_path = self.get_absolute_irods_path(path)
-        already_exists = self.session.collections.exists(abs_path)
+        already_exists = self.is_collection(abs_path)
 
         if not parents:
             assert not already_exists, \
@@ -94,9 +112,10 @@ class PathManager(Manager):
             dirname = os.path.dirname(abs_path)
             msg = 'Cannot create collection %s because the parent '
             msg += 'colllection does not exist and parents=False'
-            assert self.session.collections.exists(dirname), msg % abs_path
+            assert self.is_collection(dirname), msg % abs_path
 
         if not already_exists:
             self.log('Creating collection %s' % abs_path, verbose)
             self.session.collections.create(abs_path, recurse=parents,
                                             **options)
+            self.session.lookups.set(abs_path, 'd', True)
@@ -1,15 +1,431 @@
 import os
+import re
+import heapq
+import queue
 import fnmatch
 import warnings
 import itertools
-from irods.column import Criterion
+import threading
+from datetime import datetime, timezone
+from irods.api_number import api_number
+from irods.column import Criterion, In
+from irods.exception import CAT_NO_ROWS_FOUND, CollectionDoesNotExist
+from irods.message import GenQueryResponse, empty_gen_query_out, iRODSMessage
 from irods.models import Collection, CollectionMeta, DataObject, DataObjectMeta
+from irods.results import ResultSet
 from vsc_irods.manager import Manager
 
 
+# Characters with a special meaning in glob patterns
+glob_magic = '*?['
+
+# Maximal number of paths without wildcards which are
+# looked up together in one query by SearchManager.iglob
+glob_chunk_size = 100
+
+# Default number of rows per page of query results
+page_size = 500
+
+# Environment variables with the index of the task in an array job
+# (used when the index of a shard is not given)
+shard_index_env_var = ['SLURM_ARRAY_TASK_ID', 'PBS_ARRAYID', 'PBS_ARRAY_INDEX']
+
+# Environment variables with the number of tasks in an array job
+# (used when the number of shards is not given)
+shard_count_env_var = ['SLURM_ARRAY_TASK_COUNT']
+
+
+def glob_translate(pattern):
+    """ Translates the given absolute glob pattern into a (like pattern,
+    compiled regular expression) tuple. The 'like' pattern (to be used
+    in GenQuery 'like' conditions) matches at least all paths matched
+    by the regular expression, which implements the exact semantics.
+    """
+    like, regex = '', ''
+
+    for component in pattern.split('/')[1:]:
+        if component == '**':
+            # Zero or more collections
+            like += '%'
+            regex += '(?:/[^/]+)*'
+            continue
+
+        like += '/'
+        regex += '/'
+        i, n = 0, len(component)
+
+        while i < n:
+            c = component[i]
+            i += 1
+
+            if c == '*':
+                like += '%'
+                regex += '[^/]*'
+            elif c == '?':
+                like += '_'
+                regex += '[^/]'
+            elif c == '[':
+                j = i
+                if j < n and component[j] == '!':
+                    j += 1
+                if j < n and component[j] == ']':
+                    j += 1
+                j = component.find(']', j)
+
+                like += '_'
+                if j < 0:
+                    regex += re.escape(c)
+                else:
+                    stuff = component[i:j].replace('\\', '\\\\')
+                    i = j + 1
+                    if stuff.startswith('!'):
+                        stuff = '^/' + stuff[1:]
+                    elif stuff.startswith('^'):
+                        stuff = '\\' + stuff
+                    regex += '[%s]' % stuff
+            else:
+                # Note: '_' and '%' are wildcards in 'like' patterns,
+                # which only broadens the query
+                like += c
+                regex += re.escape(c)
+
+    return like, re.compile(regex)
+
+
+def _execute(q, connection):
+    """ Runs the given query over the given connection (as PRC's
+    Query.execute() does over a connection of its choice) and returns
+    the ResultSet.
+    """
+    message = iRODSMessage('RODS_API_REQ', msg=q._message(),
+                           int_info=api_number['GEN_QUERY_AN'])
+    connection.send(message)
+    try:
+        response = connection.recv().get_main_message(GenQueryResponse)
+        return ResultSet(response)
+    except CAT_NO_ROWS_FOUND:
+        return ResultSet(empty_gen_query_out(list(q.columns.keys())))
+
+
+def _query_pages(q):
+    """ Yields the pages (ResultSets) of the given query, like PRC's
+    Query.get_batches(), but holding a single connection of the session's
+    pool for the whole query, as a continuation index is only valid for
+    the server agent which ran the first page. A query which is stopped
+    early gets closed on that connection.
+    """
+    with q.sess.pool.get_connection() as connection:
+        result_set = _execute(q, connection)
+        try:
+            yield result_set
+
+            while result_set.continue_index > 0:
+                q = q.continue_index(result_set.continue_index)
+                result_set = _execute(q, connection)
+                yield result_set
+        except GeneratorExit:
+            if result_set.continue_index > 0:
+                q = q.continue_index(result_set.continue_index)
+                _execute(q.limit(0), connection)
+            raise
+
+
+def stream_results(q, page_size=page_size, prefetch=1, limit=None):
+    """ Yields the rows of the given query, which are fetched from the
+    server one page at a time (over the same connection, see
+    _query_pages()), so that memory usage does not grow with
+    the number of rows.
+
+    Arguments:
+
+    q: Query instance
+        The query to run
+
+    page_size: int (default: 500)
+        The number of rows per page
+
+    prefetch: int (default: 1)
+        The number of pages which are fetched ahead in a background
+        thread while the current page is being processed
+        (0 meaning that pages are only fetched when needed)
+
+    limit: int or None (default: None)
+        The maximal number of rows to yield. The query is closed
+        on the server as soon as this number has been reached.
+    """
+    if limit is not None and limit <= 0:
+        return
+
+    pages = _query_pages(q.limit(page_size))
+    if prefetch > 0:
+        pages = _prefetch(pages, prefetch)
+
+    count = 0
+    try:
+        for page in pages:
+            for row in page:
+                yield row
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+    finally:
+        pages.close()
+
+
+def _prefetch(iterator, size):
+    """ Yields the items of the given iterator (e.g. pages of query
+    results), which are fetched ahead by a background thread,
+    with at most the given number of items waiting.
+    """
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item):
+        # Returns False if the consumer has stopped
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterator:
+                if not put(('item', item)):
+                    break
+            else:
+                put(('end', None))
+        except Exception as error:
+            put(('error', error))
+        finally:
+            iterator.close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            kind, item = items.get()
+            if kind == 'end':
+                break
+            elif kind == 'error':
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def slice_results(iterator, limit=None, offset=0):
+    """ Yields the items of the given iterator, skipping the first
+    'offset' ones and stopping after 'limit' ones (None meaning
+    no limit). The iterator gets closed afterwards, so that any
+    ongoing queries are closed as well.
+    """
+    stop = None if limit is None else offset + limit
+    try:
+        yield from itertools.islice(iterator, offset, stop)
+    finally:
+        if hasattr(iterator, 'close'):
+            iterator.close()
+
+
+def get_shard(shard):
+    """ Returns the (index, count) tuple for the given shard argument,
+    which is an (index, count) tuple or list, where a None index or count
+    is taken from the environment of the array job (see
+    'shard_index_env_var' and 'shard_count_env_var'), or 'auto'
+    (meaning that both are taken from the environment).
+
+    Indices from the environment are taken modulo the count (after
+    subtracting $SLURM_ARRAY_TASK_MIN, for Slurm), so that array jobs
+    can number their tasks from 0 or from 1.
+
+    This is how the 'shard' arguments of the search and bulk methods
+    are interpreted: if not None, only the items in the shard with the
+    given (index, count) are processed, when all items get split in
+    'count' shares of about the same total size (see
+    :func:`shard_items`). Bulk operations count collections (and local
+    folders) with the total size of their tree, while search results
+    count collections as empty.
+    """
+    index, count = (None, None) if shard == 'auto' else shard
+
+    if count is None:
+        for key in shard_count_env_var:
+            if key in os.environ:
+                count = int(os.environ[key])
+                break
+        else:
+            raise ValueError('The number of shards is not given and cannot '
+                             'be found in the environment')
+
+    if index is None:
+        for key in shard_index_env_var:
+            if key in os.environ:
+                index = int(os.environ[key])
+                if key.startswith('SLURM'):
+                    index -= int(os.environ.get('SLURM_ARRAY_TASK_MIN', 0))
+                index %= count
+                break
+        else:
+            raise ValueError('The shard index is not given and cannot '
+                             'be found in the environment')
+
+    if count < 1 or not 0 <= index < count:
+        raise ValueError('Invalid shard %d of %d' % (index, count))
+    return (index, count)
+
+
+def add_shard_arguments(arg_parser):
+    """ Adds the --shard and --nshards options, for only processing
+    a share of the matching items (see :func:`get_shard`), to the given
+    ArgumentParser of a command line script.
+    """
+    arg_parser.add_argument('--shard', default=None, type=int,
+                            help='Only process the share with this index '
+                            '(from 0) when splitting the matching items in '
+                            '--nshards shares of about equal total size '
+                            '(default: the index of the task in a Slurm or '
+                            'PBS array job).')
+
+    arg_parser.add_argument('--nshards', default=None, type=int,
+                            help='The number of shares in which to split the '
+                            'matching items, e.g. one per task of an array '
+                            'job (default: the number of tasks in a Slurm '
+                            'array job, if --shard is given).')
+
+
+def get_shard_argument(options):
+    """ Returns the 'shard' argument for the search and bulk methods
+    which corresponds to the --shard and --nshards options parsed
+    by a command line script (see :func:`add_shard_arguments`),
+    i.e. None if neither of them is given.
+    """
+    if options.shard is None and options.nshards is None:
+        return None
+    return (options.shard, options.nshards)
+
+
+def shard_items(items, index, count, size=lambda item: item.size):
+    """ Yields the items belonging to the shard with the given index,
+    when the given items get split in the given number of shards of
+    about equal total size.
+
+    The items are assigned by greedy bin packing: from the largest to the
+    smallest item, each one goes to the shard with the smallest total so
+    far. Ties are broken by path and shard index, so that every task
+    computes the same assignment for the same items. The items of the
+    shard are yielded in their original order.
+
+    Arguments:
+
+    items: iterable
+        The items to split (e.g. Entry instances)
+
+    index: int
+        The index of the shard (from 0 to count - 1)
+
+    count: int
+        The number of shards
+
+    size: function (default: the 'size' attribute)
+        Returns the size of an item (None being counted as 0)
+    """
+    items = list(items)
+    sizes = [size(item) or 0 for item in items]
+    order = sorted(range(len(items)),
+                   key=lambda i: (-sizes[i], str(items[i])))
+
+    shards = [None] * len(items)
+    totals = [(0, shard) for shard in range(count)]
+    for i in order:
+        total, shard = heapq.heappop(totals)
+        shards[i] = shard
+        heapq.heappush(totals, (total + sizes[i], shard))
+
+    for item, shard in zip(items, shards):
+        if shard == index:
+            yield item
+
+
+class Entry:
+    """ Lightweight record of an iRODS collection or data object,
+    as yielded by the search manager (e.g. with return_entries=True).
+
+    All attributes are taken from the query result which found the
+    item, so that e.g. the bulk operations do not need to look them up
+    again.
+
+    Attributes:
+
+    path: str
+        The path, as it would be returned by the search
+        (e.g. relative or starting with '~')
+
+    abs_path: str
+        The absolute path on the iRODS server
+
+    kind: str
+        'd' for collections, 'f' for data objects
+
+    size: int or None
+        The size in bytes (for data objects with several replicas:
+        the largest one)
+
+    modify_time: datetime or None
+        The last modification time (for data objects with several
+        replicas: the most recent one)
+
+    checksum: str or None
+        The checksum, if one has been registered
+
+    replicas: int or None
+        The number of replicas (data objects only)
+    """
+    __slots__ = ('path', 'abs_path', 'kind', 'size', 'modify_time',
+                 'checksum', 'replicas')
+
+    def __init__(self, path, abs_path, kind, size=None, modify_time=None,
+                 checksum=None, replicas=None):
+        self.path = path
+        self.abs_path = abs_path
+        self.kind = kind
+        self.size = size
+        self.modify_time = modify_time
+        self.checksum = checksum
+        self.replicas = replicas
+
+    def __str__(self):
+        return self.path
+
+    def __repr__(self):
+        return '<Entry %s %s>' % (self.kind, self.path)
+
+
 class SearchManager(Manager):
-    """ A class for easier searching in the iRODS file system """
-    def glob(self, *args, debug=False):
+    """ A class for easier searching in the iRODS file system
+
+    Query results are streamed from the server one page at a time
+    (see :func:`stream_results`), where the 'page_size' and 'prefetch'
+    attributes set the number of rows per page and the number of
+    pages fetched ahead.
+    """
+    def __init__(self, session):
+        Manager.__init__(self, session)
+        self.page_size = page_size
+        self.prefetch = 1
+
+    def _results(self, q, limit=None):
+        """ Yields the rows of the given query, page by page
+        (see :func:`stream_results`)
+        """
+        return stream_results(q, page_size=self.page_size,
+                              prefetch=self.prefetch, limit=limit)
+
+    def glob(self, *args, shard=None, limit=None, offset=0, debug=False):
         """ As iglob(), but returns a list instead of an iterator,
         similar to the glob.iglob builtin.
 
@@ -18,22 +434,41 @@ class SearchManager(Manager):
         args: one or more str
             The search patterns
 
+        shard: None, (int, int) tuple or 'auto' (default: None)
+            See iglob()
+
+        limit: int or None (default: None)
+            The maximal number of results
+
+        offset: int (default: 0)
+            The number of results to skip
+
         debug: bool (default: False)
             Set to True for debugging info
         """
-        results = [hit for hit in self.iglob(*args, debug=debug)]
+        results = [hit for hit in self.iglob(*args, shard=shard, limit=limit,
+                                             offset=offset, debug=debug)]
 
         self.log('DBG| returning %s' % str(results), debug)
         return results
 
-    def iglob(self, pattern, debug=False):
+    def iglob(self, *patterns, return_entries=False, shard=None, limit=None,
+              offset=0, debug=False):
         """ Returns an iterator of iRODS collection and data object paths
-        which match the given pattern, similar to the glob.iglob builtin.
+        which match the given pattern(s), similar to the glob.iglob builtin.
+
+        Besides '*' (any characters except '/'), also '?' (any single
+        character), character classes such as '[a-c]' or '[!0-9]' and
+        '**' (zero or more collections, when used as a whole component)
+        are expanded. Unlike glob.iglob, '*' and '?' also match names
+        starting with a dot.
 
-        .. note::
- 
-            Currently only '*' is expanded. The other special characters
-            '?' and '[]' are not (yet) taken into account.
+        The server is sent the broadest 'like' pattern that is safe for
+        every pattern (with '%' for '*' and '**', and '_' for '?' and
+        character classes), after which the results are refined with a
+        regular expression. Patterns with the same 'like' pattern share
+        their queries, and patterns without any wildcards are looked up
+        together, so that several patterns need as few queries as possible.
 
         Examples:
 
@@ -41,66 +476,185 @@ class SearchManager(Manager):
             ['molecules_database/ch4.xyz']
         >>> session.glob('./*/*')
             ['./molecule_database/a.out', './foo/bar.so']
-        >>> session.glob('~/foo/c*.xyz')
-            ['~/foo/ch4.xyz', '~/foo/co2.xyz']
+        >>> session.glob('~/foo/c?[0-9].xyz', '~/bar/**/*.xyz')
+            ['~/foo/co2.xyz', '~/bar/ch4.xyz', '~/bar/baz/c6h6.xyz']
 
         Arguments:
 
-        pattern: str
-            The search pattern
+        patterns: one or more str
+            The search patterns
+
+        return_entries: bool (default: False)
+            Whether to return Entry instances instead of path strings
+
+        shard: None, (int, int) tuple or 'auto' (default: None)
+            If not None, only the results in the given shard are
+            returned (see :func:`get_shard`)
+
+        limit: int or None (default: None)
+            The maximal number of results, after which the queries
+            are stopped
+
+        offset: int (default: 0)
+            The number of results to skip
 
         debug: bool (default: False)
             Set to True for debugging info
         """
-        self.log('DBG| search.iglob pattern: %s' % pattern, debug)
-
-        if '*' in pattern:
-            index = pattern.index('*')
+        if shard is not None:
+            iterator = self.iglob(*patterns, return_entries=True, debug=debug)
+            iterator = shard_items(iterator, *get_shard(shard))
+            for entry in slice_results(iterator, limit=limit, offset=offset):
+                yield entry if return_entries else entry.path
+            return
+        elif limit is not None or offset > 0:
+            iterator = self.iglob(*patterns, return_entries=return_entries,
+                                  debug=debug)
+            yield from slice_results(iterator, limit=limit, offset=offset)
+            return
+
+        literals = []
+        groups = {}
+
+        for pattern in patterns:
+            self.log('DBG| search.iglob pattern: %s' % pattern, debug)
+            spec = self._glob_spec(pattern)
+
+            if spec['literal']:
+                literals.append(spec)
+            else:
+                groups.setdefault((spec['like_d'], spec['like_f']),
+                                  []).append(spec)
+
+        for (like_d, like_f), specs in groups.items():
+            self.log('DBG| search.iglob like patterns: %s, %s' % \
+                     (like_d, like_f), debug)
+            recursive = any([spec['recursive'] for spec in specs])
+
+            criteria = [Criterion('like', Collection.name, like_d)]
+            if not recursive:
+                criteria.append(Criterion('not like', Collection.name,
+                                          like_d + '/%'))
+            q = self._query_entries('d', criteria)
+            yield from self._glob_results('d', q, specs, return_entries)
+
+            like_collection, like_object = like_f
+            criteria = [Criterion('like', Collection.name, like_collection),
+                        Criterion('like', DataObject.name, like_object)]
+            if not recursive:
+                criteria.append(Criterion('not like', Collection.name,
+                                          like_collection + '/%'))
+            q = self._query_entries('f', criteria)
+            yield from self._glob_results('f', q, specs, return_entries)
+
+        for index in range(0, len(literals), glob_chunk_size):
+            specs = literals[index:index + glob_chunk_size]
+            paths = sorted(set([spec['abs_pattern'] for spec in specs]))
+            self.log('DBG| search.iglob paths: %s' % paths, debug)
+
+            q = self._query_entries('d', [In(Collection.name, paths)])
+            yield from self._glob_results('d', q, specs, return_entries)
+
+            dirnames = sorted(set([os.path.dirname(p) for p in paths]))
+            basenames = sorted(set([os.path.basename(p) for p in paths]))
+            q = self._query_entries('f', [In(Collection.name, dirnames),
+                                          In(DataObject.name, basenames)])
+            yield from self._glob_results('f', q, specs, return_entries)
+
+    def _glob_spec(self, pattern):
+        """ Returns a dictionary describing how the given glob pattern
+        is looked up by iglob(): its root (the part before the first
+        wildcard) as given and as an absolute path, its absolute form,
+        the regular expression it translates to, and the 'like'
+        patterns to be used in the queries for collections ('like_d')
+        and data objects ('like_f', a (collection, name) tuple).
+        """
+        index = min([pattern.find(c) for c in glob_magic if c in pattern],
+                    default=-1)
+        if index >= 0:
             path_root = os.path.dirname(pattern[:index])
         else:
             path_root = pattern
 
         path_root = path_root.rstrip('/') if path_root else '.'
-        path_root_abs = self.session.path.get_absolute_irods_path(path_root)
-
-        # First, the collections
-        pattern_collection = self.session.path.get_absolute_irods_path(pattern)
-        pattern_collection = pattern_collection.replace('*', '%')
-        self.log('DBG| search.iglob pattern_collection: %s' % \
-                 pattern_collection, debug)
-
-        fields = [Collection.name]
-        criteria = [Criterion('like',  Collection.name, pattern_collection),
-                    Criterion('not like',  Collection.name,
-                              pattern_collection + '/%')]
-        q = self.session.query(*fields).filter(*criteria)
-
-        for result in q.get_results():
-            path = result[Collection.name].replace(path_root_abs, path_root, 1)
-            yield path
-
-        # Next, the data objects
-        pattern_collection = os.path.dirname(pattern_collection)
-        pattern_object = os.path.basename(pattern)
-        pattern_object = pattern_object.replace('*', '%')
-        self.log('DBG| search.iglob pattern_object: %s' % pattern_object, debug)
-
-        fields = [Collection.name, DataObject.name]
-        criteria = [Criterion('like',  Collection.name, pattern_collection),
-                    Criterion('not like',  Collection.name,
-                              pattern_collection + '/%'),
-                    Criterion('like',  DataObject.name, pattern_object)]
-
-        q = self.session.query(*fields).filter(*criteria)
-
-        for result in q.get_results():
+        abs_pattern = self.session.path.get_absolute_irods_path(pattern)
+        like, regex = glob_translate(abs_pattern)
+
+        dirname, basename = os.path.split(abs_pattern)
+        if basename == '**':
+            # Data objects in the whole collection tree
+            dirname, basename = abs_pattern, '*'
+        like_collection = glob_translate(dirname)[0]
+        like_object = glob_translate('/' + basename)[0][1:]
+
+        return {'root': path_root,
+                'abs_root': self.session.path.get_absolute_irods_path(
+                                                                path_root),
+                'abs_pattern': abs_pattern,
+                'regex': regex,
+                'literal': index < 0,
+                'recursive': '**' in abs_pattern.split('/'),
+                'like_d': like,
+                'like_f': (like_collection, like_object)}
+
+    def _glob_results(self, t, q, specs, return_entries):
+        """ Yields the results of the given iglob() query for
+        collections (t='d') or data objects (t='f') which match
+        (the first of) the given pattern specifications
+        (see _glob_spec()), relative to the root of that pattern.
+        """
+        for result in self._results(q):
+            entry = self._make_entry(t, result)
+
+            for spec in specs:
+                if spec['regex'].fullmatch(entry.abs_path):
+                    break
+            else:
+                continue
+
+            self.session.lookups.set(entry.abs_path, t, True)
+            entry.path = entry.abs_path.replace(spec['abs_root'],
+                                                spec['root'], 1)
+            yield entry if return_entries else entry.path
+
+    def _query_entries(self, t, criteria):
+        """ Returns a query for the collections (t='d') or data objects
+        (t='f') satisfying the given criteria, which selects the fields
+        needed for constructing Entry instances (see _make_entry()).
+
+        For data objects, the results are grouped per data object,
+        so that each of them is returned only once, whatever the
+        number of replicas.
+        """
+        if t == 'd':
+            q = self.session.query(Collection.name, Collection.modify_time)
+        elif t == 'f':
+            q = self.session.query(Collection.name, DataObject.name)
+            q = q.max(DataObject.size, DataObject.modify_time,
+                      DataObject.checksum)
+            q = q.count(DataObject.replica_number)
+        return q.filter(*criteria)
+
+    @staticmethod
+    def _make_entry(t, result):
+        """ Returns an Entry instance for a result from a query
+        constructed with _query_entries(). Its 'path' attribute
+        is set to the absolute path.
+        """
+        if t == 'd':
+            path = result[Collection.name]
+            return Entry(path, path, 'd',
+                         modify_time=result[Collection.modify_time])
+        elif t == 'f':
             path = os.path.join(result[Collection.name],
                                 result[DataObject.name])
-            path = path.replace(path_root_abs, path_root, 1)
-            yield path
+            return Entry(path, path, 'f', size=result[DataObject.size],
+                         modify_time=result[DataObject.modify_time],
+                         checksum=result[DataObject.checksum] or None,
+                         replicas=result[DataObject.replica_number])
 
     def walk(self, collection, mindepth=0, maxdepth=-1, return_objects=False,
-             debug=False):
+             return_entries=False, use_queries=False, debug=False):
         """
         Top-down collection tree generator, yielding 3-tuples of
         (collection, [list of subcollections], [list of data objects]).
@@ -123,12 +677,35 @@ class SearchManager(Manager):
             Whether to return path strings or the corresponding objects
             (iRODSCollection and iRODSDataObject instances)
 
+        return_entries: bool (default: False)
+            Whether to return Entry instances (with absolute paths)
+            instead of path strings. Only applies when use_queries is True.
+
+        use_queries: bool (default: False)
+            Whether to list the whole collection tree with a couple
+            of (paged) queries and to rebuild the tuples from these
+            listings, instead of recursing through the subcollections
+            (which needs one or more queries per collection).
+            Only applies when return_objects is False. The tuples then
+            follow the order of the query results, and the paths are
+            worked out from the listings (as is done for find() and
+            for recursive bulk operations).
+
         debug: bool (default: False)
             Set to True for debugging info
 
         """
         assert mindepth >= 0
 
+        if use_queries and not return_objects:
+            if not isinstance(collection, str):
+                collection = collection.path
+            yield from self._walk_queries(collection, mindepth=mindepth,
+                                          maxdepth=maxdepth,
+                                          return_entries=return_entries,
+                                          debug=debug)
+            return
+
         if maxdepth == -1 or maxdepth >= mindepth:
             if isinstance(collection, str):
                 abs_path = self.session.path.get_absolute_irods_path(collection)
@@ -156,11 +733,70 @@ class SearchManager(Manager):
                     yield from self.walk(subcollection,
                                          mindepth=new_mindepth,
                                          maxdepth=new_maxdepth,
-                                         return_objects=return_objects)
+                                         return_objects=return_objects,
+                                         use_queries=False)
+
+    def _walk_queries(self, collection, mindepth=0, maxdepth=-1,
+                      return_entries=False, debug=False):
+        """ Query-based equivalent of walk() with return_objects=False.
+
+        The collection tree gets listed with one (paged) query for the
+        collections and one for the data objects, after which the
+        (collection, subcollections, data objects) tuples are rebuilt
+        on the client, in the same (depth-first) order as walk().
+        """
+        abs_path = self.session.path.get_absolute_irods_path(collection)
+
+        def convert(entries):
+            entries = sorted(entries, key=lambda entry: entry.abs_path)
+            if return_entries:
+                return entries
+            return [entry.abs_path for entry in entries]
+
+        subcollections = {}
+        root = None
+        for entry, depth in self._iter_subtree(abs_path, 'd', debug=debug):
+            if depth == 0:
+                root = entry
+            else:
+                parent = os.path.dirname(entry.abs_path)
+                subcollections.setdefault(parent, []).append(entry)
+
+        if root is None:
+            raise CollectionDoesNotExist(abs_path)
+
+        data_objects = {}
+        for entry, depth in self._iter_subtree(abs_path, 'f', debug=debug):
+            parent = os.path.dirname(entry.abs_path)
+            data_objects.setdefault(parent, []).append(entry)
+
+        # Depth-first traversal, starting from the root collection
+        stack = [(root, 0)]
+        while len(stack) > 0:
+            entry, depth = stack.pop()
+            path = entry.abs_path
+            children = sorted(subcollections.get(path, []),
+                              key=lambda child: child.abs_path)
+
+            # Depth of the subcollections and data objects
+            child_depth = depth + 1
+            if child_depth >= mindepth and \
+               (maxdepth == -1 or child_depth <= maxdepth):
+                yield (entry if return_entries else path, convert(children),
+                       convert(data_objects.get(path, [])))
+
+            if maxdepth == -1 or child_depth < maxdepth:
+                for child in reversed(children):
+                    self.log('DBG| search.walk listing subcollection: %s'
+                             % child.abs_path, debug)
+                    stack.append((child, child_depth))
 
     def find(self, irods_path='.', pattern='*', use_wholename=False,
              types='d,f', mindepth=0, maxdepth=-1, collection_avu=[],
-             object_avu=[], debug=False):
+             object_avu=[], min_size=None, max_size=None, newer=None,
+             older=None, owner=None, resource=None, min_replicas=None,
+             checksum=None, return_entries=False, shard=None, limit=None,
+             offset=0, debug=False):
         """ Returns a list of iRODS collection and data object paths
         which match the given pattern, similar to the UNIX `find` command.
 
@@ -171,6 +807,9 @@ class SearchManager(Manager):
             ['data/molecules/c6h6.xyz', './data/molecules/ch3cooh.xyz']
         >>> session.find('~/data*', pattern='molecules', types='d')
             ['~/data/molecules']
+        >>> session.find('~', pattern='*.out', min_size=1024**3,
+        >>>              newer=time.time() - 3600)
+            ['~/job/big.out']
 
         Arguments:
 
@@ -207,9 +846,75 @@ class SearchManager(Manager):
             One or several attribute[-value[-unit]] patterns to be used
             in filtering data objects.
 
+        min_size: int or None (default: None)
+            Minimal size (in bytes) of the data objects
+
+        max_size: int or None (default: None)
+            Maximal size (in bytes) of the data objects
+
+        newer: datetime, float or None (default: None)
+            Only include collections and data objects modified after
+            this time (a datetime, which is taken to be in UTC if it has
+            no time zone, or a number of seconds since the epoch)
+
+        older: datetime, float or None (default: None)
+            Only include collections and data objects modified before
+            this time (see 'newer')
+
+        owner: str or None (default: None)
+            Name of the owner of the collections and data objects
+
+        resource: str or None (default: None)
+            Name of the resource holding (a replica of) the data objects
+
+        min_replicas: int or None (default: None)
+            Minimal number of replicas of the data objects (counted
+            among the replicas satisfying the other criteria, apart
+            from the AVU criteria)
+
+        checksum: str or None (default: None)
+            Checksum of the data objects (a 'like' pattern if
+            it contains '%')
+
+        All of the above filters are added to the queries, so that the
+        server only returns the matching items. The size, resource,
+        replica and checksum filters exclude collections. For data
+        objects with several replicas, it is sufficient that one
+        replica satisfies the filters.
+
+        return_entries: bool (default: False)
+            Whether to return Entry instances instead of path strings
+
+        shard: None, (int, int) tuple or 'auto' (default: None)
+            If not None, only the results in the given shard are
+            returned (see :func:`get_shard`)
+
+        limit: int or None (default: None)
+            The maximal number of results, after which the queries
+            are stopped
+
+        offset: int (default: 0)
+            The number of results to skip
+
         debug: bool (default: False)
             Set to True for debugging info
         """
+        if shard is not None or limit is not None or offset > 0:
+            iterator = self.find(irods_path=irods_path, pattern=pattern,
+                                 use_wholename=use_wholename, types=types,
+                                 mindepth=mindepth, maxdepth=maxdepth,
+                                 collection_avu=collection_avu,
+                                 object_avu=object_avu, min_size=min_size,
+                                 max_size=max_size, newer=newer, older=older,
+                                 owner=owner, resource=resource,
+                                 min_replicas=min_replicas, checksum=checksum,
+                                 return_entries=True, debug=debug)
+            if shard is not None:
+                iterator = shard_items(iterator, *get_shard(shard))
+            for entry in slice_results(iterator, limit=limit, offset=offset):
+                yield entry if return_entries else entry.path
+            return
+
         # Process arguments:
         assert mindepth >= 0, 'mindepth argument must be >= 0'
         if isinstance(object_avu, tuple): object_avu = [object_avu]
@@ -221,7 +926,7 @@ class SearchManager(Manager):
             msg += "'wholename=True' may help you find what you're looking for."
             warnings.warn(msg % pattern)
 
-        # Set up the metadata fields and criteria for the queries:
+        # Set up the metadata criteria for the queries:
         def parse_avu_component(component):
             if component.count(',') == 0:
                 operation, meta_pattern = '=', component
@@ -231,7 +936,6 @@ class SearchManager(Manager):
                 raise ValueError('Cannot parse AVU component: %s' % component)
             return operation, meta_pattern
 
-        meta_fields = {Collection: [], DataObject: []}
         meta_criteria = {Collection: [], DataObject: []}
 
         for model, avu_list in zip([Collection, DataObject],
@@ -250,77 +954,227 @@ class SearchManager(Manager):
                              (operation, field, meta_pattern), debug)
                     criterion = Criterion(operation, field, meta_pattern)
                     meta_criteria[model].append(criterion)
-                    meta_fields[model].append(field)
+
+        # Add the criteria for the other attributes:
+        attribute_criteria = self._attribute_criteria(min_size=min_size,
+                                    max_size=max_size, newer=newer,
+                                    older=older, owner=owner,
+                                    resource=resource, checksum=checksum)
+        if min_replicas is not None:
+            attribute_criteria[Collection] = None
+
+        for model, criteria in attribute_criteria.items():
+            if criteria is None:
+                self.log('DBG| Excluding %s' % model.__name__, debug)
+                meta_criteria[model] = None
+                continue
+
+            for criterion in criteria:
+                self.log('DBG| Attribute criterion: %s %s %s' % \
+                         (criterion.op, criterion.query_key,
+                          criterion.value), debug)
+            meta_criteria[model].extend(criteria)
+
+        def depth_ok(depth):
+            return depth >= mindepth and (maxdepth == -1 or depth <= maxdepth)
+
+        def replicas_ok(entry):
+            return entry.kind == 'd' or min_replicas is None or \
+                   entry.replicas >= min_replicas
+
+        # With AVU criteria, the metadata join makes the queries count
+        # every replica once per matching AVU, so that the replica counts
+        # are then looked up in separate queries (without that join)
+        recount = len(object_avu) > 0 and \
+                  (min_replicas is not None or return_entries)
+
+        def count_replicas(entries):
+            if not recount:
+                yield from entries
+                return
+
+            while True:
+                chunk = list(itertools.islice(entries, glob_chunk_size))
+                if len(chunk) == 0:
+                    return
+                self._count_replicas(chunk, attribute_criteria[DataObject])
+                yield from chunk
+
+        def name_ok(path):
+            name = path if use_wholename else os.path.basename(path)
+            return fnmatch.fnmatch(name, pattern)
 
         # Loop over the glob-pattern-matching collections and data objects
-        for path_root in self.iglob(irods_path, debug=debug):
+        for root in self.iglob(irods_path, return_entries=True, debug=debug):
+            path_root = root.path
             self.log('DBG| search.find path_root: %s' % path_root, debug)
-            path_root_abs = self.session.path.get_absolute_irods_path(path_root)
+            path_root_abs = root.abs_path
+
+            if root.kind == 'f':
+                if 'f' not in types.split(','):
+                    continue
+                elif len(meta_criteria[DataObject]) > 0:
+                    # Check the criteria with a query for this data object
+                    criteria = [Criterion('=', Collection.name,
+                                          os.path.dirname(path_root_abs)),
+                                Criterion('=', DataObject.name,
+                                          os.path.basename(path_root_abs))]
+                    q = self._query_entries('f', criteria + \
+                                            meta_criteria[DataObject])
+                    results = list(self._results(q, limit=1))
+                    if len(results) == 0:
+                        continue
+                    root.replicas = results[0][DataObject.replica_number]
 
-            if not self.session.collections.exists(path_root_abs):
-                if 'f' in types.split(','):
-                    yield path_root
+                if recount:
+                    self._count_replicas([root],
+                                         attribute_criteria[DataObject])
+                if replicas_ok(root):
+                    yield root if return_entries else path_root
                 continue
 
-            # Walk the collection trees
-            iterators = [self.walk(path_root, mindepth=mindepth,
-                                   maxdepth=maxdepth, return_objects=True,
-                                   debug=debug)]
-            if mindepth == 0:
-                # Also include the root collection,
-                # which is not covered by self.walk
-                collection = self.session.collections.get(path_root_abs)
-                iterators.insert(0, [(collection, [collection], [])])
-
-            iterator = itertools.chain(*iterators)
-
-            for (collection, subcollections, data_objects) in iterator:
-                self.log('DBG| search.find collection: %s' % collection.path,
-                         debug)
-                # Now we are left with collections and data objects
-                # which match the depths and the given 'irods_path'
-                # glob pattern, and we just need to further filter
-                # on the (whole)name pattern and the AVUs.
-
-                # Things to keep in mind:
-                # * Collection: 'name' attribute refers to full path
-                #               'path' attribute non-existent
-                # * DataObject: 'name' attribute refers to basename
-                #               'path' attribute non-existent
-                # * iRODSCollection and iRODSDataObject:
-                #               'name' refers to basename,
-                #               'path' referse to full path
-
-                for t, items in zip(['d', 'f'], [subcollections, data_objects]):
-                    if t not in types.split(','):
-                        continue
+            # The collections and data objects in the tree (which also
+            # satisfy the AVU criteria, if any) are streamed from a single
+            # (paged) query per type, after which we just need to further
+            # filter on the depths and the (whole)name pattern.
+            for t, model in zip(['d', 'f'], [Collection, DataObject]):
+                if t not in types.split(',') or meta_criteria[model] is None:
+                    continue
+
+                iterator = self._iter_subtree(path_root_abs, t,
+                                              criteria=meta_criteria[model],
+                                              debug=debug)
+                entries = (entry for entry, depth in iterator
+                           if depth_ok(depth) and name_ok(entry.abs_path))
+                if t == 'f':
+                    entries = count_replicas(entries)
+
+                for entry in entries:
+                    if replicas_ok(entry):
+                        entry.path = entry.abs_path.replace(path_root_abs,
+                                                    path_root.rstrip('/'), 1)
+                        yield entry if return_entries else entry.path
+
+    @staticmethod
+    def _attribute_criteria(min_size=None, max_size=None, newer=None,
+                            older=None, owner=None, resource=None,
+                            checksum=None):
+        """ Returns a dictionary with, for both Collection and DataObject,
+        the list of criteria corresponding to the given find() filters,
+        or None if no collections (or data objects) can satisfy them.
+        """
+        def to_datetime(value):
+            if isinstance(value, datetime):
+                return value
+            return datetime.fromtimestamp(value, timezone.utc)
+
+        criteria = {Collection: [], DataObject: []}
+
+        for model in [Collection, DataObject]:
+            if newer is not None:
+                criteria[model].append(Criterion('>', model.modify_time,
+                                                 to_datetime(newer)))
+            if older is not None:
+                criteria[model].append(Criterion('<', model.modify_time,
+                                                 to_datetime(older)))
+            if owner is not None:
+                criteria[model].append(Criterion('=', model.owner_name,
+                                                 owner))
+
+        if min_size is not None:
+            criteria[DataObject].append(Criterion('>=', DataObject.size,
+                                                  min_size))
+        if max_size is not None:
+            criteria[DataObject].append(Criterion('<=', DataObject.size,
+                                                  max_size))
+        if resource is not None:
+            criteria[DataObject].append(Criterion('=',
+                                                  DataObject.resource_name,
+                                                  resource))
+        if checksum is not None:
+            op = 'like' if '%' in checksum else '='
+            criteria[DataObject].append(Criterion(op, DataObject.checksum,
+                                                  checksum))
+
+        if any([value is not None for value in [min_size, max_size,
+                                                 resource, checksum]]):
+            criteria[Collection] = None
+        return criteria
+
+    def _count_replicas(self, entries, criteria=[]):
+        """ Sets the replica counts of the given data object entries,
+        counted among the replicas satisfying the given criteria, with
+        one query per chunk of entries. The criteria should not involve
+        metadata, as every replica would then be counted once for every
+        matching AVU.
+        """
+        for index in range(0, len(entries), glob_chunk_size):
+            chunk = entries[index:index + glob_chunk_size]
+            dirnames = sorted(set([os.path.dirname(entry.abs_path)
+                                   for entry in chunk]))
+            basenames = sorted(set([os.path.basename(entry.abs_path)
+                                    for entry in chunk]))
+            q = self._query_entries('f', [In(Collection.name, dirnames),
+                                          In(DataObject.name, basenames)] + \
+                                         list(criteria))
+
+            counts = {}
+            for result in self._results(q):
+                entry = self._make_entry('f', result)
+                counts[entry.abs_path] = entry.replicas
+
+            for entry in chunk:
+                entry.replicas = counts.get(entry.abs_path, 0)
+
+    def _iter_subtree(self, root_abs, t, criteria=[], debug=False):
+        """ Yields (Entry instance, depth) tuples for all collections
+        (t='d') or data objects (t='f') in the collection tree rooted
+        at root_abs (including the root itself), streamed from a single
+        (paged) query. The 'path' attributes of the entries are set
+        to the absolute paths. The listed paths are also recorded
+        in the session's lookup cache.
+
+        Arguments:
+
+        root_abs: str
+            Absolute path of the root collection
+
+        t: str
+            Either 'd' (collections) or 'f' (data objects)
+
+        criteria: list of Criterion instances (default: [])
+            Additional criteria for the query (e.g. on AVUs)
+
+        debug: bool (default: False)
+            Set to True for debugging info
+        """
+        prefix = root_abs.rstrip('/')
+
+        def get_depth(collection_path):
+            # Returns the depth of the given collection with respect
+            # to the root, or None if it lies outside of the tree
+            if collection_path == root_abs:
+                return 0
+            elif collection_path.startswith(prefix + '/'):
+                return collection_path[len(prefix):].count('/')
+            return None
+
+        # Note: the metadata fields are not selected, so that every match
+        # is returned only once, even when several of its AVUs satisfy the
+        # criteria (for data objects, the replica count then includes such
+        # duplicates, see _count_replicas()).
+        all_criteria = [Criterion('like', Collection.name, prefix + '%')]
+        all_criteria.extend(criteria)
+        q = self._query_entries(t, all_criteria)
+
+        self.log('DBG| search._iter_subtree query for %s in %s' % \
+                 (t, root_abs), debug)
+
+        for result in self._results(q):
+            depth = get_depth(result[Collection.name])
+            if depth is None:
+                continue
 
-                    for item in items:
-                        name = item.path if use_wholename else item.name
-                        if not fnmatch.fnmatch(name, pattern):
-                            continue
-
-                        if t == 'd':
-                            q = self.session.query(Collection.name,
-                                                   *meta_fields[Collection])
-                            criterion = Criterion('=',  Collection.name,
-                                                  item.path)
-                            q = q.filter(criterion, *meta_criteria[Collection])
-
-                        elif t == 'f':
-                            q = self.session.query(Collection.name,
-                                                   DataObject.name,
-                                                   *meta_fields[DataObject])
-                            criteria = [Criterion('=',  Collection.name,
-                                                  collection.path),
-                                        Criterion('=',  DataObject.name,
-                                                  item.name)]
-                            q = q.filter(*criteria, *meta_criteria[DataObject])
-
-                        results = [result for result in q.get_results()]
-                        assert len(results) in [0, 1], results
-
-                        if len(results) == 1:
-                            path = item.path.replace(path_root_abs,
-                                                     path_root.rstrip('/'), 1)
-                            yield path
+            entry = self._make_entry(t, result)
+            self.session.lookups.set(entry.abs_path, t, True)
+            yield (entry, depth if t == 'd' else depth + 1)
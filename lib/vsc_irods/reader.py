@@ -0,0 +1,163 @@
+import io
+import threading
+
+
+class DataObjectReader(io.RawIOBase):
+    """ A read-only, seekable file object for the content of an iRODS
+    data object, as yielded by
+    :func:`vsc_irods.manager.bulk_manager.BulkManager.iter_open`.
+
+    The content is read in blocks of 'read_ahead' bytes. As soon
+    as a block gets used, the next one is already read in the
+    background (if an executor is given), so that sequential reads
+    hardly ever wait for the server. Data objects which fit in a single
+    block are read as a whole when the reader is created, after which
+    the reader does not hold a connection anymore.
+
+    Arguments:
+
+    path: str
+        The absolute path of the data object
+
+    size: int
+        The size of the data object
+
+    f: file object or None (default: None)
+        The opened data object (None if 'data' holds all the content)
+
+    data: bytes (default: b'')
+        The first block of the content
+
+    read_ahead: int (default: 1024**2)
+        The block size in bytes
+
+    executor: concurrent.futures.Executor or None (default: None)
+        The executor in which the next blocks are read
+    """
+    def __init__(self, path, size, f=None, data=b'', read_ahead=1024**2,
+                 executor=None):
+        io.RawIOBase.__init__(self)
+        self.path = path
+        self.name = path
+        self.size = size
+        self.read_ahead = read_ahead
+        self.executor = executor
+
+        self._f = f
+        self._lock = threading.Lock()
+        self._position = 0
+        self._blocks = {0: data}
+        self._pending = {}
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        if not self.closed:
+            for future in self._pending.values():
+                future.cancel()
+            with self._lock:
+                if self._f is not None:
+                    self._f.close()
+                    self._f = None
+            self._blocks = {}
+        io.RawIOBase.close(self)
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+
+        if offset < 0:
+            raise ValueError('Negative seek position %d' % offset)
+        self._position = offset
+        return offset
+
+    def _read_block(self, index):
+        # Reads the block with the given index from the data object
+        start = index * self.read_ahead
+        with self._lock:
+            if self._f is None:
+                raise ValueError('I/O operation on closed reader')
+            self._f.seek(start)
+            return self._f.read(min(self.read_ahead, self.size - start))
+
+    def _block(self, index):
+        # Returns the block with the given index and starts reading
+        # the next one in the background (keeping only those two)
+        if index in self._blocks:
+            data = self._blocks[index]
+        elif index in self._pending:
+            data = self._pending.pop(index).result()
+        else:
+            data = self._read_block(index)
+
+        following = index + 1
+        if following * self.read_ahead < self.size and \
+           following not in self._pending and self.executor is not None:
+            try:
+                self._pending[following] = self.executor.submit(
+                                                self._read_block, following)
+            except RuntimeError:
+                # The executor has been shut down
+                self.executor = None
+
+        for key in list(self._pending):
+            if key not in [index, following]:
+                self._pending.pop(key).cancel()
+
+        self._blocks = {index: data}
+        return data
+
+    def _view(self):
+        # Returns a memoryview of the current block from the position on
+        if self._position >= self.size:
+            return memoryview(b'')
+        index, offset = divmod(self._position, self.read_ahead)
+        return memoryview(self._block(index))[offset:]
+
+    def peek(self, size=0):
+        """ Returns the bytes from the current position up to the end
+        of the current block (without changing the position)
+        """
+        return bytes(self._view())
+
+    def readinto(self, b):
+        view = memoryview(b).cast('B')
+        count = 0
+
+        while count < len(view) and self._position < self.size:
+            data = self._view()
+            n = min(len(data), len(view) - count)
+            if n == 0:
+                break
+            view[count:count + n] = data[:n]
+            count += n
+            self._position += n
+
+        return count
+
+    def readall(self):
+        return self.read(max(self.size - self._position, 0))
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(self.size - self._position, 0)
+
+        data = self._view()
+        if size <= len(data):
+            # Served from the current block with a single copy
+            data = bytes(data[:size])
+            self._position += len(data)
+            return data
+
+        b = bytearray(min(size, max(self.size - self._position, 0)))
+        n = self.readinto(b)
+        return bytes(b[:n])
@@ -2,6 +2,7 @@ import os
 import sys
 import ssl
 from irods.session import iRODSSession
+from vsc_irods.lookup import LookupCache
 from vsc_irods.manager.path_manager import PathManager
 from vsc_irods.manager.search_manager import SearchManager
 from vsc_irods.manager.bulk_manager import BulkManager
@@ -33,8 +34,16 @@ class VSCiRODSSession(iRODSSession):
     	Where output should be printed
         Use '-' for stdout, None for /dev/null,
         any other string for a text file, or a file handle
+
+    lookup_ttl: float (default: 60)
+        The number of seconds for which the existence and type of
+        iRODS paths are cached (0 disables the cache, see
+        :class:`vsc_irods.lookup.LookupCache`)
+
+    lookup_size: int (default: 100000)
+        The maximum number of paths in that cache
     """
-    def __init__(self, txt='-', **kwargs):
+    def __init__(self, txt='-', lookup_ttl=60, lookup_size=100000, **kwargs):
         try:
             env_file = os.environ['IRODS_ENVIRONMENT_FILE']
         except KeyError:
@@ -48,7 +57,13 @@ class VSCiRODSSession(iRODSSession):
         iRODSSession.__init__(self, irods_env_file=env_file, **ssl_settings,
                               **kwargs)
 
+        # The remaining options, for setting up a similar session
+        # (e.g. in a background process)
+        self.options = dict(lookup_ttl=lookup_ttl, lookup_size=lookup_size,
+                            **kwargs)
+
         self.set_log_output(txt)
+        self.lookups = LookupCache(ttl=lookup_ttl, max_size=lookup_size)
         self.path = PathManager(self)
         self.search = SearchManager(self)
         self.bulk = BulkManager(self)
@@ -0,0 +1,258 @@
+import os
+import json
+import time
+
+
+# Prefix of the files in which the state of a stage-in is kept
+# (in the destination folder, hidden from e.g. globbing with '*')
+stage_prefix = '.vsc-prc-stage'
+
+
+def is_running(pid):
+    """ Returns whether the process with the given ID is running
+    (where child processes which have exited are reaped).
+    """
+    try:
+        return os.waitpid(pid, os.WNOHANG) == (0, 0)
+    except ChildProcessError:
+        pass
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Stage:
+    """ A handle on a stage-in, i.e. a download of data objects to
+    a local folder which runs in a background process (see
+    :func:`vsc_irods.manager.bulk_manager.BulkManager.prefetch`).
+
+    The state of the stage-in is kept in hidden files in the
+    destination folder, so that also other processes (e.g. the steps
+    of a job script, with 'vsc-prc-stage --wait') can wait for it:
+
+    * '.vsc-prc-stage.journal': the transfer journal (see
+      :class:`vsc_irods.journal.TransferJournal`), which lists
+      all planned transfers before any of them is started,
+    * '.vsc-prc-stage.pid': the process ID of the background process,
+    * '.vsc-prc-stage.done': the outcome, written at the end,
+    * '.vsc-prc-stage.log': the log output.
+
+    The data objects are downloaded to temporary files which are renamed
+    once they are complete, so that a file which exists is complete.
+
+    Example:
+
+    >>> stage = session.bulk.prefetch(['~/inputs/*.xyz'], local_path='.')
+    >>> for name in ['a.xyz', 'b.xyz']:
+    >>>     stage.wait(name)
+    >>>     ...
+    >>> stage.join()
+
+    Arguments:
+
+    local_path: str (default: '.')
+        The destination folder of the stage-in
+    """
+    def __init__(self, local_path='.'):
+        self.local_path = os.path.abspath(local_path)
+        prefix = os.path.join(self.local_path, stage_prefix)
+        self.journal_file = prefix + '.journal'
+        self.pid_file = prefix + '.pid'
+        self.done_file = prefix + '.done'
+        self.log_file = prefix + '.log'
+
+        self._offset = 0
+        self._states = {}
+
+    def _write(self, filename, text):
+        # Writes the given text to the given file in an atomic manner
+        with open(filename + '.tmp', 'w') as f:
+            f.write(text)
+        os.replace(filename + '.tmp', filename)
+
+    def reset(self):
+        """ Removes the state of a previous stage-in (except the log) """
+        for filename in [self.journal_file, self.pid_file, self.done_file]:
+            if os.path.exists(filename):
+                os.remove(filename)
+        self._offset = 0
+        self._states = {}
+
+    def start(self, pid):
+        """ Records the process ID of the background process """
+        self._write(self.pid_file, str(pid))
+
+    def finish(self, errors=[]):
+        """ Records the outcome of the stage-in, given the list
+        of error messages (if any).
+        """
+        if len(errors) > 0:
+            result = {'status': 'failed', 'error': '; '.join(errors)}
+        else:
+            result = {'status': 'ok'}
+        self._write(self.done_file, json.dumps(result) + '\n')
+
+    @property
+    def pid(self):
+        """ The process ID of the background process (or None) """
+        try:
+            with open(self.pid_file, 'r') as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def _update(self):
+        # Reads the records which have been added to the journal
+        # since the previous call (only complete lines)
+        try:
+            with open(self.journal_file, 'r') as f:
+                f.seek(self._offset)
+                for line in f:
+                    if not line.endswith('\n'):
+                        break
+                    self._offset += len(line.encode())
+
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+
+                    state = self._states.setdefault(record['destination'],
+                                                    {})
+                    if record['status'] == 'partial':
+                        continue
+                    state['status'] = record['status']
+                    if 'error' in record:
+                        state['error'] = record['error']
+        except FileNotFoundError:
+            pass
+
+    def result(self):
+        """ Returns the outcome of the stage-in, as a dictionary with
+        the 'status' ('ok' or 'failed') and, if failed, the 'error',
+        or None if it is still running.
+        """
+        try:
+            with open(self.done_file, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+
+        pid = self.pid
+        if pid is not None and is_running(pid):
+            return None
+
+        if os.path.exists(self.done_file):
+            return self.result()
+        return {'status': 'failed',
+                'error': 'The stage-in process is not running'}
+
+    def progress(self):
+        """ Returns a dictionary with the number of planned transfers
+        ('planned') and the number of those which are done ('done')
+        or have failed ('failed').
+        """
+        self._update()
+        counts = {'planned': len(self._states), 'done': 0, 'failed': 0}
+        for state in self._states.values():
+            if state['status'] in ['done', 'failed']:
+                counts[state['status']] += 1
+        return counts
+
+    def wait(self, local_file, timeout=None, interval=1.):
+        """ Waits until the given local file (a path relative to the
+        destination folder, or an absolute one) has been staged in,
+        and returns its absolute path.
+
+        Raises an OSError if its transfer has failed, FileNotFoundError
+        if the stage-in has finished without it, and TimeoutError if
+        the file has not arrived within the given timeout (in seconds).
+        A file which already exists is not waited for.
+
+        Arguments:
+
+        local_file: str
+            The file to wait for
+
+        timeout: float or None (default: None)
+            The maximal waiting time (in seconds)
+
+        interval: float (default: 1)
+            The maximal time between two checks (in seconds)
+        """
+        path = os.path.join(self.local_path, local_file)
+        start = time.time()
+        delay = min(0.05, interval)
+
+        while True:
+            if os.path.exists(path):
+                return path
+
+            self._update()
+            state = self._states.get(path, {})
+            if state.get('status') == 'failed':
+                raise OSError('Staging in %s failed: %s' % \
+                              (path, state.get('error')))
+
+            if self.result() is not None:
+                if os.path.exists(path):
+                    return path
+                raise FileNotFoundError('%s has not been staged in' % path)
+
+            if timeout is not None and time.time() - start > timeout:
+                raise TimeoutError('Timed out waiting for %s' % path)
+
+            time.sleep(delay)
+            delay = min(2 * delay, interval)
+
+    def join(self, timeout=None, interval=1.):
+        """ Waits until the stage-in has finished, and returns
+        its outcome (see result()). Raises a TimeoutError if this
+        takes longer than the given timeout (in seconds).
+        """
+        start = time.time()
+        delay = min(0.05, interval)
+
+        while True:
+            result = self.result()
+            if result is not None:
+                return result
+
+            if timeout is not None and time.time() - start > timeout:
+                raise TimeoutError('Timed out waiting for the stage-in ' + \
+                                   'to %s' % self.local_path)
+
+            time.sleep(delay)
+            delay = min(2 * delay, interval)
+
+
+def find_stage(local_file):
+    """ Returns the Stage of the stage-in to the folder of the given
+    local file or, for files in subfolders of a recursive stage-in,
+    to the nearest parent folder with a stage-in (or else the Stage
+    of its own folder).
+    """
+    folder = os.path.dirname(os.path.abspath(local_file))
+    parent = folder
+    while True:
+        stage = Stage(parent)
+        if os.path.exists(stage.pid_file):
+            return stage
+        elif os.path.dirname(parent) == parent:
+            return Stage(folder)
+        parent = os.path.dirname(parent)
+
+
+def wait_for_file(local_file, timeout=None, interval=1.):
+    """ Waits until the given local file has been staged in by the
+    stage-in to its folder or one of its parent folders (see
+    :func:`find_stage`), and returns its absolute path.
+    """
+    local_file = os.path.abspath(local_file)
+    stage = find_stage(local_file)
+    return stage.wait(local_file, timeout=timeout, interval=interval)
@@ -0,0 +1,172 @@
+import os
+import time
+import fnmatch
+from vsc_irods.manager.bulk_manager import job_metadata, scan_local
+
+
+class OutputWatcher:
+    """ Uploads the files in a local folder to an iRODS collection
+    while they are still being written, e.g. the outputs of a running
+    job ('write-behind'), so that the transfers do not all end up at
+    the end of the job and that the outputs survive a killed job.
+
+    The folder is polled for files which have not been modified
+    for a while (see 'quiet'), which are then uploaded with
+    :func:`vsc_irods.manager.bulk_manager.BulkManager.put`. Files
+    are only uploaded again if they have changed since, and flushing
+    uploads all remaining files, whether they are quiet or not.
+
+    Example:
+
+    >>> watcher = OutputWatcher(session, 'outputs', '~/results', quiet=30)
+    >>> watcher.run(interval=10, pid=os.getppid())
+
+    Arguments:
+
+    session: VSCiRODSSession
+        The session used for the uploads
+
+    local_path: str (default: '.')
+        The local folder to watch
+
+    irods_path: str (default: '.')
+        The (existing) collection to which the files are uploaded,
+        where subfolders become subcollections
+
+    pattern: str (default: '*')
+        The glob pattern which the names of the files need to match
+        (hidden files are always skipped)
+
+    recurse: bool (default: True)
+        Whether to also watch the subfolders
+
+    quiet: float (default: 30)
+        The number of seconds for which a file must not have been
+        modified before it is uploaded
+
+    job_metadata: bool (default: False)
+        Whether to add job-related metadata to the uploaded data objects
+        (see :func:`vsc_irods.manager.bulk_manager.job_metadata`)
+
+    workers: int (default: 1)
+        The number of files to upload concurrently
+
+    verbose: bool (default: False)
+        Whether to print more output
+
+    options: (any remaining keywords arguments)
+        Additional options to be passed on to put()
+        (e.g. 'streams')
+    """
+    def __init__(self, session, local_path='.', irods_path='.', pattern='*',
+                 recurse=True, quiet=30, job_metadata=False, workers=1,
+                 verbose=False, **options):
+        self.session = session
+        self.local_path = local_path
+        self.irods_path = session.path.get_absolute_irods_path(irods_path)
+        self.pattern = pattern
+        self.recurse = recurse
+        self.quiet = quiet
+        self.job_metadata = job_metadata
+        self.workers = workers
+        self.verbose = verbose
+        self.options = options
+
+        self.stopped = False
+        self.uploaded = {}
+
+    def log(self, line, flag):
+        # Also works with an AgentSession (see vsc_irods.agent)
+        if flag:
+            print(line, file=self.session.txt, flush=True)
+
+    def stop(self, *args):
+        """ Makes run() flush and return (e.g. as a signal handler) """
+        self.stopped = True
+
+    def scan(self):
+        """ Yields (local file, collection, os.stat_result) tuples
+        for the files which match the pattern.
+        """
+        for folder, subfolders, files in scan_local(self.local_path):
+            collection = os.path.normpath(os.path.join(self.irods_path,
+                                os.path.relpath(folder, self.local_path)))
+
+            for filename, local_stat in files:
+                if fnmatch.fnmatch(filename, self.pattern):
+                    yield (os.path.join(folder, filename), collection,
+                           local_stat)
+
+            if not self.recurse:
+                break
+
+    def poll(self, flush=False):
+        """ Uploads the files which have changed since they were last
+        uploaded (or are new) and which have not been modified for
+        'quiet' seconds, or all of them if flush is True. Returns the
+        number of uploaded files.
+        """
+        now = time.time()
+        batches = {}
+
+        for local_file, collection, local_stat in self.scan():
+            signature = (local_stat.st_size, local_stat.st_mtime_ns)
+            if self.uploaded.get(local_file) == signature:
+                continue
+
+            if flush or now - local_stat.st_mtime >= self.quiet:
+                batches.setdefault(collection, []).append((local_file,
+                                                           signature))
+
+        avus = job_metadata() if self.job_metadata else []
+        count = 0
+
+        for collection, batch in sorted(batches.items()):
+            try:
+                self.session.path.imkdir(collection, parents=True,
+                                         verbose=self.verbose)
+                self.session.bulk.put([local_file for local_file, _ in batch],
+                                      irods_path=collection, clobber=True,
+                                      workers=self.workers, object_avu=avus,
+                                      verbose=self.verbose, **self.options)
+            except Exception as error:
+                # Everything in the batch gets another try at the next poll
+                self.log('Uploading to %s failed: %s' % (collection, error),
+                         True)
+                continue
+
+            # Files which get modified again during the upload have
+            # a new signature, so that they get uploaded again later
+            for local_file, signature in batch:
+                self.uploaded[local_file] = signature
+            count += len(batch)
+
+        return count
+
+    def run(self, interval=10, pid=None):
+        """ Polls the folder every 'interval' seconds until stop() gets
+        called or, if given, the process with the given ID has exited,
+        and then flushes. Returns the total number of uploads.
+        """
+        count = 0
+        next_poll = time.time()
+
+        while not self.stopped:
+            if pid is not None:
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    self.log('Process %d has exited' % pid, self.verbose)
+                    break
+                except PermissionError:
+                    pass
+
+            if time.time() >= next_poll:
+                count += self.poll()
+                next_poll = time.time() + interval
+
+            time.sleep(min(1., interval))
+
+        self.log('Flushing %s' % self.local_path, self.verbose)
+        count += self.poll(flush=True)
+        return count
@@ -5,9 +5,23 @@ inside your iRODS home.
 """
 
 import os
+import json
+import time
+import shutil
 import fnmatch
 import tempfile
+import threading
+from vsc_irods.agent import (Agent, AgentError, AgentSession, _exception,
+                             connect, control)
+from vsc_irods.batch import parse_operation, run_batch
+from vsc_irods.cache import DownloadCache
+from vsc_irods.journal import TransferJournal
+from vsc_irods.lookup import LookupCache
+from vsc_irods.manager.bulk_manager import BulkOperationError
+from vsc_irods.manager.search_manager import get_shard
 from vsc_irods.session import VSCiRODSSession
+from vsc_irods.stage import Stage, find_stage, wait_for_file
+from vsc_irods.watch import OutputWatcher
 
 
 def create_tmpdir(session, tmpdir):
@@ -116,6 +130,17 @@ def test_put(session, tmpdir):
             fname = line.rstrip()
             assert '%s/molecules/%s' % (tmpdir, fname) in hits, (hits, fname)
 
+    session.bulk.put('data', irods_path=tmpdir + '/molecules', recurse=True,
+                     workers=4, verbose=True)
+    sizes = list(session.bulk.size(tmpdir + '/molecules/data', recurse=True,
+                                   counts=True))
+    expected = sum([os.path.getsize(os.path.join('data/molecules', f))
+                    for f in os.listdir('data/molecules')]) + \
+               sum([os.path.getsize(os.path.join('data', f))
+                    for f in os.listdir('data')
+                    if os.path.isfile(os.path.join('data', f))])
+    assert sizes[-1][1:] == (expected, 9), (sizes, expected)
+
     remove_tmpdir(session, tmpdir)
     return
 
@@ -164,6 +189,461 @@ def test_get(session, tmpdir):
         f = os.path.join(d, os.path.basename(testfile))
         assert os.path.isfile(f), f
 
+    # Concurrent transfers
+    session.bulk.put('data/molecules', irods_path=testdir, recurse=True,
+                     verbose=True)
+
+    with tempfile.TemporaryDirectory() as tmpdest:
+        print('Using temporary test directory:', tmpdest)
+        session.bulk.get(testdir + '/molecules/*', local_path=tmpdest,
+                         workers=4, verbose=True)
+        for f in os.listdir('data/molecules'):
+            with open(os.path.join('data/molecules', f), 'rb') as f1:
+                with open(os.path.join(tmpdest, f), 'rb') as f2:
+                    assert f1.read() == f2.read(), f
+
+    # Transfers in multiple streams (in both directions)
+    session.bulk.put('data/*', irods_path=testdir,
+                     streams=3, large_threshold=0, verbose=True)
+    with tempfile.TemporaryDirectory() as tmpdest:
+        session.bulk.get(testdir + '/*', local_path=tmpdest, workers=2,
+                         streams=3, large_threshold=0, verbose=True)
+        for f in ['README', 'molecule_names.txt']:
+            with open(os.path.join('data', f), 'rb') as f1:
+                with open(os.path.join(tmpdest, f), 'rb') as f2:
+                    assert f1.read() == f2.read(), f
+
+    remove_tmpdir(session, tmpdir)
+    return
+
+
+def test_sync(session, tmpdir):
+    create_tmpdir(session, tmpdir)
+
+    with tempfile.TemporaryDirectory() as tmpsrc:
+        src = os.path.join(tmpsrc, 'data')
+        shutil.copytree('data', src)
+        session.bulk.put(src, irods_path=tmpdir, recurse=True, sync=True,
+                         verbose=True)
+
+        with open(os.path.join(src, 'README'), 'a') as f:
+            f.write('One more line\n')
+
+        print('> Expecting only the README to be transferred:')
+        session.bulk.put(src, irods_path=tmpdir, recurse=True, sync=True,
+                         verbose=True)
+        sizes = list(session.bulk.size(tmpdir + '/data/README'))
+        expected = os.path.getsize(os.path.join(src, 'README'))
+        assert sizes[0][1] == expected, (sizes, expected)
+
+    with tempfile.TemporaryDirectory() as tmpdest:
+        session.bulk.get(tmpdir + '/data', local_path=tmpdest, recurse=True,
+                         sync=True, verbose=True)
+
+        # A local change which affects neither the size nor the
+        # modification time goes unnoticed
+        f = os.path.join(tmpdest, 'data', 'molecules', 'c6h6.xyz')
+        stat = os.stat(f)
+        with open(f, 'r+b') as fh:
+            first = fh.read(1)
+            fh.seek(0)
+            fh.write(b'#')
+        os.utime(f, (stat.st_atime, stat.st_mtime))
+
+        print('> Expecting no transfers:')
+        session.bulk.get(tmpdir + '/data', local_path=tmpdest, recurse=True,
+                         sync=True, verbose=True)
+        with open(f, 'rb') as fh:
+            assert fh.read(1) == b'#'
+
+        # ... but not when the modification time differs
+        os.utime(f, (stat.st_atime, stat.st_mtime - 10))
+        session.bulk.get(tmpdir + '/data', local_path=tmpdest, recurse=True,
+                         sync=True, verbose=True)
+        with open(f, 'rb') as fh:
+            assert fh.read(1) == first
+        assert os.stat(f).st_mtime == stat.st_mtime
+
+    remove_tmpdir(session, tmpdir)
+    return
+
+
+def test_resume(session, tmpdir):
+    create_tmpdir(session, tmpdir)
+
+    session.bulk.put('data/molecules', irods_path=tmpdir, recurse=True,
+                     verbose=True)
+    molecules = sorted(os.listdir('data/molecules'))
+
+    with tempfile.TemporaryDirectory() as tmpdest:
+        journal = os.path.join(tmpdest, 'journal')
+        session.bulk.get(tmpdir + '/molecules', local_path=tmpdest,
+                         recurse=True, journal=journal, verbose=True)
+
+        with open(journal, 'r') as f:
+            statuses = [json.loads(line)['status'] for line in f]
+        assert statuses.count('planned') == len(molecules), statuses
+        assert statuses.count('done') == len(molecules), statuses
+
+        # Completed transfers are not repeated
+        f = os.path.join(tmpdest, 'molecules', molecules[0])
+        with open(f, 'r+b') as fh:
+            fh.write(b'#')
+
+        session.bulk.get(tmpdir + '/molecules', local_path=tmpdest,
+                         recurse=True, journal=journal, resume=True,
+                         verbose=True)
+        with open(f, 'rb') as fh:
+            assert fh.read(1) == b'#'
+
+        # An interrupted transfer in multiple streams continues
+        # from the completed byte ranges
+        with open(os.path.join('data/molecules', molecules[1]), 'rb') as fh:
+            data = fh.read()
+        half = len(data) // 2
+
+        f = os.path.join(tmpdest, 'molecules', molecules[1])
+        with open(f, 'wb') as fh:
+            fh.write(data[:half] + b'\0' * (len(data) - half))
+
+        path = session.path.get_absolute_irods_path(tmpdir + '/molecules/' +
+                                                    molecules[1])
+        entry = session.bulk._object_entry(path)
+        with TransferJournal(journal, resume=True) as j:
+            key = (path, os.path.abspath(f))
+            j.planned(*key, entry.size, entry.checksum)
+            j.partial(*key, 0, half)
+
+        session.bulk.get(tmpdir + '/molecules', local_path=tmpdest,
+                         recurse=True, journal=journal, resume=True,
+                         streams=2, large_threshold=0, verbose=True)
+        with open(f, 'rb') as fh:
+            assert fh.read() == data
+
+        with open(journal, 'r') as fh:
+            records = [json.loads(line) for line in fh]
+        records = [record for record in records
+                   if record['destination'] == os.path.abspath(f)]
+        offsets = [record['offset'] for record in records
+                   if record['status'] == 'partial']
+        assert offsets[0] == 0 and min(offsets[1:]) >= half, records
+        assert records[-1]['status'] == 'done', records
+
+        # An interrupted single-stream transfer is carried out again,
+        # even without clobbering
+        with open(os.path.join('data/molecules', molecules[2]), 'rb') as fh:
+            data = fh.read()
+
+        f = os.path.join(tmpdest, 'molecules', molecules[2])
+        with open(f, 'wb') as fh:
+            fh.write(data[:10])
+
+        path = session.path.get_absolute_irods_path(tmpdir + '/molecules/' +
+                                                    molecules[2])
+        entry = session.bulk._object_entry(path)
+        with TransferJournal(journal, resume=True) as j:
+            j.planned(path, os.path.abspath(f), entry.size, entry.checksum)
+
+        session.bulk.get(tmpdir + '/molecules', local_path=tmpdest,
+                         recurse=True, clobber=False, journal=journal,
+                         resume=True, verbose=True)
+        with open(f, 'rb') as fh:
+            assert fh.read() == data
+
+        # Uploads of files which have been rewritten with the same size
+        # are not considered to be done
+        put_journal = os.path.join(tmpdest, 'put_journal')
+        f = os.path.join(tmpdest, 'molecules', molecules[0])
+        session.bulk.put(f, irods_path=tmpdir, journal=put_journal,
+                         verbose=True)
+
+        with open(f, 'r+b') as fh:
+            fh.write(b'!')
+        stat = os.stat(f)
+        os.utime(f, (stat.st_atime, stat.st_mtime + 10))
+
+        session.bulk.put(f, irods_path=tmpdir, clobber=False,
+                         journal=put_journal, resume=True, verbose=True)
+        path = session.path.get_absolute_irods_path(tmpdir + '/' +
+                                                    molecules[0])
+        with session.data_objects.open(path, 'r') as fh:
+            assert fh.read(1) == b'!'
+
+    remove_tmpdir(session, tmpdir)
+    return
+
+
+def test_cache(session, tmpdir):
+    create_tmpdir(session, tmpdir)
+
+    session.bulk.put('data', irods_path=tmpdir, recurse=True, verbose=True)
+    molecules = sorted(os.listdir('data/molecules'))
+
+    with tempfile.TemporaryDirectory() as tmpcache:
+        cache = DownloadCache(tmpcache)
+
+        # Only the first download goes to the server
+        for i in range(2):
+            with tempfile.TemporaryDirectory() as tmpdest:
+                session.bulk.get(tmpdir + '/data/molecules',
+                                 local_path=tmpdest, recurse=True,
+                                 cache=cache, verbose=True)
+                for f in molecules:
+                    with open(os.path.join('data/molecules', f), 'rb') as f1:
+                        with open(os.path.join(tmpdest, 'molecules', f),
+                                  'rb') as f2:
+                            assert f1.read() == f2.read(), f
+
+        stats = cache.statistics()
+        assert stats['files'] == len(molecules), stats
+        assert stats['hits'] == len(molecules), stats
+        assert stats['misses'] == len(molecules), stats
+
+        # The least recently used files get evicted
+        max_size = stats['size'] // 2
+        cache = DownloadCache(tmpcache, max_size=max_size)
+        with tempfile.TemporaryDirectory() as tmpdest:
+            session.bulk.get(tmpdir + '/data/README', local_path=tmpdest,
+                             cache=cache, verbose=True)
+
+        stats = cache.statistics()
+        assert stats['size'] <= max_size, stats
+        assert stats['evictions'] > 0, stats
+
+    remove_tmpdir(session, tmpdir)
+    return
+
+
+def test_bundle(session, tmpdir):
+    create_tmpdir(session, tmpdir)
+    dest = session.path.get_absolute_irods_path(tmpdir)
+
+    session.bulk.put('data', irods_path=tmpdir, recurse=True,
+                     bundle_size=2048, verbose=True)
+
+    index = session.bulk.bundle_index(tmpdir + '/data')
+    assert len(index['bundles']) > 1, index
+    for bundle in index['bundles']:
+        assert session.data_objects.exists(dest + '/data/' + bundle)
+    assert not session.data_objects.exists(dest + '/data/README')
+
+    # Single files are read without reading whole bundles
+    with open('data/molecules/no2.xyz', 'rb') as f:
+        data = f.read()
+    assert session.bulk.read_member(tmpdir + '/data',
+                                    'molecules/no2.xyz') == data
+
+    # Bundles get extracted again
+    with tempfile.TemporaryDirectory() as tmpdest:
+        session.bulk.get(tmpdir + '/data', local_path=tmpdest, recurse=True,
+                         verbose=True)
+        for folder, subfolders, files in os.walk('data'):
+            for name in files:
+                f = os.path.join(folder, name)
+                with open(f, 'rb') as f1:
+                    with open(os.path.join(tmpdest, f), 'rb') as f2:
+                        assert f1.read() == f2.read(), f
+
+        # Unchanged files are not extracted again
+        f = os.path.join(tmpdest, 'data', 'README')
+        with open(f, 'r+b') as fh:
+            fh.write(b'#')
+        os.utime(f, (os.path.getmtime('data/README'),) * 2)
+        session.bulk.get(tmpdir + '/data', local_path=tmpdest, recurse=True,
+                         sync=True, verbose=True)
+        with open(f, 'rb') as fh:
+            assert fh.read(1) == b'#'
+
+    # Putting again with larger bundles replaces the old ones
+    session.bulk.put('data', irods_path=tmpdir, recurse=True,
+                     bundle_size=1024**2, verbose=True)
+    old_index = index
+    index = session.bulk.bundle_index(tmpdir + '/data')
+    assert index['bundles'] == ['bundle-g2-00000.tar'], index
+    for bundle in old_index['bundles']:
+        assert not session.data_objects.exists(dest + '/data/' + bundle)
+
+    remove_tmpdir(session, tmpdir)
+    return
+
+
+def test_stage(session, tmpdir):
+    create_tmpdir(session, tmpdir)
+
+    session.bulk.put('data', irods_path=tmpdir, recurse=True, verbose=True)
+    molecules = sorted(os.listdir('data/molecules'))
+
+    with tempfile.TemporaryDirectory() as tmpdest:
+        start = time.time()
+        stage = session.bulk.prefetch([tmpdir + '/data/molecules/' +
+                                       molecules[-1],
+                                       tmpdir + '/data/molecules/*.xyz'],
+                                      local_path=tmpdest, workers=2,
+                                      verbose=True)
+        assert time.time() - start < 5
+        assert stage.pid is not None
+
+        # Files only appear once they are complete
+        f = stage.wait(molecules[-1], timeout=60)
+        with open(os.path.join('data/molecules', molecules[-1]), 'rb') as f1:
+            with open(f, 'rb') as f2:
+                assert f1.read() == f2.read()
+
+        f = wait_for_file(os.path.join(tmpdest, molecules[0]), timeout=60)
+        assert os.path.getsize(f) == \
+               os.path.getsize(os.path.join('data/molecules', molecules[0]))
+
+        assert stage.join(timeout=60) == {'status': 'ok'}
+        progress = stage.progress()
+        assert progress['done'] == progress['planned'], progress
+        assert progress['failed'] == 0, progress
+
+        names = [name for name in os.listdir(tmpdest)
+                 if not name.startswith('.')]
+        assert sorted(names) == molecules, names
+        assert not any(name.endswith('.part') for name in os.listdir(tmpdest))
+
+        # Other processes can wait on the same stage-in
+        stage = Stage(tmpdest)
+        assert stage.result() == {'status': 'ok'}
+        try:
+            stage.wait('nonexisting.xyz', timeout=60)
+            raise AssertionError('Waiting for a missing file succeeded')
+        except FileNotFoundError:
+            pass
+
+    # Files in subfolders of a recursive stage-in
+    with tempfile.TemporaryDirectory() as tmpdest:
+        stage = session.bulk.prefetch(tmpdir + '/data', local_path=tmpdest,
+                                      recurse=True, verbose=True)
+        path = os.path.join(tmpdest, 'data', 'molecules', molecules[0])
+        assert find_stage(path).local_path == stage.local_path
+        f = wait_for_file(path, timeout=60)
+        assert os.path.getsize(f) == \
+               os.path.getsize(os.path.join('data/molecules', molecules[0]))
+        assert stage.join(timeout=60) == {'status': 'ok'}
+
+    remove_tmpdir(session, tmpdir)
+    return
+
+
+def test_iter_open(session, tmpdir):
+    create_tmpdir(session, tmpdir)
+
+    session.bulk.put('data', irods_path=tmpdir, recurse=True, verbose=True)
+
+    contents = {}
+    for folder, subfolders, files in os.walk('data'):
+        for name in files:
+            with open(os.path.join(folder, name), 'rb') as f:
+                contents[os.path.join(folder, name)] = f.read()
+
+    # Small blocks, so that also the read-ahead gets used
+    dest = session.path.get_absolute_irods_path(tmpdir)
+    paths = []
+    for f in session.bulk.iter_open(tmpdir + '/data', recurse=True,
+                                    prefetch=3, read_ahead=100):
+        with f:
+            name = os.path.relpath(f.path, dest)
+            paths.append(name)
+            assert f.read() == contents[name], name
+
+            f.seek(10)
+            assert f.read(150) == contents[name][10:160], name
+            f.seek(0)
+            assert b''.join(f.readlines()) == contents[name], name
+
+    assert sorted(paths) == sorted(contents), paths
+
+    # Stopping early closes the readers which were opened ahead
+    iterator = session.bulk.iter_open(tmpdir + '/data/molecules/*.xyz',
+                                      prefetch=4)
+    with next(iterator) as f:
+        assert int(f.readline()) > 0
+    iterator.close()
+
+    remove_tmpdir(session, tmpdir)
+    return
+
+
+def test_get_buffers(session, tmpdir):
+    create_tmpdir(session, tmpdir)
+
+    session.bulk.put('data', irods_path=tmpdir, recurse=True, verbose=True)
+
+    contents = {}
+    for folder, subfolders, files in os.walk('data'):
+        for name in files:
+            with open(os.path.join(folder, name), 'rb') as f:
+                contents[os.path.join(folder, name)] = f.read()
+
+    dest = session.path.get_absolute_irods_path(tmpdir)
+    name = 'data/molecules/c6h6.xyz'
+    content = contents[name]
+
+    buffer = bytearray(len(content) + 10)
+    count = session.bulk.get_into(tmpdir + '/' + name, buffer)
+    assert count == len(content), count
+    assert buffer[:count] == content
+
+    # Partial reads, also over multiple streams
+    buffer = bytearray(20)
+    count = session.bulk.get_into(tmpdir + '/' + name, buffer, offset=5)
+    assert count == 20 and buffer == content[5:25], buffer
+
+    view = memoryview(bytearray(len(content)))[10:]
+    count = session.bulk.get_into(tmpdir + '/' + name, view, offset=10,
+                                  streams=3)
+    assert count == len(content) - 10 and view == content[10:], count
+
+    views = session.bulk.get_buffers(tmpdir + '/data', recurse=True,
+                                     align=8, workers=3, verbose=True)
+    assert sorted(os.path.relpath(path, dest) for path in views) == \
+           sorted(contents), views
+    for path, view in views.items():
+        assert view == contents[os.path.relpath(path, dest)], path
+
+    # The slices share a single (allocated) buffer
+    view = list(views.values())[-1]
+    assert all(v.obj is view.obj for v in views.values())
+
+    try:
+        session.bulk.get_buffers(tmpdir + '/data', recurse=True,
+                                 buffer=bytearray(10))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('Expected a ValueError for a small buffer')
+
+    remove_tmpdir(session, tmpdir)
+    return
+
+
+def test_read_ranges(session, tmpdir):
+    create_tmpdir(session, tmpdir)
+
+    session.bulk.put('data', irods_path=tmpdir, recurse=True, verbose=True)
+
+    contents = {}
+    for folder, subfolders, files in os.walk('data'):
+        for name in files:
+            with open(os.path.join(folder, name), 'rb') as f:
+                contents[os.path.join(folder, name)] = f.read()
+
+    dest = session.path.get_absolute_irods_path(tmpdir)
+    ranges = [(0, 30), (-10, None), (5, 10**6), (10**6, 10)]
+    paths = []
+    for path, buffers in session.bulk.read_ranges(tmpdir + '/data', ranges,
+                                                  recurse=True, workers=3,
+                                                  verbose=True):
+        name = os.path.relpath(path, dest)
+        paths.append(name)
+        content = contents[name]
+        expected = [content[:30], content[-10:], content[5:], b'']
+        assert buffers == expected, (name, buffers)
+
+    assert sorted(paths) == sorted(contents), paths
+
     remove_tmpdir(session, tmpdir)
     return
 
@@ -206,6 +686,189 @@ def test_find(session, tmpdir):
                 n += 1
             assert n == len(refs), '%d items are missing!' % (len(refs) - n)
 
+    # Results can be paged through with limit and offset, also when
+    # the query results come in many small pages
+    session.search.page_size = 2
+    hits = list(session.search.find('./data', types='f'))
+    assert len(hits) == 9, hits
+    pages = [list(session.search.find('./data', types='f', limit=4,
+                                      offset=offset))
+             for offset in range(0, 12, 4)]
+    assert pages[0] + pages[1] + pages[2] == hits, (pages, hits)
+    assert [len(page) for page in pages] == [4, 4, 1], pages
+
+    hits = session.search.glob('data/molecules/*', limit=3)
+    assert len(hits) == 3, hits
+    session.search.page_size = 500
+
+    # Filters on other attributes than the name
+    hits = session.search.find('./data', min_size=450, max_size=700)
+    assert sorted(hits) == ['./data/molecules/c6h6.xyz',
+                            './data/molecules/ch3cooh.xyz',
+                            './data/molecules/isobutene.xyz'], hits
+
+    hits = list(session.search.find('./data', newer=time.time() + 3600))
+    assert len(hits) == 0, hits
+    hits = list(session.search.find('./data', older=time.time() + 3600,
+                                    owner=session.username, types='d'))
+    assert sorted(hits) == ['./data', './data/molecules'], hits
+
+    hits = list(session.search.find('./data/README', min_replicas=1))
+    assert hits == ['./data/README'], hits
+
+    # Replicas are counted once, also when several AVUs match
+    from irods.meta import iRODSMeta
+    from irods.models import DataObject
+
+    for value in ['a', 'b']:
+        session.metadata.add(DataObject, session.path.get_absolute_irods_path(
+                             './data/README'), iRODSMeta('letter', value))
+    for path in ['./data/README', './data']:
+        hits = list(session.search.find(path, min_replicas=2, types='f',
+                                        object_avu=('letter',)))
+        assert len(hits) == 0, hits
+        entries = list(session.search.find(path, min_replicas=1, types='f',
+                                           object_avu=('letter',),
+                                           return_entries=True))
+        assert [entry.path for entry in entries] == ['./data/README'], entries
+        assert entries[0].replicas == 1, entries[0].replicas
+    hits = list(session.search.find('./data/README', min_size=100))
+    assert len(hits) == 0, hits
+
+    session.path.ichdir('~')
+    remove_tmpdir(session, tmpdir)
+    return
+
+
+def test_walk(session, tmpdir):
+    create_tmpdir(session, tmpdir)
+
+    session.bulk.put('data', irods_path=tmpdir, recurse=True, verbose=True)
+    session.path.ichdir(tmpdir)
+
+    # The query-based tree walk should give the same results
+    # as the recursive one
+    for mindepth in range(3):
+        for maxdepth in list(range(mindepth, 3)) + [-1]:
+            print('Checking mindepth = %d, maxdepth = %d' % (mindepth, maxdepth))
+            kwargs = dict(mindepth=mindepth, maxdepth=maxdepth, debug=True)
+            hits = [hit for hit in session.search.walk('data',
+                                                       use_queries=True,
+                                                       **kwargs)]
+            refs = [ref for ref in session.search.walk('data', **kwargs)]
+            assert hits == refs, (hits, refs)
+
+    session.path.ichdir('~')
+    remove_tmpdir(session, tmpdir)
+    return
+
+
+def test_entries(session, tmpdir):
+    create_tmpdir(session, tmpdir)
+
+    session.bulk.put('data', irods_path=tmpdir, recurse=True, verbose=True)
+    session.path.ichdir(tmpdir)
+
+    # Entries should carry the same paths as the plain search results
+    hits = session.search.glob('data/*', debug=True)
+    entries = [entry for entry in session.search.iglob('data/*',
+                                                       return_entries=True)]
+    assert [entry.path for entry in entries] == hits, (entries, hits)
+
+    for entry in entries:
+        print('Checking entry %s' % repr(entry))
+        if entry.kind == 'd':
+            assert entry.path == 'data/molecules', entry.path
+        else:
+            assert entry.kind == 'f', entry.kind
+            assert entry.replicas >= 1, entry.replicas
+            assert entry.size == os.path.getsize(entry.path), entry.size
+
+    # Bulk operations should accept entries as well
+    iterator = session.search.find('./data', types='f', return_entries=True)
+    total = sum([size for path, size in session.bulk.size(iterator)])
+    assert total == 3277, total
+
+    session.path.ichdir('~')
+    remove_tmpdir(session, tmpdir)
+    return
+
+
+def test_glob(session, tmpdir):
+    create_tmpdir(session, tmpdir)
+
+    session.bulk.put('data', irods_path=tmpdir, recurse=True, verbose=True)
+    d = tmpdir + '/data/molecules'
+
+    tests = [(d + '/c?h?.xyz', ['c6h6.xyz']),
+             (d + '/[a-c]*.xyz', ['alcl3.xyz', 'c6h6.xyz', 'ch2och2.xyz',
+                                  'ch3cooh.xyz']),
+             (d + '/[!c]*.xyz', ['alcl3.xyz', 'isobutene.xyz', 'no2.xyz',
+                                 'sih4.xyz']),
+             (d + '/*[0-9].xyz', ['alcl3.xyz', 'c6h6.xyz', 'ch2och2.xyz',
+                                  'no2.xyz', 'sih4.xyz'])]
+
+    for pattern, expected in tests:
+        hits = session.search.glob(pattern, debug=True)
+        assert sorted(hits) == [d + '/' + f for f in expected], hits
+
+    # Recursive patterns
+    hits = session.search.glob(tmpdir + '/**/*.txt', debug=True)
+    assert hits == [tmpdir + '/data/molecule_names.txt'], hits
+
+    hits = session.search.glob(tmpdir + '/**', debug=True)
+    assert len(hits) == 12, hits
+
+    # Several patterns at once, with and without wildcards
+    hits = session.search.glob(d + '/c?h?.xyz', tmpdir + '/data/README',
+                               tmpdir + '/data/missing', d, debug=True)
+    assert sorted(hits) == [tmpdir + '/data/README', d, d + '/c6h6.xyz'], hits
+
+    remove_tmpdir(session, tmpdir)
+    return
+
+
+def test_shard(session, tmpdir):
+    create_tmpdir(session, tmpdir)
+
+    session.bulk.put('data', irods_path=tmpdir, recurse=True, verbose=True)
+    session.path.ichdir(tmpdir)
+
+    # The shards should be disjoint, complete and about equally large
+    hits = sorted(session.search.find('data', types='f'))
+    shards = [list(session.search.find('data', types='f', shard=(i, 3)))
+              for i in range(3)]
+    assert sorted(sum(shards, [])) == hits, (shards, hits)
+
+    totals = [sum([os.path.getsize(path) for path in shard])
+              for shard in shards]
+    assert max(totals) - min(totals) <= 694, totals
+
+    # ... and the same for every task
+    assert shards[1] == list(session.search.find('data', types='f',
+                                                  shard=(1, 3)))
+
+    # Collections count with the size of their whole tree
+    sizes = [sum([size for path, size in session.bulk.size('data/*',
+                                                recurse=True, shard=(i, 2))])
+             for i in range(2)]
+    assert sorted(sizes) == [135, 3142], sizes
+
+    tmp = tempfile.mkdtemp()
+    session.bulk.get('data/*', local_path=tmp, recurse=True, shard=(0, 2))
+    assert os.listdir(tmp) == ['molecules'], os.listdir(tmp)
+    shutil.rmtree(tmp)
+
+    # Index and count from the environment of an array job
+    environ = dict(os.environ)
+    os.environ.update(SLURM_ARRAY_TASK_ID='7', SLURM_ARRAY_TASK_MIN='5',
+                      SLURM_ARRAY_TASK_COUNT='4')
+    assert get_shard('auto') == (2, 4)
+    assert get_shard((None, 2)) == (0, 2)
+    os.environ.clear()
+    os.environ.update(environ)
+
+    session.path.ichdir('~')
     remove_tmpdir(session, tmpdir)
     return
 
@@ -298,6 +961,34 @@ def test_metadata(session, tmpdir):
     counter = len([hit for hit in iterator])
     assert counter == 0, counter
 
+    # Recursively adding metadata replaces existing values
+    # of the same attributes
+    from irods.models import Collection
+
+    for value in ['inorganic', 'organic']:
+        session.bulk.metadata(d, object_avu=(attribute, value),
+                              collection_avu=(attribute, value),
+                              action='add', recurse=True, workers=4,
+                              verbose=True)
+
+    d_abs = session.path.get_absolute_irods_path(d)
+    metadata = session.metadata.get(Collection, d_abs)
+    assert [(m.name, m.value) for m in metadata] == [(attribute, 'organic')]
+
+    for item in session.search.find(d, '*.xyz', types='f', debug=True):
+        path = session.path.get_absolute_irods_path(item)
+        metadata = session.metadata.get(DataObject, path)
+        assert [(m.name, m.value) for m in metadata] == \
+               [(attribute, 'organic')], (item, metadata)
+
+    # Several values for the same attribute are all added
+    session.bulk.metadata(d, collection_avu=[(attribute, 'a'),
+                                             (attribute, 'b')],
+                          action='add', recurse=True, verbose=True)
+    metadata = session.metadata.get(Collection, d_abs)
+    assert sorted([(m.name, m.value) for m in metadata]) == \
+           [(attribute, 'a'), (attribute, 'b')], metadata
+
     remove_tmpdir(session, tmpdir)
     return
 
@@ -356,6 +1047,57 @@ def test_add_job_metadata(session, tmpdir):
     return
 
 
+def test_watch(session, tmpdir):
+    create_tmpdir(session, tmpdir)
+    dest = session.path.get_absolute_irods_path(tmpdir)
+
+    with tempfile.TemporaryDirectory() as tmpsrc:
+        os.mkdir(os.path.join(tmpsrc, 'sub'))
+        for name in ['a.out', 'sub/b.out', 'c.log']:
+            with open(os.path.join(tmpsrc, name), 'w') as f:
+                f.write('first\n')
+
+        os.environ['PBS_JOBID'] = 'watchjob'
+        try:
+            watcher = OutputWatcher(session, tmpsrc, tmpdir, pattern='*.out',
+                                    quiet=3600, job_metadata=True,
+                                    verbose=True)
+
+            # Files which are still being written are left alone
+            assert watcher.poll() == 0
+
+            watcher.quiet = 0
+            assert watcher.poll() == 2
+            assert session.data_objects.exists(dest + '/a.out')
+            assert session.data_objects.exists(dest + '/sub/b.out')
+            assert not session.data_objects.exists(dest + '/c.log')
+
+            obj = session.data_objects.get(dest + '/a.out')
+            assert obj.metadata.get_one('PBS_JOBID').value == 'watchjob'
+        finally:
+            del os.environ['PBS_JOBID']
+
+        # Unchanged files are not uploaded again, changed ones are
+        assert watcher.poll() == 0
+
+        with open(os.path.join(tmpsrc, 'a.out'), 'a') as f:
+            f.write('second\n')
+        watcher.quiet = 3600
+        assert watcher.poll(flush=True) == 1
+
+        with session.data_objects.open(dest + '/a.out', 'r') as f:
+            assert f.read() == b'first\nsecond\n'
+
+        # Flushing happens when stopped
+        with open(os.path.join(tmpsrc, 'sub', 'b.out'), 'a') as f:
+            f.write('second\n')
+        watcher.stop()
+        assert watcher.run(interval=1) == 1
+
+    remove_tmpdir(session, tmpdir)
+    return
+
+
 def test_size(session, tmpdir):
     create_tmpdir(session, tmpdir)
 
@@ -384,6 +1126,14 @@ def test_size(session, tmpdir):
     path, size = results[0]
     assert total == size, (total, size)
 
+    # Check the per-subcollection breakdown and the object counts
+    results = [result for result in session.bulk.size('data', recurse=True,
+                                                      max_depth=1, counts=True,
+                                                      verbose=True)]
+    assert [result[0] for result in results] == ['data/molecules', 'data'], \
+           results
+    assert results[-1][1:] == (total, 9), results
+
     remove_tmpdir(session, tmpdir)
     return
 
@@ -432,6 +1182,210 @@ def test_move(session, tmpdir):
     remove_tmpdir(session, tmpdir)
     return
 
+
+def test_copy(session, tmpdir):
+    create_tmpdir(session, tmpdir)
+
+    from irods.exception import CollectionDoesNotExist
+
+    session.bulk.put('data', irods_path=tmpdir, recurse=True, verbose=True)
+    session.path.ichdir(tmpdir)
+    size_0 = list(session.bulk.size('data', recurse=True, counts=True))
+
+    # Copy a single data object to a new name and a tree to a new collection
+    session.bulk.copy('data/README', 'data/README.copy', verbose=True)
+    hits = sorted(session.search.glob('data/README*'))
+    assert hits == ['data/README', 'data/README.copy'], hits
+
+    session.bulk.copy('data', 'copy', verbose=True)
+    assert not session.path.is_collection('copy')
+
+    session.bulk.copy('data', 'copy', recurse=True, workers=4, verbose=True)
+    size_1 = list(session.bulk.size('copy', recurse=True, counts=True))
+    assert size_1 == [('copy', size_0[0][1] + 61, 10)], (size_0, size_1)
+
+    # Copy several items into an existing collection, without overwriting
+    session.bulk.remove('copy/molecules/c*.xyz', verbose=True)
+    session.bulk.copy('data/molecules/*', 'copy/molecules', clobber=False,
+                      workers=2, verbose=True)
+    hits = session.search.glob('copy/molecules/*')
+    assert len(hits) == 7, hits
+
+    try:
+        session.bulk.copy('data/*', 'missing', verbose=True)
+    except CollectionDoesNotExist:
+        pass
+    else:
+        raise RuntimeError('Copying several items to a missing collection '
+                           'is expected to raise a CollectionDoesNotExist')
+
+    session.path.ichdir('~')
+    remove_tmpdir(session, tmpdir)
+    return
+
+
+def test_agent(session, tmpdir):
+    create_tmpdir(session, tmpdir)
+
+    # Run an agent with the current session in a separate thread
+    socket_path = os.path.join(tempfile.mkdtemp(), 'agent.sock')
+    agent = Agent(socket_path=socket_path, idle_time=None, session=session)
+    thread = threading.Thread(target=agent.serve)
+    thread.start()
+    while control('status', socket_path) is None:
+        time.sleep(0.1)
+
+    with connect(txt='-', socket_path=socket_path) as client:
+        assert isinstance(client, AgentSession)
+
+        # Log lines of concurrent workers should not get mixed up
+        client.bulk.put('data', irods_path=tmpdir, recurse=True, workers=4,
+                        verbose=True)
+
+        # Generators and tuples should be passed back as such
+        hits = list(client.search.find(tmpdir, types='f'))
+        assert hits == list(session.search.find(tmpdir, types='f')), hits
+        assert len(hits) == 9, hits
+
+        results = list(client.bulk.size(tmpdir, recurse=True, counts=True))
+        assert results == [(tmpdir, 3277, 9)], results
+
+        # Exceptions should be raised in the client
+        try:
+            client.bulk.move(tmpdir + '/data/*', tmpdir + '/missing')
+        except AgentError as e:
+            assert str(e).startswith('CollectionDoesNotExist'), e
+        else:
+            raise RuntimeError('Moving several items to a missing collection '
+                               'is expected to raise a CollectionDoesNotExist '
+                               'error')
+
+        # Changes made by other clients in between operations are seen
+        client.path.imkdir(tmpdir + '/external')
+        session.collections.remove(session.path.get_absolute_irods_path(
+                                   tmpdir + '/external'), force=True)
+        client.path.imkdir(tmpdir + '/external')
+
+    # Partial bulk failures are raised again with the agent's message
+    error = _exception('BulkOperationError', '2 item(s) failed, starting '
+                       'with getting object a: No such file')
+    assert isinstance(error, BulkOperationError), error
+    assert str(error).startswith('2 item(s) failed'), error
+    assert error.failures == [], error.failures
+
+    # Agents in directories accessible to others are not used
+    os.chmod(os.path.dirname(socket_path), 0o755)
+    assert control('status', socket_path) is None
+    os.chmod(os.path.dirname(socket_path), 0o700)
+
+    status = control('stop', socket_path)
+    thread.join()
+    assert status['served'] == 6, status
+    assert not os.path.exists(socket_path)
+
+    remove_tmpdir(session, tmpdir)
+    return
+
+
+def test_batch(session, tmpdir):
+    create_tmpdir(session, tmpdir)
+
+    lines = ['# Upload the test data first',
+             'put data irods_path=%s recurse=true verbose=true' % tmpdir,
+             'wait',
+             'size %s recurse=true counts=true' % tmpdir,
+             json.dumps({'op': 'search.find', 'args': [tmpdir],
+                         'kwargs': {'types': 'f', 'pattern': '*.xyz'}}),
+             'metadata %s/data/README object_avu=\'["kind", "text"]\'' % \
+             tmpdir,
+             'move %s/data/* %s/missing' % (tmpdir, tmpdir),
+             'unknown_operation',
+             'wait',
+             'find %s types=f object_avu=\'["kind", "text"]\'' % tmpdir]
+
+    statuses = list(run_batch(session, lines, workers=4))
+    print(statuses)
+    assert [status['line'] for status in statuses] == [2, 4, 5, 6, 7, 8, 10]
+    assert [status['status'] for status in statuses] == \
+           ['ok', 'ok', 'ok', 'ok', 'failed', 'failed', 'ok'], statuses
+
+    assert statuses[1]['result'] == [(tmpdir, 3277, 9)], statuses[1]
+    assert len(statuses[2]['result']) == 7, statuses[2]
+    assert statuses[6]['result'] == [tmpdir + '/data/README'], statuses[6]
+
+    # Nothing after a 'wait' line should be run after a failure
+    lines = ['move %s/data/* %s/missing' % (tmpdir, tmpdir), 'wait',
+             'remove %s/data recurse=true' % tmpdir]
+    statuses = list(run_batch(session, lines, stop_on_error=True))
+    assert len(statuses) == 1 and statuses[0]['status'] == 'failed'
+
+    # Values of string arguments are not decoded as JSON
+    operation = parse_operation('find 2024 pattern=2024 owner=2024 '
+                                'min_size=10 maxdepth=2 limit:=5')
+    assert operation.args == ['2024'], operation.args
+    assert operation.kwargs == {'pattern': '2024', 'owner': '2024',
+                                'min_size': 10, 'maxdepth': 2,
+                                'limit': 5}, operation.kwargs
+
+    # A change of the working collection is not run concurrently
+    cwd = session.path.get_irods_cwd()
+    lines = ['imkdir %s/2024' % tmpdir, 'ichdir %s/2024' % tmpdir,
+             'imkdir sub', 'wait', 'find . pattern=sub types=d']
+    statuses = list(run_batch(session, lines, workers=4))
+    session.path.ichdir(cwd)
+    assert [status['status'] for status in statuses] == ['ok'] * 4, statuses
+    assert len(statuses[3]['result']) == 1, statuses[3]
+    assert statuses[3]['result'][0].endswith('/sub'), statuses[3]
+
+    remove_tmpdir(session, tmpdir)
+    return
+
+def test_lookups(session, tmpdir):
+    create_tmpdir(session, tmpdir)
+
+    # The cache on its own
+    lookups = LookupCache(ttl=0.5, max_size=2)
+    assert lookups.get('/a', 'd') is None
+    lookups.set('/a', 'd', True)
+    assert lookups.get('/a', 'd') and lookups.get('/a', 'f') is False
+    lookups.set('/a/b', 'f', True)
+    lookups.set('/c', 'd', False)
+    assert len(lookups) == 2 and lookups.get('/a', 'd') is None
+    lookups.invalidate('/a', recurse=True)
+    assert lookups.get('/a/b', 'f') is None
+    time.sleep(0.6)
+    assert lookups.get('/c', 'd') is None
+    assert lookups.stats() == {'hits': 2, 'misses': 4, 'size': 0}
+
+    # Repeated lookups of the destination do not need the server
+    path = session.path.get_absolute_irods_path(tmpdir)
+    for i in range(3):
+        session.bulk.put('data/README', irods_path=tmpdir, verbose=True)
+    hits = session.lookups.hits
+    assert session.path.is_collection(tmpdir)
+    assert session.path.is_data_object(tmpdir + '/README')
+    assert session.lookups.hits == hits + 2, session.lookups.stats()
+
+    # Listings fill the cache, and the session's own changes invalidate it
+    session.bulk.put('data', irods_path=tmpdir, recurse=True)
+    session.search.find(tmpdir + '/data')
+    hits = session.lookups.hits
+    assert session.path.is_data_object(tmpdir + '/data/molecules/c6h6.xyz')
+    assert session.lookups.hits == hits + 1, session.lookups.stats()
+
+    session.bulk.move(tmpdir + '/data/molecules', tmpdir + '/mol')
+    assert not session.path.is_collection(tmpdir + '/data/molecules')
+    assert not session.path.is_data_object(tmpdir + '/data/molecules/c6h6.xyz')
+    assert session.path.is_data_object(tmpdir + '/mol/c6h6.xyz')
+
+    session.bulk.remove(tmpdir + '/README')
+    assert not session.path.is_data_object(path + '/README')
+
+    remove_tmpdir(session, tmpdir)
+    assert not session.path.is_collection(path)
+    return
+
+
 def test_case_sensitivity(session, tmpdir):
     # Checks whether avus retain their capital letters when added
     # Assumes the iCAT database is case-sensitive.
@@ -473,9 +1427,26 @@ if __name__ == '__main__':
         test_put(session, tmpdir)
         test_remove(session, tmpdir)
         test_get(session, tmpdir)
+        test_sync(session, tmpdir)
+        test_resume(session, tmpdir)
+        test_cache(session, tmpdir)
+        test_bundle(session, tmpdir)
+        test_stage(session, tmpdir)
+        test_iter_open(session, tmpdir)
+        test_get_buffers(session, tmpdir)
+        test_read_ranges(session, tmpdir)
         test_find(session, tmpdir)
+        test_walk(session, tmpdir)
+        test_entries(session, tmpdir)
+        test_glob(session, tmpdir)
+        test_shard(session, tmpdir)
         test_metadata(session, tmpdir)
         test_add_job_metadata(session, tmpdir)
+        test_watch(session, tmpdir)
         test_size(session, tmpdir)
         test_move(session, tmpdir)
+        test_copy(session, tmpdir)
+        test_agent(session, tmpdir)
+        test_batch(session, tmpdir)
+        test_lookups(session, tmpdir)
         test_case_sensitivity(session, tmpdir)
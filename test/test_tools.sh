@@ -13,6 +13,7 @@ icd $tmpdir
 # Copy content to iRODS
 echo "TEST: vsc-prc-iput"
 vsc-prc-iput -r ../test/data* -d $irods_path --verbose
+vsc-prc-iput -r ../test/data* -d $irods_path --workers=4 --no-clobber
 echo "iRODS tmpdir content:"
 ils -r .
 
@@ -23,20 +24,81 @@ vsc-prc-imv $irods_path"/data/newname/*.xyz" $irods_path"/data/" --verbose
 vsc-prc-imv $irods_path"/data/newname" $irods_path"/data/molecules" --verbose
 vsc-prc-imv $irods_path"/data/*.xyz" $irods_path"/data/molecules" --verbose
 
+# Copy on the server
+echo "TEST: vsc-prc-icp"
+vsc-prc-icp -r $irods_path"/data/molecules" $irods_path"/data/copy" --workers=2 --verbose
+vsc-prc-icp $irods_path"/data/molecules/*.xyz" $irods_path"/data/copy" -n --verbose
+vsc-prc-irm -r $irods_path"/data/copy" --verbose
+
 # Get disk usage
 echo "TEST: vsc-prc-size"
 vsc-prc-size $irods_path -r -H --verbose
+vsc-prc-size $irods_path -r --max-depth=-1 --count --verbose
 
 # Fetch content to local directory
 echo "TEST: vsc-prc-iget"
 local_tmpdir=`mktemp -d`
 echo "Local tmpdir path: "$local_tmpdir
 vsc-prc-iget -r $irods_path"/data/molecules/" -d $local_tmpdir --verbose
+vsc-prc-iget -r $irods_path"/data/molecules/" -d $local_tmpdir --workers=4 \
+             --verbose
+vsc-prc-iget -r $irods_path"/data/molecules/" -d $local_tmpdir --streams=2 \
+             --large-threshold=0 --verbose
+vsc-prc-iget -r $irods_path"/data/molecules/" -d $local_tmpdir \
+             --journal=$local_tmpdir/journal --streams=2 --large-threshold=0
+vsc-prc-iget -r $irods_path"/data/molecules/" -d $local_tmpdir \
+             --journal=$local_tmpdir/journal --resume --verbose
+vsc-prc-iget -r $irods_path"/data/molecules/" -d $local_tmpdir \
+             --cache=$local_tmpdir/cache --cache-size=100000 --verbose
+vsc-prc-iget -r $irods_path"/data/molecules/" -d $local_tmpdir \
+             --cache=$local_tmpdir/cache --cache-size=100000 --verbose
+vsc-prc-imkdir $irods_path"/bundled"
+vsc-prc-iput -r ../test/data/molecules -d $irods_path"/bundled" \
+             --bundle-size=4096 --verbose
+mkdir $local_tmpdir/bundled
+vsc-prc-iget -r $irods_path"/bundled/molecules" -d $local_tmpdir/bundled \
+             --verbose
+vsc-prc-irm -r $irods_path"/bundled" --verbose
+vsc-prc-imkdir $irods_path"/sharded"
+for shard in 0 1 2; do
+    # Shell-expanded arguments are split over the shards together
+    vsc-prc-iput ../test/data/molecules/*.xyz -d $irods_path"/sharded" \
+                 --nshards=3 --shard=$shard --verbose
+    vsc-prc-iget $irods_path"/sharded/*.xyz" -d $local_tmpdir \
+                 --nshards=3 --shard=$shard --verbose
+done
+vsc-prc-irm -r $irods_path"/sharded" --verbose
+echo "TEST: vsc-prc-isync"
+vsc-prc-isync -r "i:"$irods_path"/data/molecules/" $local_tmpdir --verbose
+vsc-prc-isync -r ../test/data* "i:"$irods_path --checksum --verbose
 echo "Local tmpdir content: "
 find $local_tmpdir
 echo "Removing local tmpdir "$local_tmpdir
 rm -r $local_tmpdir
 
+# Write content to the standard output
+echo "TEST: vsc-prc-cat"
+vsc-prc-cat $irods_path"/data/molecules/*.xyz" --prefetch=4 | wc -l
+vsc-prc-cat -r $irods_path"/data/molecules" --read-ahead=100 --verbose \
+            > /dev/null
+
+# Preview the first and last bytes of data objects
+echo "TEST: vsc-prc-head"
+vsc-prc-head $irods_path"/data/molecules/*.xyz" -n 2 --workers=4
+vsc-prc-head -r $irods_path"/data/molecules" --bytes=20 --offset=-20 --quiet \
+             --verbose
+
+# Stage in content in the background
+echo "TEST: vsc-prc-stage"
+local_tmpdir=`mktemp -d`
+vsc-prc-stage $irods_path"/data/molecules/c6h6.xyz" \
+              $irods_path"/data/molecules/*.xyz" -d $local_tmpdir --verbose
+vsc-prc-stage --wait c6h6.xyz no2.xyz -d $local_tmpdir --timeout=60
+vsc-prc-stage --join -d $local_tmpdir --timeout=60
+vsc-prc-stage --status -d $local_tmpdir
+ls $local_tmpdir
+rm -r $local_tmpdir
+
 # Add metadata to certain files
 echo "TEST: vsc-prc-imeta (add)"
 vsc-prc-imeta $irods_path"/data/molec*/c*.xyz" --object_avu=Kind,organic \
@@ -52,6 +114,20 @@ echo "TEST: vsc-prc-imeta (remove)"
 vsc-prc-imeta $irods_path"/data/molec*/c*.xyz" --object_avu=Kind,organic \
            --action=remove --verbose
 
+# Upload files while they are being written
+echo "TEST: vsc-prc-watch-put"
+local_tmpdir=`mktemp -d`
+cp ../test/data/molecules/*.xyz $local_tmpdir
+vsc-prc-watch-put $local_tmpdir -d $irods_path"/data" --name="c*.xyz" \
+                  --job-metadata --once --verbose
+vsc-prc-watch-put $local_tmpdir -d $irods_path"/data" --quiet=0 \
+                  --interval=1 --verbose &
+watch_pid=$!
+sleep 3
+kill $watch_pid
+wait $watch_pid
+rm -r $local_tmpdir
+
 # Add dummy job metadata
 echo "TEST: vsc-prc-add-job-metadata"
 export PBS_JOBID=666
@@ -63,6 +139,19 @@ echo r678910 >> $PBS_NODEFILE
 vsc-prc-add-job-metadata $irods_path"/data/README" --recurse --verbose
 rm $PBS_NODEFILE
 
+# Run some commands through an agent
+echo "TEST: vsc-prc-agent"
+vsc-prc-agent --daemon --idle-time=60
+vsc-prc-agent --status
+vsc-prc-find $irods_path"/data" -n "*.xyz"
+vsc-prc-size $irods_path -r --count --verbose
+vsc-prc-agent --stop
+
+# Run several operations within one session
+echo "TEST: vsc-prc-batch"
+printf 'size %s recurse=true counts=true\nfind %s pattern=*.xyz\n' \
+       $irods_path $irods_path"/data" | vsc-prc-batch --workers=2
+
 # Remove all the uploaded content
 echo "TEST: vsc-prc-irm"
 vsc-prc-irm -r $irods_path"/data/" --verbose